@@ -17,6 +17,10 @@ app_settings: Dict[str, Any] = {
     "static": {},
     "jsapps": {},
     "default_static_filenames": ['index.html', 'index.htm'],
+    "static_cache": {
+        "max_file_size": 1024 * 64,
+        "max_size": 1024 * 1024 * 10
+    },
     "load_utilities": {
         "guillotina.queue": {
             "provides": "guillotina.interfaces.IQueueUtility",
@@ -32,6 +36,22 @@ app_settings: Dict[str, Any] = {
         }
     },
     "store_json": True,
+    "ghost_objects": False,
+    "state_codec": {
+        "compression": "zlib",
+        "compress_threshold": 65536
+    },
+    "blob_read_ahead": 1024 * 1024 * 10,
+    "upload_read_ahead": 1024 * 1024 * 10,
+    "blob_gc": {
+        "max_age": 60 * 60 * 24,
+        "batch_size": 100,
+        "pause": 0.1
+    },
+    "local_file_storage": {
+        "path": "files",
+        "max_age": 60 * 60 * 24
+    },
     "root_user": {
         "password": ""
     },
@@ -66,7 +86,9 @@ app_settings: Dict[str, Any] = {
         'shell': 'guillotina.commands.shell.ShellCommand',
         'testdata': 'guillotina.commands.testdata.TestDataCommand',
         'initialize-db': 'guillotina.commands.initialize_db.DatabaseInitializationCommand',
-        'run': 'guillotina.commands.run.RunCommand'
+        'run': 'guillotina.commands.run.RunCommand',
+        'vacuum-local-files': 'guillotina.commands.vacuum_local_files.VacuumLocalFilesCommand',
+        'vacuum-blobs': 'guillotina.commands.vacuum_blobs.VacuumBlobsCommand'
     },
     "json_schema_definitions": {},  # json schemas available to reference in docs
     "default_layer": interfaces.IDefaultLayer,
@@ -85,6 +107,7 @@ app_settings: Dict[str, Any] = {
     "pg_connection_class": "asyncpg.connection.Connection",
     "oid_generator": generate_oid,
     "cors_renderer": "guillotina.cors.DefaultCorsRenderer",
+    "json_dumps": "guillotina.renderers.json_dumps",
     "check_writable_request": "guillotina.writable.check_writable_request"
 }
 default_settings = copy.deepcopy(app_settings)
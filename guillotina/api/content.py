@@ -18,12 +18,14 @@ from guillotina.events import BeforeObjectMovedEvent
 from guillotina.events import BeforeObjectRemovedEvent
 from guillotina.events import ObjectAddedEvent
 from guillotina.events import ObjectDuplicatedEvent
+from guillotina.events import ObjectLoadedEvent
 from guillotina.events import ObjectModifiedEvent
 from guillotina.events import ObjectMovedEvent
 from guillotina.events import ObjectPermissionsViewEvent
 from guillotina.events import ObjectRemovedEvent
 from guillotina.events import ObjectVisitedEvent
 from guillotina.exceptions import PreconditionFailed
+from guillotina.files.dbfile import copy_blobs
 from guillotina.i18n import default_message_factory as _
 from guillotina.interfaces import IAbsoluteURL
 from guillotina.interfaces import IAnnotations
@@ -43,6 +45,7 @@ from guillotina.interfaces import IResourceSerializeToJson
 from guillotina.interfaces import IResourceSerializeToJsonSummary
 from guillotina.interfaces import IResponse
 from guillotina.interfaces import IRolePermissionMap
+from guillotina.json.serialize_content import serialize_summary
 from guillotina.json.utils import convert_interfaces_to_schema
 from guillotina.profile import profilable
 from guillotina.response import ErrorResponse
@@ -706,13 +709,14 @@ async def duplicate(context, request):
     new_obj = await create_content_in_container(
         destination_ob, context.type_name, new_id, id=new_id,
         creators=context.creators, contributors=context.contributors)
+    txn = get_transaction(request)
 
     for key in context.__dict__.keys():
         if key.startswith('__') or key.startswith('_BaseObject'):
             continue
         if key in ('id',):
             continue
-        new_obj.__dict__[key] = context.__dict__[key]
+        new_obj.__dict__[key] = await copy_blobs(context.__dict__[key], new_obj, txn)
     new_obj.__acl__ = context.__acl__
     for behavior in context.__behaviors__:
         new_obj.add_behavior(behavior)
@@ -724,7 +728,7 @@ async def duplicate(context, request):
     for anno_id, anno_data in context.__gannotations__.items():
         new_anno_data = AnnotationData()
         for key, value in anno_data.items():
-            new_anno_data[key] = value
+            new_anno_data[key] = await copy_blobs(value, new_obj, txn)
         await annotations_container.async_set(anno_id, new_anno_data)
 
     data['id'] = new_id
@@ -745,7 +749,36 @@ async def duplicate(context, request):
         }
     })
 async def ids(context, request):
-    return await context.async_keys()
+    # streamed page by page instead of loading every key
+    return get_transaction(request).iterate_keys(context._p_oid)
+
+
+# number of children loaded with one query while @items is streamed
+ITEMS_BATCH_SIZE = 50
+
+
+async def _iter_items(context, request, keys, summary, include, omit):
+    for idx in range(0, len(keys), ITEMS_BATCH_SIZE):
+        batch = keys[idx:idx + ITEMS_BATCH_SIZE]
+        obs = {}
+        # summaries only need the metadata of the objects
+        async for ob in context.async_multi_get(batch, metadata_only=summary):
+            obs[ob.__name__] = ob
+        for key in batch:
+            if key not in obs:
+                continue
+            ob = obs.pop(key)
+            if summary:
+                yield await serialize_summary(context, ob, request)
+                continue
+            await notify(ObjectLoadedEvent(ob))
+            serializer = get_multi_adapter(
+                (ob, request),
+                IResourceSerializeToJson)
+            try:
+                yield await serializer(include=include, omit=omit)
+            except TypeError:
+                yield await serializer()
 
 
 @configure.service(
@@ -770,6 +803,11 @@ async def ids(context, request):
         "in": "query",
         "type": "number",
         "default": 1
+    }, {
+        "name": "summary",
+        "in": "query",
+        "type": "boolean",
+        "default": False
     }],
     responses={
         "200": {
@@ -795,17 +833,9 @@ async def items(context, request):
     if request.query.get('omit'):
         omit = request.query.get('omit').split(',')
 
-    results = []
-    for key in await txn.get_page_of_keys(context._p_oid, page=page, page_size=page_size):
-        ob = await context.async_get(key)
-        serializer = get_multi_adapter(
-            (ob, request),
-            IResourceSerializeToJson)
-        try:
-            results.append(await serializer(include=include, omit=omit))
-        except TypeError:
-            results.append(await serializer())
-
+    keys = await txn.get_page_of_keys(context._p_oid, page=page, page_size=page_size)
+    summary = request.query.get('summary') in ('true', '1')
+    results = _iter_items(context, request, keys, summary, include, omit)
     return {
         'items': results,
         'total': await context.async_len(),
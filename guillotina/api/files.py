@@ -1,4 +1,8 @@
+import hashlib
 import mimetypes
+import os
+from collections import OrderedDict
+from email.utils import formatdate
 
 from aiohttp.web import StreamResponse
 from guillotina import configure
@@ -7,12 +11,15 @@ from guillotina.api.content import DefaultOPTIONS
 from guillotina.api.service import DownloadService
 from guillotina.api.service import TraversableFieldService
 from guillotina.component import get_multi_adapter
+from guillotina.files.manager import SendfileResponse
 from guillotina.interfaces import IAsyncBehavior
 from guillotina.interfaces import IFileManager
 from guillotina.interfaces import IResource
 from guillotina.interfaces import IStaticDirectory
 from guillotina.interfaces import IStaticFile
 from guillotina.response import HTTPNotFound
+from guillotina.response import HTTPNotModified
+from guillotina.utils import run_async
 
 
 def _traversed_file_doc(summary, parameters=[], responses={
@@ -37,29 +44,149 @@ def _traversed_file_doc(summary, parameters=[], responses={
 
 
 # Static File
+PRECOMPRESSED_EXTENSIONS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def get_accepted_encodings(header):
+    '''
+    Content codings of an Accept-Encoding header, without the ones refused
+    with a zero quality
+    '''
+    encodings = set()
+    for value in header.split(','):
+        encoding, *params = [part.strip() for part in value.split(';')]
+        try:
+            quality = float(dict(param.split('=', 1) for param in params if '=' in param)
+                            .get('q', 1))
+        except ValueError:
+            quality = 1
+        if quality > 0:
+            encodings.add(encoding.lower())
+    return encodings
+
+
+def get_static_file_variant(filepath, accept_encoding=''):
+    '''
+    Path, content encoding and stat of the precompressed sibling of a file
+    the client accepts, of the file itself if there is none
+    '''
+    encodings = get_accepted_encodings(accept_encoding)
+    for encoding, extension in PRECOMPRESSED_EXTENSIONS:
+        if encoding in encodings:
+            try:
+                return filepath + extension, encoding, os.stat(filepath + extension)
+            except FileNotFoundError:
+                pass
+    return filepath, None, os.stat(filepath)
+
+
+def _read(filepath):
+    with open(filepath, 'rb') as fi:
+        return fi.read()
+
+
+class StaticFileCache:
+    '''
+    Contents of small static files and their etag, by the stat of the file
+    they were read after. The least recently used ones are dropped once they
+    take more than the `static_cache` max size
+    '''
+
+    def __init__(self):
+        self._data = OrderedDict()
+        self._size = 0
+
+    def get(self, filepath, key):
+        try:
+            cached_key, data, etag = self._data[filepath]
+        except KeyError:
+            return None
+        if cached_key != key:
+            return None
+        self._data.move_to_end(filepath)
+        return data, etag
+
+    def set(self, filepath, key, data, etag):
+        if filepath in self._data:
+            self._size -= len(self._data.pop(filepath)[1])
+        self._data[filepath] = (key, data, etag)
+        self._size += len(data)
+        while self._size > app_settings['static_cache']['max_size']:
+            _, (_, dropped, _) = self._data.popitem(last=False)
+            self._size -= len(dropped)
+
+    def clear(self):
+        self._data.clear()
+        self._size = 0
+
+
+static_file_cache = StaticFileCache()
+
+
 @configure.service(
     context=IStaticFile, method='GET', permission='guillotina.AccessContent')
 class FileGET(DownloadService):
-    async def serve_file(self, fi):
-        filepath = str(fi.file_path.absolute())
-        filename = fi.file_path.name
-        with open(filepath, 'rb') as f:
-            resp = StreamResponse()
-            resp.content_type, _ = mimetypes.guess_type(filename)
-
-            disposition = 'filename="{}"'.format(filename)
-            if 'text' not in resp.content_type:
-                disposition = 'attachment; ' + disposition
 
-            resp.headers['CONTENT-DISPOSITION'] = disposition
-
-            data = f.read()
-            resp.content_length = len(data)
-            await resp.prepare(self.request)
+    def not_modified(self, etag, mtime):
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags or f'W/{etag}' in tags
+        modified_since = self.request.if_modified_since
+        return modified_since is not None and int(mtime) <= modified_since.timestamp()
 
+    async def serve_file(self, fi):
+        filename = fi.file_path.name
+        filepath, encoding, stat = await run_async(
+            get_static_file_variant, str(fi.file_path.absolute()),
+            self.request.headers.get('Accept-Encoding', ''))
+        suffix = f'-{encoding}' if encoding else ''
+        key = '"{:x}-{:x}{}"'.format(stat.st_mtime_ns, stat.st_size, suffix)
+        data = etag = None
+        cached = static_file_cache.get(filepath, key)
+        if cached is not None:
+            data, etag = cached
+        elif stat.st_size <= app_settings['static_cache']['max_file_size']:
+            data = await run_async(_read, filepath)
+            # the file can change between the stat and the read
+            etag = '"{}{}"'.format(hashlib.md5(data).hexdigest(), suffix)
+            static_file_cache.set(filepath, key, data, etag)
+        if data is None:
+            etag = key
+            size = stat.st_size
+        else:
+            size = len(data)
+
+        headers = {
+            'ETag': etag,
+            'Last-Modified': formatdate(stat.st_mtime, usegmt=True),
+            'Vary': 'Accept-Encoding'
+        }
+        if self.not_modified(etag, stat.st_mtime):
+            return HTTPNotModified(headers=headers)
+        if encoding is not None:
+            headers['Content-Encoding'] = encoding
+
+        if data is None:
+            # the data is sent when the response is prepared
+            resp = SendfileResponse(filepath, 0, size, headers=headers)
+        else:
+            resp = StreamResponse(headers=headers)
+        content_type, _ = mimetypes.guess_type(filename)
+        resp.content_type = content_type or 'application/octet-stream'
+
+        disposition = 'filename="{}"'.format(filename)
+        if 'text' not in resp.content_type:
+            disposition = 'attachment; ' + disposition
+
+        resp.headers['CONTENT-DISPOSITION'] = disposition
+        resp.content_length = size
+        await resp.prepare(self.request)
+
+        if data is not None:
             await resp.write(data)
-            await resp.write_eof()
-            return resp
+        await resp.write_eof()
+        return resp
 
     async def __call__(self):
         if hasattr(self.context, 'file_path'):
@@ -13,6 +13,7 @@ from guillotina.interfaces import IAioHTTPResponse
 from guillotina.interfaces import IContainer
 from guillotina.interfaces import IInteraction
 from guillotina.interfaces import IPermission
+from guillotina.renderers import collect_streamed
 from guillotina.security.utils import get_view_permission
 from guillotina.transactions import get_tm
 
@@ -146,6 +147,8 @@ class WebsocketsView(Service):
             raise Exception('Do not accept raw aiohttp exceptions in ws')
         else:
             from guillotina.traversal import apply_rendering
+            # frames are sent whole
+            view_result = await collect_streamed(view_result)
             resp = await apply_rendering(view, self.request, view_result)
 
         # Return the value, body is always encoded
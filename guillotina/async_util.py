@@ -2,68 +2,166 @@ from datetime import datetime
 from dateutil.tz import tzutc
 from guillotina import logger
 from guillotina.browser import View
+from guillotina.db.interfaces import IPostgresStorage
+from guillotina.db.storages.utils import SQLStatements
+from guillotina.db.storages.utils import register_sql
 from guillotina.db.transaction import Status
+from guillotina.exceptions import JobPoolFullException
 from guillotina.exceptions import ServerClosingException
 from guillotina.interfaces import IAsyncJobPool  # noqa
 from guillotina.interfaces import IAsyncUtility  # noqa
+from guillotina.interfaces import IDatabase
 from guillotina.interfaces import IQueueUtility  # noqa
 from guillotina.transactions import get_tm
 from guillotina.transactions import get_transaction
 from guillotina.transactions import managed_transaction
+from guillotina.utils import get_dotted_name
+from guillotina.utils import get_object_by_oid
+from guillotina.utils import resolve_dotted_name
 
 import aiotask_context
 import asyncio
+import asyncpg
+import heapq
+import json
+import time
 import typing
+import zlib
 
 
 _zone = tzutc()
 
 
 class QueueUtility(object):
+    '''
+    Run views in the background.
+
+    Views are processed by `workers` concurrent consumers, each in its own
+    transaction. Views with the same queue key (by default, the oid of the
+    view context) are always handled by the same consumer so they run in the
+    order they were added. Views can define a `queue_key` attribute to
+    customize this.
+    '''
 
     def __init__(self, settings=None, loop=None):
-        self._queue = None
+        settings = settings or {}
+        self._queues = []
         self._loop = loop
+        self._workers = settings.get('workers', 1)
+        self._max_origin_wait = settings.get('max_origin_wait', 30.0)
         self._exceptions = False
         self._total_queued = 0
+        self._next_worker = 0
+        self._processing = 0
+        self._processed = 0
+        self._errored = 0
+        self._latency = 0.0
+        self._run_time = 0.0
+
+    @property
+    def queues(self):
+        if len(self._queues) == 0:
+            self._queues = [asyncio.Queue(loop=self._loop)
+                            for _ in range(self._workers)]
+        return self._queues
 
     @property
     def queue(self):
-        if self._queue is None:
-            self._queue = asyncio.Queue(loop=self._loop)
-        return self._queue
+        return self.queues[0]
+
+    @property
+    def _queue(self):
+        return self.queue
 
     async def initialize(self, app=None):
         # loop
         self.app = app
+        workers = [asyncio.ensure_future(self._consume(queue), loop=self._loop)
+                   for queue in self.queues]
+        try:
+            await asyncio.wait(workers, loop=self._loop)
+        finally:
+            for worker in workers:
+                worker.cancel()
+
+    def _watch_origin(self, request):
+        '''
+        Event set once the transaction of the request queueing a view is
+        finished
+        '''
+        event = asyncio.Event(loop=self._loop)
+        txn = getattr(request, '_txn', None)
+        if txn is None or txn.status in (
+                Status.ABORTED, Status.COMMITTED, Status.CONFLICT):
+            event.set()
+            return event
+        txn.add_after_commit_hook(self._origin_finished, args=[event])
+        # requests that abort their transaction only run their futures
+        name = f'queue-origin-{id(event)}'
+        for scope in ('', 'failure'):
+            request.add_future(name, self._origin_finished, scope=scope,
+                               args=[False, event])
+        return event
+
+    async def _origin_finished(self, status, event):
+        event.set()
+
+    def _get_request(self, request):
+        # a new request with the state of the one that queued the view and
+        # no transaction, the view gets its own
+        new_request = request.clone()
+        for name, value in request.__dict__.items():
+            if name not in new_request.__dict__:
+                new_request.__dict__[name] = value
+        new_request.matchdict = request.matchdict
+        new_request._txn = None
+        new_request._futures = {}
+        return new_request
+
+    async def _run_view(self, view):
+        start = time.time()
+        origin_done = getattr(view, '_origin_done', None)
+        if origin_done is not None and not origin_done.is_set():
+            try:
+                await asyncio.wait_for(
+                    origin_done.wait(), self._max_origin_wait, loop=self._loop)
+            except asyncio.TimeoutError:
+                logger.warning(
+                    f'Transaction that queued {view} not finished after '
+                    f'{self._max_origin_wait} seconds, running it anyway')
+        view.request = request = self._get_request(view.request)
+        tm = get_tm(request)
+        txn = await tm.begin(request)
+        try:
+            context = getattr(view, 'context', None)
+            if getattr(context, '_p_jar', None) is not None:
+                # the object belongs to the transaction that queued the
+                # view, load it again in ours
+                view.context = await get_object_by_oid(context._p_oid, txn)
+                if view.context is None:
+                    raise KeyError(f'Object {context._p_oid} does not exist')
+            aiotask_context.set('request', request)
+            await view()
+            await tm.commit(txn=txn)
+            self._processed += 1
+        except Exception as e:
+            self._errored += 1
+            logger.error(
+                "Exception on writing execution",
+                exc_info=e)
+            await tm.abort(txn=txn)
+        finally:
+            self._run_time += time.time() - start
+            self._latency += time.time() - getattr(view, '_queued', start)
+
+    async def _consume(self, queue):
         while True:
             got_obj = False
             try:
-                view = await self.queue.get()
+                view = await queue.get()
                 got_obj = True
-                txn = get_transaction(view.request)
-                tm = get_tm(view.request)
-                if txn is None or (txn.status in (
-                        Status.ABORTED, Status.COMMITTED, Status.CONFLICT) and
-                        txn._db_conn is None):
-                    txn = await tm.begin(view.request)
-                else:
-                    # still finishing current transaction, this connection
-                    # will be cut off, so we need to wait until we no longer
-                    # have an active transaction on the reqeust...
-                    await self.add(view)
-                    await asyncio.sleep(1)
-                    continue
-
-                try:
-                    aiotask_context.set('request', view.request)
-                    await view()
-                    await tm.commit(txn=txn)
-                except Exception as e:
-                    logger.error(
-                        "Exception on writing execution",
-                        exc_info=e)
-                    await tm.abort(txn=txn)
+                self._processing += 1
+                await self._run_view(view)
             except (RuntimeError, SystemExit, GeneratorExit, KeyboardInterrupt,
                     asyncio.CancelledError, KeyboardInterrupt):
                 # dive, these errors mean we're exit(ing)
@@ -78,11 +176,12 @@ class QueueUtility(object):
                 except (RuntimeError, ValueError):
                     pass
                 if got_obj:
+                    self._processing -= 1
                     try:
                         view.request.execute_futures()
                     except AttributeError:
                         pass
-                    self.queue.task_done()
+                    queue.task_done()
 
     @property
     def exceptions(self):
@@ -92,10 +191,45 @@ class QueueUtility(object):
     def total_queued(self):
         return self._total_queued
 
+    @property
+    def num_queued(self):
+        return sum([queue.qsize() for queue in self.queues])
+
+    def get_metrics(self):
+        done = self._processed + self._errored
+        return {
+            'queued': self.num_queued,
+            'processing': self._processing,
+            'processed': self._processed,
+            'errored': self._errored,
+            'avg_latency': self._latency / done if done else 0.0,
+            'avg_run_time': self._run_time / done if done else 0.0
+        }
+
+    def get_queue_key(self, view):
+        key = getattr(view, 'queue_key', None)
+        if key is None:
+            key = getattr(getattr(view, 'context', None), '_p_oid', None)
+        return key
+
+    def _get_queue(self, view):
+        key = self.get_queue_key(view)
+        if key is None:
+            # no ordering required, spread the work
+            self._next_worker = (self._next_worker + 1) % len(self.queues)
+            return self.queues[self._next_worker]
+        return self.queues[zlib.crc32(str(key).encode('utf-8')) % len(self.queues)]
+
     async def add(self, view):
-        await self.queue.put(view)
+        view._queued = time.time()
+        view._origin_done = self._watch_origin(getattr(view, 'request', None))
+        await self._get_queue(view).put(view)
         self._total_queued += 1
-        return self.queue.qsize()
+        return self.num_queued
+
+    async def join(self):
+        for queue in self.queues:
+            await queue.join()
 
     async def finalize(self, app):
         pass
@@ -116,11 +250,16 @@ class QueueObject(View):
 class Job:
 
     def __init__(self, func: typing.Callable[[], typing.Coroutine],
-                 request=None, args=None, kwargs=None) -> None:
+                 request=None, args=None, kwargs=None, kind='default',
+                 priority=0, dedup_key=None) -> None:
         self._func = func
         self._request = request
         self._args = args
         self._kwargs = kwargs
+        self.kind = kind
+        self.priority = priority
+        self.dedup_key = dedup_key
+        self.queued = time.time()
 
     @property
     def func(self):
@@ -141,13 +280,61 @@ class Job:
             aiotask_context.set('request', None)
 
 
+class JobClass:
+    '''
+    Named kind of job with its own concurrency limit, priority and metrics
+    '''
+
+    def __init__(self, name, max_size=5, priority=0):
+        self.name = name
+        self.max_size = max_size
+        self.priority = priority
+        # heap of (-priority, sequence, job)
+        self.pending = []
+        self.running = 0
+        self.finished = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self.run_time = 0.0
+
+    def get_metrics(self):
+        done = self.finished + self.failed
+        return {
+            'queued': len(self.pending),
+            'running': self.running,
+            'finished': self.finished,
+            'failed': self.failed,
+            'avg_wait_time': self.wait_time / done if done else 0.0,
+            'avg_run_time': self.run_time / done if done else 0.0
+        }
+
+
 class AsyncJobPool:
+    '''
+    Run jobs in the background with a limited concurrency.
+
+    Jobs can be given a `kind` that is configured in the `job_classes`
+    setting with its own `max_size` and `priority`. Pending jobs of higher
+    priority are started first and a kind never runs more jobs at once than
+    its `max_size`. Jobs with the same `dedup_key` are only queued once.
+    '''
 
     def __init__(self, settings={'max_size': 5}, loop=None):
         self._loop = None
         self._running = []
-        self._pending = []
         self._max_size = settings['max_size']
+        self._max_pending = settings.get('max_pending', 10000)
+        self._max_pending_wait = settings.get('max_pending_wait', 10.0)
+        self._classes = {}
+        for name, config in settings.get('job_classes', {}).items():
+            self._classes[name] = JobClass(
+                name, max_size=config.get('max_size', self._max_size),
+                priority=config.get('priority', 0))
+        self._dedup = {}
+        self._sequence = 0
+        self._num_pending = 0
+        self._idle = None
+        self._space = None
         self._closing = False
 
     def get_loop(self):
@@ -157,12 +344,21 @@ class AsyncJobPool:
 
     @property
     def num_pending(self):
-        return len(self._pending)
+        return self._num_pending
 
     @property
     def num_running(self):
         return len(self._running)
 
+    def get_job_class(self, kind):
+        if kind not in self._classes:
+            self._classes[kind] = JobClass(kind, max_size=self._max_size)
+        return self._classes[kind]
+
+    def get_metrics(self):
+        return {name: job_class.get_metrics()
+                for name, job_class in self._classes.items()}
+
     async def initialize(self, app=None):
         pass
 
@@ -170,45 +366,465 @@ class AsyncJobPool:
         await self.join()
 
     def add_job(self, func: typing.Callable[[], typing.Coroutine],
-                request=None, args=None, kwargs=None):
+                request=None, args=None, kwargs=None, kind='default',
+                priority=None, dedup_key=None):
         if self._closing:
             raise ServerClosingException('Can not schedule job')
-        job = Job(func, request=request, args=args, kwargs=kwargs)
-        self._pending.insert(0, job)
+        if dedup_key is not None and dedup_key in self._dedup:
+            return self._dedup[dedup_key]
+        if self._max_pending and self._num_pending >= self._max_pending:
+            if self.shed_job(func, request=request, args=args, kwargs=kwargs, kind=kind,
+                             priority=priority, dedup_key=dedup_key):
+                return None
+            raise JobPoolFullException(f'{self._num_pending} jobs pending')
+        return self._queue_job(func, request=request, args=args, kwargs=kwargs, kind=kind,
+                               priority=priority, dedup_key=dedup_key)
+
+    def _queue_job(self, func, request=None, args=None, kwargs=None, kind='default',
+                   priority=None, dedup_key=None):
+        job_class = self.get_job_class(kind)
+        if priority is None:
+            priority = job_class.priority
+        job = Job(func, request=request, args=args, kwargs=kwargs, kind=kind,
+                  priority=priority, dedup_key=dedup_key)
+        self._sequence += 1
+        heapq.heappush(job_class.pending, (-priority, self._sequence, job))
+        self._num_pending += 1
+        if dedup_key is not None:
+            self._dedup[dedup_key] = job
         self._schedule()
         return job
 
-    def _add_job_after_commit(self, status, func, request=None, args=None, kwargs=None):
-        self.add_job(func, request=request, args=args, kwargs=kwargs)
+    async def wait_for_space(self):
+        '''
+        Wait until the pending queue has room for more jobs
+        '''
+        while self._max_pending and self._num_pending >= self._max_pending:
+            if self._space is None:
+                self._space = asyncio.Event(loop=self.get_loop())
+            self._space.clear()
+            await self._space.wait()
+
+    def shed_job(self, func, request=None, args=None, kwargs=None, **job_options):
+        '''
+        Called when the pending queue is full. Returns True if the job was
+        handed over somewhere else, `PostgresqlAsyncJobPool` stores it.
+        '''
+        return False
+
+    async def _add_job_after_commit(self, status, func, request=None, args=None,
+                                    kwargs=None, **job_options):
+        # apply backpressure to the request that committed instead of failing
+        try:
+            await asyncio.wait_for(
+                self.wait_for_space(), self._max_pending_wait, loop=self.get_loop())
+        except asyncio.TimeoutError:
+            # the jobs running may be the ones waiting to add jobs, do not
+            # wait for them forever
+            if self.shed_job(func, request=request, args=args, kwargs=kwargs,
+                             **job_options):
+                return
+            logger.warning(f'Job pool full for {self._max_pending_wait} seconds, '
+                           f'queueing job {func} over the limit')
+            self._queue_job(func, request=request, args=args, kwargs=kwargs,
+                            **job_options)
+            return
+        self.add_job(func, request=request, args=args, kwargs=kwargs, **job_options)
 
     def add_job_after_commit(self, func: typing.Callable[[], typing.Coroutine],
-                             request=None, args=None, kwargs=None):
+                             request=None, args=None, kwargs=None, **job_options):
         txn = get_transaction(request)
         txn.add_after_commit_hook(
             self._add_job_after_commit,
             args=[func],
-            kws={
-                'request': request,
-                'args': args,
-                'kwargs': kwargs
-            })
+            kws=dict(job_options, request=request, args=args, kwargs=kwargs))
 
     def _done_callback(self, task):
         self._running.remove(task)
         self._schedule()  # see if we can schedule now
+        if (self._idle is not None and len(self._running) == 0 and
+                self._num_pending == 0):
+            self._idle.set()
+
+    def _next_job_class(self):
+        found = None
+        for job_class in self._classes.values():
+            if (len(job_class.pending) == 0 or
+                    job_class.running >= job_class.max_size):
+                continue
+            if found is None or job_class.pending[0] < found.pending[0]:
+                found = job_class
+        return found
 
     def _schedule(self):
         '''
-        check if we can schedule a new job
+        check if we can schedule new jobs
         '''
-        if len(self._running) < self._max_size and len(self._pending) > 0:
-            job = self._pending.pop()
-            task = self.get_loop().create_task(job.run())
+        while len(self._running) < self._max_size:
+            job_class = self._next_job_class()
+            if job_class is None:
+                break
+            _, _, job = heapq.heappop(job_class.pending)
+            job_class.running += 1
+            self._num_pending -= 1
+            if job.dedup_key is not None:
+                self._dedup.pop(job.dedup_key, None)
+            task = self.get_loop().create_task(self._run_job(job_class, job))
             task._job = job
             self._running.append(task)
             task.add_done_callback(self._done_callback)
+        if self._space is not None and self._num_pending < (self._max_pending or 1):
+            self._space.set()
+
+    async def _run_job(self, job_class, job):
+        start = time.time()
+        job_class.wait_time += start - job.queued
+        try:
+            await job.run()
+            job_class.finished += 1
+        except Exception:
+            job_class.failed += 1
+            logger.error(f'Error running job {job.func}', exc_info=True)
+        finally:
+            job_class.running -= 1
+            job_class.run_time += time.time() - start
 
     async def join(self):
         self._closing = True
-        while len(self._running) > 0 or len(self._pending) > 0:
-            await asyncio.sleep(0.1)
+        while len(self._running) > 0 or self._num_pending > 0:
+            if self._idle is None:
+                self._idle = asyncio.Event(loop=self.get_loop())
+            self._idle.clear()
+            await self._idle.wait()
+
+
+register_sql('CREATE_JOBS_TABLE', """
+CREATE TABLE IF NOT EXISTS {table_name} (
+    id BIGSERIAL PRIMARY KEY,
+    func TEXT NOT NULL,
+    args JSONB,
+    kwargs JSONB,
+    transactional BOOLEAN NOT NULL,
+    kind TEXT NOT NULL DEFAULT 'default',
+    priority INT NOT NULL DEFAULT 0,
+    dedup_key TEXT,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INT NOT NULL DEFAULT 0,
+    created TIMESTAMPTZ NOT NULL DEFAULT now(),
+    run_after TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished TIMESTAMPTZ,
+    duration FLOAT,
+    error TEXT
+);
+CREATE INDEX IF NOT EXISTS {table_name}_pending ON {table_name} (priority, run_after)
+WHERE status IN ('pending', 'running');
+CREATE UNIQUE INDEX IF NOT EXISTS {table_name}_dedup ON {table_name} (dedup_key)
+WHERE status = 'pending';
+""")
+
+register_sql('INSERT_JOB', """
+INSERT INTO {table_name} (func, args, kwargs, transactional, kind, priority, dedup_key)
+VALUES ($1::text, $2::jsonb, $3::jsonb, $4::boolean, $5::text, $6::int, $7::text)
+ON CONFLICT (dedup_key) WHERE status = 'pending' DO NOTHING
+""")
+
+# claimed jobs are leased by pushing run_after into the future. If the process
+# running the job dies, another worker picks it up again once the lease expires.
+register_sql('CLAIM_JOBS', """
+UPDATE {table_name}
+SET
+    status = 'running',
+    attempts = attempts + 1,
+    run_after = now() + $2::float * interval '1 second'
+WHERE id IN (
+    SELECT id
+    FROM {table_name}
+    WHERE status IN ('pending', 'running') AND run_after <= now()
+    ORDER BY priority DESC, id
+    LIMIT $1::int
+    FOR UPDATE SKIP LOCKED
+)
+RETURNING id, func, args, kwargs, transactional, kind, attempts
+""")
+
+register_sql('FINISH_JOB', """
+UPDATE {table_name}
+SET
+    status = 'finished',
+    finished = now(),
+    duration = $2::float
+WHERE id = $1::bigint
+""")
+
+register_sql('RETRY_JOB', """
+UPDATE {table_name}
+SET
+    status = 'pending',
+    run_after = now() + $2::float * interval '1 second',
+    duration = $3::float,
+    error = $4::text
+WHERE id = $1::bigint
+""")
+
+# a failed job is retried by the pending job with the same dedup key
+register_sql('MERGE_JOB', """
+UPDATE {table_name}
+SET
+    status = 'merged',
+    finished = now(),
+    duration = $2::float,
+    error = $3::text
+WHERE id = $1::bigint
+""")
+
+register_sql('FAIL_JOB', """
+UPDATE {table_name}
+SET
+    status = 'failed',
+    finished = now(),
+    duration = $2::float,
+    error = $3::text
+WHERE id = $1::bigint
+""")
+
+register_sql('PURGE_FINISHED_JOBS', """
+DELETE FROM {table_name}
+WHERE status IN ('finished', 'merged') AND finished < now() - $1::float * interval '1 second'
+""")
+
+
+class PostgresqlAsyncJobPool(AsyncJobPool):
+    '''
+    Job pool that persists jobs scheduled with `add_job_after_commit` in a
+    table of the postgresql database the transaction writes to.
+
+    The job is inserted in the same database transaction as the commit so it
+    is only ever run if the commit succeeded and it is not lost on restart.
+    Workers in every process claim jobs with `FOR UPDATE SKIP LOCKED`, retry
+    failed jobs with exponential backoff and record how long each run took.
+
+    Only jobs for module level functions with json serializable arguments
+    can be persisted. Anything else, or transactions not on a postgresql
+    storage, are run in memory like `AsyncJobPool` does.
+    '''
+
+    def __init__(self, settings={}, loop=None):
+        super().__init__(settings=dict(
+            settings, max_size=settings.get('max_size', 5)), loop=loop)
+        self._table_name = settings.get('table_name', 'jobs')
+        self._poll_interval = settings.get('poll_interval', 1.0)
+        self._max_attempts = settings.get('max_attempts', 5)
+        self._backoff = settings.get('backoff', 1.0)
+        self._max_backoff = settings.get('max_backoff', 300.0)
+        self._lease = settings.get('lease', 600.0)
+        self._retention = settings.get('retention', 24 * 60 * 60)
+        self._sql = SQLStatements()
+        self._initialized_storages = set()
+        self._last_purge = 0
+        self.app = None
+
+    async def initialize(self, app=None):
+        self.app = app
+        while not self._closing:
+            try:
+                claimed = 0
+                for db in self.get_databases():
+                    claimed += await self.run_pending(db)
+                if claimed == 0:
+                    await asyncio.sleep(self._poll_interval)
+            except (RuntimeError, SystemExit, GeneratorExit, KeyboardInterrupt,
+                    asyncio.CancelledError):
+                # dive, these errors mean we're exit(ing)
+                return
+            except Exception:
+                logger.error('Error running durable jobs', exc_info=True)
+                await asyncio.sleep(self._poll_interval)
+
+    def get_databases(self):
+        if self.app is None:
+            return []
+        return [db for _, db in self.app
+                if IDatabase.providedBy(db) and self.supports_storage(db.storage)]
+
+    def supports_storage(self, storage):
+        # cockroach does not support SKIP LOCKED
+        return (IPostgresStorage.providedBy(storage) and
+                getattr(storage, '_supports_skip_locked', True))
+
+    async def initialize_storage(self, storage):
+        if storage in self._initialized_storages:
+            return
+        sql = self._sql.get('CREATE_JOBS_TABLE', self._table_name)
+        conn = await storage.open()
+        try:
+            await conn.execute(sql)
+        finally:
+            await storage.close(conn)
+        self._initialized_storages.add(storage)
+
+    def _serialize_job(self, func, args, kwargs):
+        try:
+            func_name = get_dotted_name(func)
+            if resolve_dotted_name(func_name) is not func:
+                return None
+            return (func_name, json.dumps(args or []), json.dumps(kwargs or {}))
+        except (AttributeError, ImportError, TypeError, ValueError):
+            return None
+
+    def add_job_after_commit(self, func: typing.Callable[[], typing.Coroutine],
+                             request=None, args=None, kwargs=None, kind='default',
+                             priority=None, dedup_key=None):
+        txn = get_transaction(request)
+        serialized = self._serialize_job(func, args, kwargs)
+        if serialized is None or not self.supports_storage(txn.storage):
+            # request objects, bound methods, etc can not be stored
+            logger.debug(f'Can not persist job {func}, running in memory')
+            return super().add_job_after_commit(
+                func, request=request, args=args, kwargs=kwargs, kind=kind,
+                priority=priority, dedup_key=dedup_key)
+
+        if priority is None:
+            priority = self.get_job_class(kind).priority
+        job_data = {
+            'serialized': serialized + (request is not None, kind, priority, dedup_key),
+            'stored': False
+        }
+        txn.add_tpc_commit_hook(self._store_job_in_txn, args=[job_data])
+        txn.add_after_commit_hook(self._store_job_after_commit, args=[txn.storage, job_data])
+
+    def shed_job(self, func, request=None, args=None, kwargs=None, kind='default',
+                 priority=None, dedup_key=None):
+        # store the job for any process to run instead of keeping it in memory
+        db = getattr(request, '_db', None)
+        serialized = self._serialize_job(func, args, kwargs)
+        if db is None or serialized is None or not self.supports_storage(db.storage):
+            return False
+        if priority is None:
+            priority = self.get_job_class(kind).priority
+        job_data = {
+            'serialized': serialized + (True, kind, priority, dedup_key),
+            'stored': False
+        }
+        self.get_loop().create_task(self._store_shed_job(db.storage, job_data))
+        return True
+
+    async def _store_shed_job(self, storage, job_data):
+        try:
+            await self._store_job_after_commit(True, storage, job_data)
+        except Exception:
+            logger.error(f'Error storing job {job_data["serialized"][0]}', exc_info=True)
+
+    async def _insert_job(self, conn, job_data):
+        sql = self._sql.get('INSERT_JOB', self._table_name)
+        await conn.execute(sql, *job_data['serialized'])
+
+    async def _store_job_in_txn(self, txn, job_data):
+        if txn._db_txn is None or not txn.strategy.writable_transaction:
+            # no db transaction to commit with, store it after commit
+            return
+        await self.initialize_storage(txn.storage)
+        conn = await txn.get_connection()
+        async with txn._lock:
+            await self._insert_job(conn, job_data)
+        job_data['stored'] = True
+
+    async def _store_job_after_commit(self, status, storage, job_data):
+        if not status or job_data['stored']:
+            return
+        await self.initialize_storage(storage)
+        conn = await storage.open()
+        try:
+            await self._insert_job(conn, job_data)
+        finally:
+            await storage.close(conn)
+
+    async def run_pending(self, db):
+        '''
+        Claim and start as many pending jobs as there are free slots in the pool
+        '''
+        available = self._max_size - len(self._running)
+        if available <= 0 or self._closing:
+            return 0
+        storage = db.storage
+        await self.initialize_storage(storage)
+        conn = await storage.open()
+        try:
+            await self._purge_finished(conn)
+            sql = self._sql.get('CLAIM_JOBS', self._table_name)
+            records = await conn.fetch(sql, available, self._lease)
+        finally:
+            await storage.close(conn)
+
+        for record in records:
+            job_class = self.get_job_class(record['kind'])
+            job_class.running += 1
+            task = self.get_loop().create_task(
+                self._run_durable_job(db, job_class, record))
+            self._running.append(task)
+            task.add_done_callback(self._done_callback)
+        return len(records)
+
+    async def _purge_finished(self, conn):
+        if (time.time() - self._last_purge) < self._retention / 24:
+            return
+        self._last_purge = time.time()
+        sql = self._sql.get('PURGE_FINISHED_JOBS', self._table_name)
+        await conn.execute(sql, self._retention)
+
+    def _get_job(self, db, record):
+        func = resolve_dotted_name(record['func'])
+        args = json.loads(record['args'] or '[]')
+        kwargs = json.loads(record['kwargs'] or '{}')
+        request = None
+        if record['transactional']:
+            from guillotina.tests.utils import make_mocked_request
+            request = make_mocked_request('POST', '/')
+            request._db_write_enabled = True
+            request._db_id = db.id
+            request._db = db
+            request._tm = db.get_transaction_manager()
+            request._txn = None
+        return Job(func, request=request, args=args, kwargs=kwargs)
+
+    async def _run_durable_job(self, db, job_class, record):
+        start = time.time()
+        error = None
+        try:
+            await self._get_job(db, record).run()
+            job_class.finished += 1
+        except (SystemExit, GeneratorExit, KeyboardInterrupt,
+                asyncio.CancelledError):
+            # exiting, lease will expire and job will be picked up again
+            raise
+        except Exception as ex:
+            job_class.failed += 1
+            logger.warning(f'Error running job {record["func"]}', exc_info=True)
+            error = repr(ex)
+        finally:
+            job_class.running -= 1
+        duration = time.time() - start
+        job_class.run_time += duration
+
+        storage = db.storage
+        conn = await storage.open()
+        try:
+            if error is None:
+                sql = self._sql.get('FINISH_JOB', self._table_name)
+                await conn.execute(sql, record['id'], duration)
+            elif record['attempts'] >= self._max_attempts:
+                logger.error(f'Giving up on job {record["func"]} after '
+                             f'{record["attempts"]} attempts')
+                sql = self._sql.get('FAIL_JOB', self._table_name)
+                await conn.execute(sql, record['id'], duration, error)
+            else:
+                delay = min(self._backoff * (2 ** (record['attempts'] - 1)),
+                            self._max_backoff)
+                sql = self._sql.get('RETRY_JOB', self._table_name)
+                try:
+                    await conn.execute(sql, record['id'], delay, duration, error)
+                except asyncpg.exceptions.UniqueViolationError:
+                    # the same job was queued again while this one ran
+                    sql = self._sql.get('MERGE_JOB', self._table_name)
+                    await conn.execute(sql, record['id'], duration, error)
+        finally:
+            await storage.close(conn)
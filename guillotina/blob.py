@@ -1,7 +1,8 @@
 from guillotina._settings import app_settings
 from guillotina.exceptions import BlobChunkNotFound
 from guillotina.transactions import get_transaction
-from io import BytesIO
+
+import asyncio
 
 
 class Blob:
@@ -15,11 +16,15 @@ class Blob:
         data = await blob.async_read()
     """
 
+    # size of all chunks but the last one, None if they differ
+    chunk_size = None
+
     def __init__(self, resource):
         self.bid = app_settings['oid_generator'](resource)
         self.resource_zoid = resource._p_oid
         self.size = 0
         self.chunks = 0
+        self.chunk_size = None
 
     def open(self, mode='r', transaction=None):
         return BlobFile(self, mode, transaction)
@@ -54,6 +59,14 @@ class BlobFile:
 
         self._started_writing = True
 
+        if self.blob.chunks == 0:
+            self.blob.chunk_size = len(data)
+        elif self.blob.chunk_size is not None and (
+                self.blob.size != self.blob.chunks * self.blob.chunk_size or
+                len(data) > self.blob.chunk_size):
+            # previous chunk was shorter or this one is longer
+            self.blob.chunk_size = None
+
         await self.transaction.write_blob_chunk(
             self.blob.bid, self.blob.resource_zoid, self.blob.chunks, data)
 
@@ -61,10 +74,13 @@ class BlobFile:
         self.blob.size += len(data)
 
     async def async_write(self, data, chunk_size=1024 * 1024 * 1):
-        if isinstance(data, bytes):
-            stream = BytesIO(data)
-        else:
-            stream = data
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            # chunks are views of the data, not copies
+            view = memoryview(data)
+            for start in range(0, len(view), chunk_size):
+                await self.async_write_chunk(view[start:start + chunk_size])
+            return
+        stream = data
         data = stream.read(chunk_size)
         while data:
             await self.async_write_chunk(data)
@@ -78,18 +94,110 @@ class BlobFile:
                 self.blob.bid, chunk_index
             ))
 
-    async def iter_async_read(self):
+    async def async_read_chunks(self, chunk_indexes):
+        records = await self.transaction.read_blob_chunk_batch(
+            self.blob.bid, chunk_indexes)
+        for chunk_index, record in zip(chunk_indexes, records):
+            if record is None:
+                raise BlobChunkNotFound('Could not find blob({}), chunk({})'.format(
+                    self.blob.bid, chunk_index
+                ))
+        return [record['data'] for record in records]
+
+    async def iter_async_read(self, read_ahead=None):
         '''
         yield chunks of data...
+
+        the next chunks are fetched while the previous ones are consumed,
+        holding up to read_ahead bytes
         '''
-        for chunk_index in range(self.blob.chunks):
-            yield await self.async_read_chunk(chunk_index)
+        async for chunk in self._iter_chunks(0, self.blob.chunks, read_ahead):
+            yield chunk
+
+    async def _iter_chunks(self, first, last, read_ahead=None):
+        if read_ahead is None:
+            read_ahead = app_settings.get('blob_read_ahead', 0)
+        chunk_size = self.blob.chunk_size or self.blob.size // max(self.blob.chunks, 1)
+        max_depth = max(read_ahead // max(chunk_size, 1), 1)
+        # number of chunks requested ahead of the consumer, grows while the
+        # consumer waits on the database and shrinks while it is slower
+        depth = 1
+        requested = first
+        pending = []
+        ready = []
+        try:
+            while requested < last or pending or ready:
+                ahead = len(ready) + sum(len(indexes) for indexes, _ in pending)
+                if requested < last and ahead < depth:
+                    # fetch all the missing chunks with one query
+                    indexes = list(range(requested, min(requested + depth - ahead, last)))
+                    pending.append((indexes, asyncio.ensure_future(
+                        self.async_read_chunks(indexes))))
+                    requested += len(indexes)
+                if not ready:
+                    indexes, future = pending[0]
+                    if not future.done() and depth < max_depth:
+                        depth = min(depth * 2, max_depth)
+                        continue
+                    pending.pop(0)
+                    ready.extend(await future)
+                elif ahead >= depth and depth > 1 and all(
+                        future.done() for _, future in pending):
+                    depth -= 1
+                yield ready.pop(0)
+        finally:
+            # let queries on the connection of the transaction finish
+            for _, future in pending:
+                try:
+                    await future
+                except Exception:
+                    pass
+
+    async def iter_async_read_range(self, start, end, read_ahead=None):
+        '''
+        yield the data from byte start up to byte end, not included.
+
+        only the chunks containing the range are read when all the chunks
+        of the blob have the same size
+        '''
+        first = pos = 0
+        last = self.blob.chunks
+        if self.blob.chunk_size:
+            first = start // self.blob.chunk_size
+            last = min(-(-end // self.blob.chunk_size), last)
+            pos = first * self.blob.chunk_size
+        async for data in self._iter_chunks(first, last, read_ahead):
+            chunk_end = pos + len(data)
+            if chunk_end > start:
+                if start > pos or end < chunk_end:
+                    data = data[max(start - pos, 0):end - pos]
+                yield data
+            pos = chunk_end
+            if pos >= end:
+                break
+
+    async def async_readinto(self, buffer):
+        '''
+        read all the data into a writable buffer of at least the size of the
+        blob, returns the number of bytes read
+        '''
+        view = memoryview(buffer)
+        pos = 0
+        async for chunk in self.iter_async_read():
+            view[pos:pos + len(chunk)] = chunk
+            pos += len(chunk)
+        return pos
+
+    async def async_read_view(self):
+        '''
+        read all the data into one buffer and return a memoryview of it
+        '''
+        buffer = bytearray(self.blob.size)
+        size = await self.async_readinto(buffer)
+        return memoryview(buffer)[:size]
 
     async def async_read(self, chunk_size=None):
         '''
         read all the data... should this implement complete file-like api?
         '''
-        data = b''
-        async for chunk in self.iter_async_read():
-            data += chunk
-        return data
+        return b''.join([chunk async for chunk in self.iter_async_read()])
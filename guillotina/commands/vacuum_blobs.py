@@ -0,0 +1,33 @@
+from guillotina.commands import Command
+from guillotina.component import get_utility
+from guillotina.files.dbfile import vacuum_blobs
+from guillotina.interfaces import IApplication
+from guillotina.interfaces import IDatabase
+
+
+class VacuumBlobsCommand(Command):
+    description = 'Remove blobs no object refers to'
+
+    def get_parser(self):
+        parser = super(VacuumBlobsCommand, self).get_parser()
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Remove blobs of uploads without activity for this many seconds')
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='Number of blobs removed in each transaction')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only report the blobs that would be removed')
+        return parser
+
+    async def run(self, arguments, settings, app):
+        request = self.request  # noqa so magically get_current_request can find
+        root = get_utility(IApplication, name='root')
+        for _id, db in root:
+            if not IDatabase.providedBy(db):
+                continue
+            removed = await vacuum_blobs(
+                db.get_transaction_manager(), max_age=arguments.max_age,
+                dry_run=arguments.dry_run, batch_size=arguments.batch_size)
+            for bid, zoid in removed:
+                print(f'{bid} of {zoid}')
+            action = 'Would remove' if arguments.dry_run else 'Removed'
+            print(f'{action} {len(removed)} blobs of database {_id}')
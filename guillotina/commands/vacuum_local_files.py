@@ -0,0 +1,35 @@
+from guillotina.commands import Command
+from guillotina.component import get_utility
+from guillotina.files.localfile import vacuum
+from guillotina.interfaces import IApplication
+from guillotina.interfaces import IDatabase
+
+
+class VacuumLocalFilesCommand(Command):
+    description = 'Remove files of the local file storage no object refers to'
+
+    def get_parser(self):
+        parser = super(VacuumLocalFilesCommand, self).get_parser()
+        parser.add_argument('--max-age', type=int, default=None,
+                            help='Only remove files older than this many seconds')
+        parser.add_argument('--dry-run', action='store_true', default=False,
+                            help='Only report the files that would be removed')
+        return parser
+
+    async def run(self, arguments, settings, app):
+        request = self.request  # noqa so magically get_current_request can find
+        root = get_utility(IApplication, name='root')
+        for _id, db in root:
+            if not IDatabase.providedBy(db):
+                continue
+            tm = request._tm = db.get_transaction_manager()
+            txn = await tm.begin(request)
+            try:
+                removed = await vacuum(
+                    txn, max_age=arguments.max_age, dry_run=arguments.dry_run)
+            finally:
+                await tm.abort(txn=txn)
+            for path in removed:
+                print(path)
+            action = 'Would remove' if arguments.dry_run else 'Removed'
+            print(f'{action} {len(removed)} files of database {_id}')
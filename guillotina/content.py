@@ -331,14 +331,16 @@ class Folder(Resource):
         return default
 
     async def async_multi_get(self, keys: List[str], default=None,
-                              suppress_events=False) -> AsyncIterator[
+                              suppress_events=False, metadata_only=False) -> AsyncIterator[
             Tuple[Resource]]:
         """
         Asynchronously get an multiple objects inside this folder
 
         :param keys: keys of child objects to get
+        :param metadata_only: only load id, name, type, uuid and parent
         """
-        async for item in self._get_transaction().get_children(self, keys):
+        async for item in self._get_transaction().get_children(
+                self, keys, metadata_only=metadata_only):
             yield item
 
     async def async_del(self, key: str) -> None:
@@ -361,19 +363,23 @@ class Folder(Resource):
         """
         return await self._get_transaction().keys(self._p_oid)
 
-    async def async_items(self, suppress_events=False) -> AsyncIterator[
+    async def async_items(self, suppress_events=False, metadata_only=False) -> AsyncIterator[
             Tuple[str, Resource]]:
         """
         Asynchronously iterate through contents of folder
+
+        :param metadata_only: only load id, name, type, uuid and parent
         """
-        async for key, value in self._get_transaction().items(self):
+        async for key, value in self._get_transaction().items(
+                self, metadata_only=metadata_only):
             if not suppress_events:
                 await notify(ObjectLoadedEvent(value))
             yield key, value
 
-    async def async_values(self, suppress_events=False) -> AsyncIterator[
+    async def async_values(self, suppress_events=False, metadata_only=False) -> AsyncIterator[
             Tuple[Resource]]:
-        async for _, value in self._get_transaction().items(self):
+        async for _, value in self._get_transaction().items(
+                self, metadata_only=metadata_only):
             if not suppress_events:
                 await notify(ObjectLoadedEvent(value))
             yield value
@@ -3,3 +3,8 @@ ROOT_ID = '0' * 32
 
 # object to reassign parent id to when you are deleting
 TRASHED_ID = 'D' * 32
+
+# wal position of the last commit of a client, sent back by the client so
+# following requests are not served older data from a read replica
+READ_LSN_HEADER = 'X-Guillotina-LSN'
+READ_LSN_COOKIE = 'guillotina_lsn'
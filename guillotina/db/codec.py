@@ -0,0 +1,100 @@
+from guillotina._settings import app_settings
+
+import hashlib
+import zlib
+
+
+# rows stored before states had a codec header start with the PROTO
+# opcode of the pickle
+PICKLE_PROTO = 0x80
+
+_codecs = {}
+_codecs_by_header = {}
+
+
+class PickleCodec:
+    '''
+    Store the pickle as is
+    '''
+    name = 'pickle'
+    header = 0x01
+
+    def encode(self, data):
+        return data
+
+    def decode(self, data):
+        return data
+
+
+class ZlibCodec:
+    '''
+    Compress the pickle with zlib
+    '''
+    name = 'zlib'
+    header = 0x02
+
+    def __init__(self, level=1):
+        self.level = level
+
+    def encode(self, data):
+        return zlib.compress(data, self.level)
+
+    def decode(self, data):
+        return zlib.decompress(data)
+
+
+def register_codec(codec):
+    if codec.header == PICKLE_PROTO or not 0 < codec.header < 256:
+        raise ValueError(f'Invalid header {codec.header} for codec {codec.name}')
+    existing = _codecs_by_header.get(codec.header)
+    if existing is not None and existing.name != codec.name:
+        raise ValueError(f'Header {codec.header} already used by codec {existing.name}')
+    _codecs[codec.name] = codec
+    _codecs_by_header[codec.header] = codec
+
+
+def get_codec(name):
+    return _codecs[name]
+
+
+def encode_state(pickled, codec=None):
+    '''
+    Prefix the pickled state with the header of the codec used to store it.
+    Unless a codec is given, states larger than the configured threshold
+    are compressed.
+    '''
+    if codec is None:
+        settings = app_settings.get('state_codec', {})
+        threshold = settings.get('compress_threshold')
+        if threshold is not None and len(pickled) >= threshold:
+            codec = settings.get('compression', 'zlib')
+        else:
+            codec = 'pickle'
+    codec = _codecs[codec]
+    return bytes((codec.header,)) + codec.encode(pickled)
+
+
+def decode_state(state):
+    '''
+    Get the pickle of a stored state, rows without header are returned
+    as they are.
+    '''
+    header = state[0]
+    if header == PICKLE_PROTO:
+        return state
+    try:
+        codec = _codecs_by_header[header]
+    except KeyError:
+        raise ValueError(f'No codec registered for state header {header}')
+    return codec.decode(memoryview(state)[1:])
+
+
+def state_digest(state):
+    '''
+    Digest of a stored state to find objects that did not change
+    '''
+    return hashlib.blake2b(state, digest_size=16).digest()
+
+
+register_codec(PickleCodec())
+register_codec(ZlibCodec())
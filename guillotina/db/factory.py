@@ -9,7 +9,9 @@ from guillotina.db.interfaces import IDatabaseManager
 from guillotina.db.storages.cockroach import CockroachStorage
 from guillotina.db.storages.dummy import DummyFileStorage
 from guillotina.db.storages.dummy import DummyStorage
+from guillotina.db.storages.mvcc import MVCCStorage
 from guillotina.db.storages.pg import PostgresqlStorage
+from guillotina.db.storages.sqlite import SQLiteStorage
 from guillotina.event import notify
 from guillotina.events import DatabaseInitializedEvent
 from guillotina.factory.content import Database
@@ -94,12 +96,40 @@ async def DummyDatabaseConfigurationFactory(key, dbconfig, loop=None):
 
 @configure.utility(provides=IDatabaseConfigurationFactory, name="DUMMY_FILE")
 async def DummyFileDatabaseConfigurationFactory(key, dbconfig, loop=None):
-    dss = DummyFileStorage(dbconfig.get('filename', 'g.db'))
+    dss = DummyFileStorage(
+        dbconfig.get('filename', 'g.db'),
+        fsync=dbconfig.get('fsync', False),
+        compact_ratio=dbconfig.get('compact_ratio', 0.5),
+        compact_min_size=dbconfig.get('compact_min_size', 1 << 20))
     db = Database(key, dss)
     await db.initialize()
     return db
 
 
+@configure.utility(provides=IDatabaseConfigurationFactory, name="mvcc")
+async def MVCCDatabaseConfigurationFactory(key, dbconfig, loop=None):
+    dbconfig.update({
+        'name': key
+    })
+    mvs = MVCCStorage(**dbconfig)
+    await mvs.initialize(loop=loop)
+    db = Database(key, mvs)
+    await db.initialize()
+    return db
+
+
+@configure.utility(provides=IDatabaseConfigurationFactory, name="sqlite")
+async def SQLiteDatabaseConfigurationFactory(key, dbconfig, loop=None):
+    dbconfig.update({
+        'name': key
+    })
+    sls = SQLiteStorage(**dbconfig)
+    await sls.initialize(loop=loop)
+    db = Database(key, sls)
+    await db.initialize()
+    return db
+
+
 CREATE_DB = '''CREATE DATABASE "{}";'''
 DELETE_DB = '''DROP DATABASE "{}";'''
 
@@ -129,6 +129,16 @@ class IStorage(Interface):
         read blob chunks
         '''
 
+    async def read_blob_chunk_batch(txn, bid, chunks):
+        '''
+        read several blob chunks with one query
+        '''
+
+    async def get_page_of_blobs(txn, page=1, page_size=1000):
+        '''
+        bid and zoid of the stored blobs, ordered by zoid
+        '''
+
     async def del_blob(txn, bid):
         '''
         delete blob
@@ -22,6 +22,17 @@ class ObjectProperty(object):
         object.__setattr__(inst, self.attribute, self.default)
 
 
+class LocationProperty(ObjectProperty):
+    """
+    Changing where the object is stored also needs a write when the state
+    did not change, reset the digest of the loaded state
+    """
+
+    def __set__(self, inst, value):
+        object.__setattr__(inst, self.attribute, value)
+        object.__setattr__(inst, '_BaseObject__digest', None)
+
+
 class DictDefaultProperty(ObjectProperty):
     def __init__(self, attribute: str) -> None:
         self.attribute = attribute
@@ -54,16 +65,19 @@ class BaseObject:
         object.__setattr__(inst, '_BaseObject__of', None)
         object.__setattr__(inst, '_BaseObject__name', None)
         object.__setattr__(inst, '_BaseObject__immutable_cache', False)
+        object.__setattr__(inst, '_BaseObject__ghost', None)
+        object.__setattr__(inst, '_BaseObject__digest', None)
         return inst
 
     def __repr__(self):
         return "<%s %d>" % (self.__class__.__name__, id(self))
 
     __slots__ = ('__parent', '__of', '__name', '__annotations', '__immutable_cache',
-                 '__new_marker', '__jar', '__oid', '__serial')
-    __parent__: Optional['BaseObject'] = ObjectProperty('_BaseObject__parent', None)  # type: ignore
-    __of__: Optional['BaseObject'] = ObjectProperty('_BaseObject__of', None)  # type: ignore
-    __name__: Optional[str] = ObjectProperty('_BaseObject__name', None)  # type: ignore
+                 '__new_marker', '__jar', '__oid', '__serial', '__ghost',
+                 '__digest')
+    __parent__: Optional['BaseObject'] = LocationProperty('_BaseObject__parent', None)  # type: ignore
+    __of__: Optional['BaseObject'] = LocationProperty('_BaseObject__of', None)  # type: ignore
+    __name__: Optional[str] = LocationProperty('_BaseObject__name', None)  # type: ignore
     __immutable_cache__: bool = ObjectProperty('_BaseObject__immutable_cache', False)  # type: ignore
     __new_marker__ = ObjectProperty('_BaseObject__new_marker', False)
     __gannotations__: dict = DictDefaultProperty('_BaseObject__annotations')  # type: ignore
@@ -72,6 +86,8 @@ class BaseObject:
     _p_jar = ObjectProperty('_BaseObject__jar', None)
     _p_oid = ObjectProperty('_BaseObject__oid', None)
     _p_serial = ObjectProperty('_BaseObject__serial', None)
+    # digest of the state the object was loaded with
+    _p_digest = ObjectProperty('_BaseObject__digest', None)
 
     def _p_register(self):
         jar = self._p_jar
@@ -1,9 +1,240 @@
+from guillotina.db.codec import decode_state
+from guillotina.db.orm.base import BaseObject
+from guillotina.exceptions import InvalidContentType
+from guillotina.exceptions import StateNotLoadedError
+
+import importlib
 import pickle
+import pickletools
+import re
+
+
+# attributes a ghost can answer from the row without loading its state
+GHOST_ATTRIBUTES = frozenset({
+    '_p_oid', '_p_serial', '_p_jar', '__name__', '__parent__', '__of__',
+    'id', 'uuid', 'type_name', '__new_marker__', '__immutable_cache__',
+    '__gannotations__', '__providedBy__', '__provides__', '__implemented__',
+    '__conform__', '_p_digest', '_BaseObject__ghost'
+})
+# objects loaded without state only have a local acl if the row had a state
+METADATA_ATTRIBUTES = GHOST_ATTRIBUTES | {'__acl__', 'acl', '__class__'}
+
+# searched with a regex so memoryviews of states are not copied
+_provides = re.compile(b'__provides__')
+_state_classes = {}
+_ghost_classes = {}
 
 
 def reader(result):
-    obj = pickle.loads(result['state'])
+    obj = pickle.loads(decode_state(result['state']))
     obj._p_oid = result['zoid']
     obj._p_serial = result['tid']
     obj.__name__ = result['id']
     return obj
+
+
+def ghost_reader(result):
+    '''
+    Create the object of a row without unpickling its state.
+
+    The state is decoded the first time an attribute that is not part of
+    the row metadata is accessed. Rows that can not be ghosted are loaded
+    with the default reader.
+    '''
+    state = decode_state(result['state'])
+    type_name = result.get('type')
+    klass = None
+    if type_name and _provides.search(state) is None:
+        klass = get_state_class(state)
+    if klass is None:
+        obj = pickle.loads(state)
+        obj._p_oid = result['zoid']
+        obj._p_serial = result['tid']
+        obj.__name__ = result['id']
+        return obj
+
+    return _new_ghost(get_ghost_class(klass), result, state)
+
+
+def metadata_reader(result):
+    '''
+    Create the object of a row loaded without its state column.
+
+    Rows that still come with a state are loaded as ghosts. Returns None
+    if the class can not be found from the type of the row.
+    '''
+    if result['state'] is not None:
+        return ghost_reader(result)
+    from guillotina.content import get_cached_factory
+    try:
+        klass = get_cached_factory(result['type'])._callable
+    except InvalidContentType:
+        return None
+    if not _can_ghost(klass):
+        return None
+    return _new_ghost(get_ghost_class(klass, MetadataGhost), result, None)
+
+
+def _new_ghost(ghost_class, result, state):
+    obj = ghost_class.__new__(ghost_class)
+    # set the slots directly, going through Ghost.__setattr__ is slow
+    object.__setattr__(obj, '_BaseObject__ghost', state)
+    object.__setattr__(obj, '_BaseObject__oid', result['zoid'])
+    object.__setattr__(obj, '_BaseObject__serial', result['tid'])
+    object.__setattr__(obj, '_BaseObject__name', result['id'])
+    object.__getattribute__(obj, '__dict__')['type_name'] = result['type']
+    return obj
+
+
+def get_state_class(state):
+    '''
+    Find the class of a pickled object from the first global of its state
+    '''
+    key = _read_stack_global(state)
+    if key is None:
+        key = _read_global(state)
+        if key is None:
+            return None
+    if key not in _state_classes:
+        module_name, qualname = key
+        if isinstance(module_name, bytes):
+            module_name = module_name.decode('utf-8')
+            qualname = qualname.decode('utf-8')
+        _state_classes[key] = _resolve_class(module_name, qualname)
+    return _state_classes[key]
+
+
+def _read_stack_global(state):
+    '''
+    Fast path for the layout `pickle.dumps` produces with protocol 4:
+    PROTO, FRAME, the module and class names and STACK_GLOBAL
+    '''
+    if state[:3] != b'\x80\x04\x95':
+        return None
+    pos = 11
+    names = []
+    try:
+        for _ in range(2):
+            if state[pos] != 0x8c:  # SHORT_BINUNICODE
+                return None
+            end = pos + 2 + state[pos + 1]
+            names.append(bytes(state[pos + 2:end]))
+            pos = end
+            if state[pos] == 0x94:  # MEMOIZE
+                pos += 1
+        if state[pos] != 0x93:  # STACK_GLOBAL
+            return None
+    except IndexError:
+        return None
+    return tuple(names)
+
+
+def _read_global(state):
+    strings = []
+    try:
+        for opcode, arg, _ in pickletools.genops(bytes(state)):
+            if opcode.name == 'STACK_GLOBAL':
+                key = tuple(strings[-2:])
+                break
+            elif opcode.name == 'GLOBAL':
+                key = tuple(arg.split(' ', 1))
+                break
+            elif 'UNICODE' in opcode.name:
+                strings.append(arg)
+        else:
+            return None
+    except ValueError:
+        return None
+    return key
+
+
+def _resolve_class(module_name, qualname):
+    try:
+        klass = importlib.import_module(module_name)
+        for name in qualname.split('.'):
+            klass = getattr(klass, name)
+    except (ImportError, AttributeError):
+        return None
+    if not _can_ghost(klass):
+        return None
+    return klass
+
+
+def _can_ghost(klass):
+    return (isinstance(klass, type) and issubclass(klass, BaseObject) and
+            bool(klass.__dictoffset__) and
+            klass.__getattribute__ is object.__getattribute__)
+
+
+def get_ghost_class(klass, mixin=None):
+    mixin = mixin or Ghost
+    key = (klass, mixin)
+    if key not in _ghost_classes:
+        _ghost_classes[key] = type(klass.__name__, (mixin, klass), {
+            '__slots__': (),
+            '__module__': klass.__module__,
+            '__ghost_of__': klass
+        })
+    return _ghost_classes[key]
+
+
+def activate(obj):
+    '''
+    Load the pending state of a ghost and turn it into its real class
+    '''
+    state = object.__getattribute__(obj, '_BaseObject__ghost')
+    if state is None:
+        return
+    loaded = pickle.loads(state)
+    object.__setattr__(obj, '_BaseObject__ghost', None)
+    object.__setattr__(obj, '__class__', type(obj).__ghost_of__)
+    # values set on the ghost win over the ones from the state
+    loaded.__dict__.update(obj.__dict__)
+    obj.__dict__ = loaded.__dict__
+
+
+class Ghost:
+    '''
+    Mixin for objects whose state has not been loaded yet
+    '''
+
+    __slots__ = ()
+
+    def __getattribute__(self, name):
+        if name in GHOST_ATTRIBUTES:
+            return object.__getattribute__(self, name)
+        activate(self)
+        return getattr(self, name)
+
+    def __setattr__(self, name, value):
+        if name in GHOST_ATTRIBUTES:
+            object.__setattr__(self, name, value)
+        else:
+            activate(self)
+            setattr(self, name, value)
+
+    def __delattr__(self, name):
+        activate(self)
+        delattr(self, name)
+
+
+class MetadataGhost(Ghost):
+    '''
+    Mixin for objects loaded without their state, only the row metadata
+    can be used
+    '''
+
+    __slots__ = ()
+
+    def __getattribute__(self, name):
+        if name in METADATA_ATTRIBUTES:
+            return object.__getattribute__(self, name)
+        raise StateNotLoadedError(name)
+
+    def __setattr__(self, name, value):
+        if name not in METADATA_ATTRIBUTES:
+            raise StateNotLoadedError(name)
+        object.__setattr__(self, name, value)
+
+    def __delattr__(self, name):
+        raise StateNotLoadedError(name)
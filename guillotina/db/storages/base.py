@@ -15,6 +15,7 @@ class BaseStorage:
         self._hits = 0
         self._misses = 0
         self._stored = 0
+        self._skipped = 0
 
     @property
     def supports_unique_constraints(self):
@@ -32,6 +33,9 @@ class BaseStorage:
     async def open(self):
         raise NotImplemented()  # pragma: no cover
 
+    async def use_read_replica(self, request):
+        return False
+
     async def close(self, con):
         raise NotImplemented()  # pragma: no cover
 
@@ -41,6 +45,16 @@ class BaseStorage:
     async def store(self, oid, old_serial, writer, obj, txn):
         raise NotImplemented()  # pragma: no cover
 
+    async def store_batch(self, txn, objects):
+        for oid, old_serial, writer, obj in objects:
+            await self.store(oid, old_serial, writer, obj, txn)
+
+    async def store_json(self, txn, objects):
+        '''
+        Update the json of (oid, writer, obj) objects that are not written
+        because their state did not change, for storages that query it
+        '''
+
     async def delete(self, txn, oid):
         raise NotImplemented()  # pragma: no cover
 
@@ -80,9 +94,17 @@ class BaseStorage:
     async def len(self, txn, oid):
         raise NotImplemented()  # pragma: no cover
 
-    async def items(self, txn, oid):
+    async def items(self, txn, oid, metadata_only=False):
         raise NotImplemented()  # pragma: no cover
 
+    async def get_children_metadata(self, txn, parent_oid, ids):
+        # storages that can not leave out the state return full rows
+        return await self.get_children(txn, parent_oid, ids)
+
+    async def wait_for_json(self, tid, timeout=None):
+        # the json column is written with the object unless deferred
+        return True
+
     async def get_annotation(self, txn, oid, id):
         raise NotImplemented()  # pragma: no cover
 
@@ -98,6 +120,13 @@ class BaseStorage:
     async def read_blob_chunks(self, txn, bid):
         raise NotImplemented()  # pragma: no cover
 
+    async def read_blob_chunk_batch(self, txn, bid, chunks):
+        # records of the chunks in the order asked for, None if missing
+        return [await self.read_blob_chunk(txn, bid, chunk) for chunk in chunks]
+
+    async def get_page_of_blobs(self, txn, page=1, page_size=1000):
+        raise NotImplemented()  # pragma: no cover
+
     async def del_blob(self, txn, bid):
         raise NotImplemented()  # pragma: no cover
 
@@ -110,5 +139,6 @@ class BaseStorage:
     async def get_total_resources_of_type(self, txn, type_):
         raise NotImplemented()  # pragma: no cover
 
-    async def _get_page_resources_of_type(self, txn, type_, page, page_size):
+    async def _get_page_resources_of_type(self, txn, type_, page, page_size,
+                                          metadata_only=False):
         raise NotImplemented()  # pragma: no cover
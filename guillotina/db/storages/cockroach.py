@@ -127,6 +127,10 @@ class CockroachStorage(pg.PostgresqlStorage):
 
     _db_transaction_factory = CockroachDBTransaction
     _vacuum = _vacuum_task = None
+    _supports_skip_locked = False
+    _tid_allocator_class = None
+    _json_projector_class = None
+    _supports_blob_dedup = False
 
     def __init__(self, *args, **kwargs):
         transaction_strategy = kwargs.get('transaction_strategy', 'dbresolve_readcommitted')
@@ -211,6 +215,25 @@ class CockroachStorage(pg.PostgresqlStorage):
                     oid, txn, old_serial, writer)
         await txn._cache.store_object(obj, pickled)
 
+    async def store_batch(self, txn, objects):
+        # cockroach does not store the json column the batched update writes
+        for oid, old_serial, writer, obj in objects:
+            await self.store(oid, old_serial, writer, obj, txn)
+
+    async def store_json(self, txn, objects):
+        # cockroach does not store the json column
+        pass
+
+    async def use_read_replica(self, request):
+        # there are no wal positions to check the replica against
+        if not await super().use_read_replica(request):
+            return False
+        return pg.get_request_lsn(request) is None
+
+    async def get_children_metadata(self, txn, parent_oid, ids):
+        # keep sending the state, the metadata queries are postgresql specific
+        return await self.get_children(txn, parent_oid, ids)
+
     async def commit(self, transaction):
         if transaction._db_txn is not None:
             async with transaction._lock:
@@ -6,12 +6,26 @@ from zope.interface import implementer
 
 import asyncio
 import logging
+import mmap
 import os
 import pickle
+import struct
+import uuid
+import zlib
 
 
 logger = logging.getLogger('guillotina')
 
+# log files start with the magic and a random id of the log, snapshots of
+# the index are only used with the log they were written for
+LOG_MAGIC = b'GLOG\x01\n'
+LOG_ID_SIZE = 16
+RECORD_MARKER = b'GREC'
+# marker, tid, length of the pickled changes and length of the data
+RECORD_HEADER = struct.Struct('>4sQII')
+# crc32 of the changes and the data
+RECORD_FOOTER = struct.Struct('>I')
+
 
 @implementer(IStorage)
 class DummyStorage(BaseStorage):
@@ -112,7 +126,12 @@ class DummyStorage(BaseStorage):
         self.get_txn(txn)['removed'].append(oid)
 
     async def commit(self, transaction):
-        for oid, element in self.get_txn(transaction)['added'].items():
+        db_txn = self.get_txn(transaction)
+        self._commit_changes(db_txn['added'], db_txn['removed'])
+        return transaction._tid
+
+    def _commit_changes(self, added, removed):
+        for oid, element in added.items():
             if oid in self._db and self._db[oid]['parent_id'] != element['parent_id']:
                 # can move object move, we need to cleanup here...
                 old_parent_ob = self._db[self._db[oid]['parent_id']]
@@ -130,7 +149,7 @@ class DummyStorage(BaseStorage):
             if element['of'] and element['of'] in self._db:
                 self._db[element['of']]['ofs'][element['id']] = oid
 
-        for oid in self.get_txn(transaction)['removed']:
+        for oid in removed:
             tobj = self._db[oid]
             del self._db[oid]
             if tobj['parent_id'] and tobj['parent_id'] in self._db:
@@ -144,8 +163,6 @@ class DummyStorage(BaseStorage):
                 if oid in ofs:
                     del of_ob['ofs'][ofs[oid]]
 
-        return transaction._tid
-
     async def abort(self, transaction):
         transaction._db_txn = None
 
@@ -174,7 +191,7 @@ class DummyStorage(BaseStorage):
             return len(self._db[oid]['children'])
         return 0
 
-    async def items(self, txn, oid):  # pragma: no cover
+    async def items(self, txn, oid, metadata_only=False):  # pragma: no cover
         for cid, coid in self._db[oid]['children'].items():
             obj = await self.load(txn, coid)
             yield obj
@@ -208,13 +225,19 @@ class DummyStorage(BaseStorage):
                 'oid': oid,
                 'chunks': []
             }
-        self._blobs[bid]['chunks'].append(data)
+        # callers can pass memoryviews of buffers they keep changing
+        self._blobs[bid]['chunks'].append(bytes(data))
 
     async def read_blob_chunk(self, txn, bid, chunk=0):
         return {
             'data': self._blobs[bid]['chunks'][chunk]
         }
 
+    async def get_page_of_blobs(self, txn, page=1, page_size=1000):
+        blobs = sorted((blob['oid'], bid) for bid, blob in self._blobs.items())
+        start = (page - 1) * page_size
+        return [{'bid': bid, 'zoid': oid} for oid, bid in blobs[start:start + page_size]]
+
     async def get_conflicts(self, txn):
         return []
 
@@ -227,35 +250,381 @@ class DummyStorage(BaseStorage):
 
 
 @implementer(IStorage)
-class DummyFileStorage(DummyStorage):  # pragma: no cover
+class DummyFileStorage(DummyStorage):
+    '''
+    Storage that appends the changes of every commit to a log file.
+
+    Objects, children and annotations are indexed in memory. The index is
+    rebuilt from the log at startup, starting from the snapshot of the
+    index written when the storage is closed or the log compacted. States
+    are loaded as slices of a memory map of the log without copying them.
+
+    Once more than `compact_ratio` of the log are overwritten or deleted
+    records, the live records are rewritten to a new log in the background.
+    '''
 
-    def __init__(self, filename='g.db'):
+    def __init__(self, filename='g.db', fsync=False, compact_ratio=0.5,
+                 compact_min_size=1 << 20):
         super(DummyFileStorage, self).__init__()
-        self.filename = filename
-        self.blob_filename = self.filename + '.blobs'
-        self.__load()
+        self._configure(filename, fsync, compact_ratio, compact_min_size)
+        self.__open()
 
-    def __load(self):
-        if not os.path.exists(self.filename):
-            return
+    def _configure(self, filename, fsync, compact_ratio, compact_min_size):
+        self.filename = filename
+        self.snapshot_filename = self.filename + '.index'
+        self._fsync = fsync
+        self._compact_ratio = compact_ratio
+        self._compact_min_size = compact_min_size
+        self._db = {}
+        self._blobs = {}
+        # bids of the blobs of every oid
+        self._blob_oids = {}
+        self._file = None
+        self._map = self._view = None
+        self._log_id = None
+        self._size = 0
+        # bytes of the states and blob chunks still in use
+        self._live = 0
+        self._compact_task = None
+        # commits and compaction write to the log one at a time
+        self._write_lock = None
+
+    def _get_write_lock(self):
+        if self._write_lock is None:
+            self._write_lock = asyncio.Lock()
+        return self._write_lock
+
+    def __open(self):
+        if os.path.exists(self.filename):
+            with open(self.filename, 'rb') as fi:
+                magic = fi.read(len(LOG_MAGIC))
+            if magic != LOG_MAGIC:
+                self.__migrate()
+        else:
+            self._write_log(self.filename, [], [])
+        self._file = open(self.filename, 'r+b')
+        self._size = os.path.getsize(self.filename)
+        self._remap()
+        self._log_id = bytes(self._view[len(LOG_MAGIC):len(LOG_MAGIC) + LOG_ID_SIZE])
+        offset = self.__load_snapshot()
+        if offset is None:
+            offset = len(LOG_MAGIC) + LOG_ID_SIZE
+        self.__replay(offset)
+
+    def __migrate(self):
+        # databases of previous versions are a pickle of the whole index
         with open(self.filename, 'rb') as fi:
             try:
                 self._db = pickle.loads(fi.read())
             except EOFError:
                 logger.warning(f'Could not load db file {self.filename}')
-        if os.path.exists(self.blob_filename):
-            with open(self.blob_filename, 'rb') as fi:
+        blob_filename = self.filename + '.blobs'
+        if os.path.exists(blob_filename):
+            with open(blob_filename, 'rb') as fi:
                 try:
                     self._blobs = pickle.loads(fi.read())
                 except EOFError:
-                    logger.warning(f'Could not load db file {self.blob_filename}')
+                    logger.warning(f'Could not load db file {blob_filename}')
+        blobs = []
+        for bid, blob in self._blobs.items():
+            for chunk_index, data in enumerate(blob['chunks']):
+                blobs.append((bid, blob['oid'], chunk_index, data))
+        logger.warning(f'Migrating {self.filename} to a log file')
+        self._last_transaction = max(
+            [self._last_transaction] + [element['tid'] for element in self._db.values()])
+        self._write_log(self.filename + '.compact', self._get_live_objects(), blobs)
+        os.replace(self.filename + '.compact', self.filename)
+        self._db = {}
+        self._blobs = {}
 
-    def __save(self):
-        with open(self.filename, 'wb') as fi:
-            fi.write(pickle.dumps(self._db))
-        with open(self.blob_filename, 'wb') as fi:
-            fi.write(pickle.dumps(self._blobs))
+    def __load_snapshot(self):
+        if not os.path.exists(self.snapshot_filename):
+            return None
+        try:
+            with open(self.snapshot_filename, 'rb') as fi:
+                snapshot = pickle.loads(fi.read())
+        except Exception:
+            logger.warning(f'Could not load index {self.snapshot_filename}', exc_info=True)
+            return None
+        if snapshot['log_id'] != self._log_id or snapshot['size'] > self._size:
+            return None
+        self._db = snapshot['db']
+        self._blobs = snapshot['blobs']
+        self._blob_oids = {}
+        for bid, blob in self._blobs.items():
+            self._blob_oids.setdefault(blob['oid'], set()).add(bid)
+        self._live = snapshot['live']
+        self._last_transaction = snapshot['last_transaction']
+        return snapshot['size']
+
+    def _write_snapshot(self):
+        with open(self.snapshot_filename + '.tmp', 'wb') as fi:
+            fi.write(pickle.dumps({
+                'log_id': self._log_id,
+                'size': self._size,
+                'db': self._db,
+                'blobs': self._blobs,
+                'live': self._live,
+                'last_transaction': self._last_transaction
+            }, protocol=pickle.HIGHEST_PROTOCOL))
+        os.replace(self.snapshot_filename + '.tmp', self.snapshot_filename)
+
+    def __replay(self, offset):
+        view = self._view
+        while offset < self._size:
+            if self._size - offset < RECORD_HEADER.size + RECORD_FOOTER.size:
+                break
+            marker, tid, changes_size, data_size = RECORD_HEADER.unpack_from(view, offset)
+            start = offset + RECORD_HEADER.size
+            end = start + changes_size + data_size
+            if marker != RECORD_MARKER or end + RECORD_FOOTER.size > self._size:
+                break
+            if zlib.crc32(view[start:end]) != RECORD_FOOTER.unpack_from(view, end)[0]:
+                break
+            self._apply(pickle.loads(view[start:start + changes_size]), start + changes_size)
+            self._last_transaction = max(self._last_transaction, tid)
+            offset = end + RECORD_FOOTER.size
+        if offset < self._size:
+            # the last commit was not completely written
+            logger.warning(f'Truncating incomplete record at {offset} of {self.filename}')
+            self._file.truncate(offset)
+            self._size = offset
+            self._remap()
+
+    def _remap(self):
+        # views handed out keep the previous map alive
+        self._map = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+    def _write_log(self, filename, objects, blobs):
+        with open(filename, 'wb') as fi:
+            fi.write(LOG_MAGIC + uuid.uuid4().bytes)
+            if len(objects) > 0 or len(blobs) > 0:
+                fi.write(self._make_record(
+                    self._last_transaction, dict(objects), [], blobs, []))
+            fi.flush()
+            if self._fsync:
+                os.fsync(fi.fileno())
+
+    def _make_record(self, tid, added, removed, blobs, deleted_blobs):
+        data = []
+        size = 0
+        objects = []
+        for oid, element in added.items():
+            state = element['state']
+            objects.append((oid, {
+                key: value for key, value in element.items()
+                if key not in ('state', 'children', 'ofs', 'offset', 'length')
+            }, size, len(state)))
+            data.append(state)
+            size += len(state)
+        chunks = []
+        for bid, oid, chunk_index, chunk in blobs:
+            chunks.append((bid, oid, chunk_index, size, len(chunk)))
+            data.append(chunk)
+            size += len(chunk)
+        changes = pickle.dumps({
+            'objects': objects,
+            'removed': removed,
+            'blobs': chunks,
+            'deleted_blobs': deleted_blobs
+        }, protocol=pickle.HIGHEST_PROTOCOL)
+        crc = zlib.crc32(changes)
+        for chunk in data:
+            crc = zlib.crc32(chunk, crc)
+        return b''.join([
+            RECORD_HEADER.pack(RECORD_MARKER, tid, len(changes), size),
+            changes, *data, RECORD_FOOTER.pack(crc)])
+
+    def _apply(self, changes, data_offset):
+        added = {}
+        for oid, element, offset, length in changes['objects']:
+            existing = self._db.get(oid)
+            if existing is not None:
+                self._live -= existing['length']
+            added[oid] = dict(
+                element, state=None, offset=data_offset + offset, length=length,
+                children=existing['children'] if existing else {},
+                ofs=existing['ofs'] if existing else {})
+            self._live += length
+
+        # children and annotations are deleted with their parent
+        removed = {}
+        stack = list(changes['removed'])
+        while len(stack) > 0:
+            oid = stack.pop()
+            if oid in removed or (oid not in self._db and oid not in added):
+                continue
+            tobj = added.get(oid, self._db.get(oid))
+            removed[oid] = tobj
+            stack.extend(tobj['children'].values())
+            stack.extend(tobj['ofs'].values())
+        for tobj in removed.values():
+            self._live -= tobj['length']
+        self._commit_changes(added, [oid for oid in removed if oid in self._db or oid in added])
+
+        deleted = set(changes['deleted_blobs'])
+        for oid in removed:
+            deleted.update(self._blob_oids.get(oid, ()))
+        for bid in deleted:
+            blob = self._blobs.pop(bid, None)
+            if blob is None:
+                continue
+            self._live -= sum(length for _, length in blob['chunks'])
+            bids = self._blob_oids[blob['oid']]
+            bids.discard(bid)
+            if len(bids) == 0:
+                del self._blob_oids[blob['oid']]
+        for bid, oid, chunk_index, offset, length in changes['blobs']:
+            if bid not in self._blobs:
+                self._blobs[bid] = {'oid': oid, 'chunks': []}
+                self._blob_oids.setdefault(oid, set()).add(bid)
+            chunks = self._blobs[bid]['chunks']
+            while len(chunks) <= chunk_index:
+                chunks.append((0, 0))
+            self._live -= chunks[chunk_index][1]
+            chunks[chunk_index] = (data_offset + offset, length)
+            self._live += length
+
+    @property
+    def _garbage(self):
+        # overwritten and deleted records and the headers of the commits
+        return self._size - self._live
+
+    def _get_live_objects(self):
+        # parents and annotated objects are written before the objects
+        # referencing them so the indexes are rebuilt in order
+        depths = {}
+
+        def get_depth(oid):
+            path = []
+            while oid in self._db and oid not in depths and oid not in path:
+                path.append(oid)
+                element = self._db[oid]
+                oid = element['of'] or element['parent_id']
+            depth = depths.get(oid, 0)
+            for oid in reversed(path):
+                depth += 1
+                depths[oid] = depth
+            return depth
+
+        for oid in self._db:
+            get_depth(oid)
+        return sorted(self._db.items(), key=lambda item: depths[item[0]])
+
+    def get_txn(self, txn):
+        db_txn = super().get_txn(txn)
+        db_txn.setdefault('blobs', [])
+        db_txn.setdefault('deleted_blobs', [])
+        return db_txn
+
+    async def load(self, txn, oid):
+        element = self._db[oid]
+        if element['state'] is not None:
+            # stored by a previous version
+            return element
+        offset = element['offset']
+        return dict(element, state=self._view[offset:offset + element['length']])
 
     async def commit(self, transaction):
-        await super().commit(transaction)
-        self.__save()
+        db_txn = self.get_txn(transaction)
+        if (len(db_txn['added']) == 0 and len(db_txn['removed']) == 0 and
+                len(db_txn['blobs']) == 0 and len(db_txn['deleted_blobs']) == 0):
+            return transaction._tid
+        record = self._make_record(
+            transaction._tid, db_txn['added'], db_txn['removed'],
+            db_txn['blobs'], db_txn['deleted_blobs'])
+        loop = asyncio.get_event_loop()
+        async with self._get_write_lock():
+            offset = self._size
+            await loop.run_in_executor(None, self._append, record)
+            changes_size = RECORD_HEADER.unpack_from(record)[2]
+            self._apply(
+                pickle.loads(record[RECORD_HEADER.size:RECORD_HEADER.size + changes_size]),
+                offset + RECORD_HEADER.size + changes_size)
+        self._last_transaction = max(self._last_transaction, transaction._tid)
+        if (self._size > self._compact_min_size and
+                self._garbage > self._size * self._compact_ratio and
+                (self._compact_task is None or self._compact_task.done())):
+            self._compact_task = asyncio.ensure_future(self.compact())
+        return transaction._tid
+
+    def _append(self, record):
+        self._file.seek(self._size)
+        self._file.write(record)
+        self._file.flush()
+        if self._fsync:
+            os.fsync(self._file.fileno())
+        self._size += len(record)
+        self._remap()
+
+    async def compact(self):
+        '''
+        Rewrite the live records to a new log
+        '''
+        loop = asyncio.get_event_loop()
+        async with self._get_write_lock():
+            size = self._size
+            view = self._view
+            objects = [(oid, dict(element, state=view[
+                element['offset']:element['offset'] + element['length']]))
+                for oid, element in self._get_live_objects()]
+            blobs = [(bid, blob['oid'], chunk_index, view[offset:offset + length])
+                     for bid, blob in self._blobs.items()
+                     for chunk_index, (offset, length) in enumerate(blob['chunks'])]
+        filename = self.filename + '.compact'
+        await loop.run_in_executor(None, self._write_log, filename, objects, blobs)
+
+        async with self._get_write_lock():
+            # commits done while compacting are copied as they are, the new
+            # log is loaded in a thread while the previous one is still read
+            loader = object.__new__(self.__class__)
+            loader._configure(
+                self.filename, self._fsync, self._compact_ratio, self._compact_min_size)
+            await loop.run_in_executor(None, self._replace_log, filename, size, loader)
+            previous = self._file
+            for name in ('_file', '_map', '_view', '_log_id', '_size', '_live',
+                         '_db', '_blobs', '_blob_oids'):
+                setattr(self, name, getattr(loader, name))
+            self._last_transaction = max(
+                self._last_transaction, loader._last_transaction)
+            previous.close()
+            await loop.run_in_executor(None, self._write_snapshot)
+        logger.info(f'Compacted {self.filename} from {size} to {self._size} bytes')
+
+    def _replace_log(self, filename, size, loader):
+        with open(filename, 'ab') as fi:
+            fi.write(self._view[size:self._size])
+            fi.flush()
+            if self._fsync:
+                os.fsync(fi.fileno())
+        os.replace(filename, self.filename)
+        if os.path.exists(self.snapshot_filename):
+            os.remove(self.snapshot_filename)
+        loader._DummyFileStorage__open()
+
+    async def finalize(self):
+        if self._compact_task is not None and not self._compact_task.done():
+            await self._compact_task
+        if self._file is not None:
+            self._write_snapshot()
+            self._file.close()
+            self._file = None
+
+    async def write_blob_chunk(self, txn, bid, oid, chunk_index, data):
+        self.get_txn(txn)['blobs'].append((bid, oid, chunk_index, bytes(data)))
+
+    async def read_blob_chunk(self, txn, bid, chunk=0):
+        for chunk_bid, oid, chunk_index, data in self.get_txn(txn)['blobs']:
+            if chunk_bid == bid and chunk_index == chunk:
+                return {
+                    'data': data
+                }
+        offset, length = self._blobs[bid]['chunks'][chunk]
+        # blob data is handed to code expecting bytes
+        return {
+            'data': bytes(self._view[offset:offset + length])
+        }
+
+    async def del_blob(self, txn, bid):
+        self.get_txn(txn)['deleted_blobs'].append(bid)
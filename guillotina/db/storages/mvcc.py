@@ -0,0 +1,503 @@
+from guillotina.db import ROOT_ID
+from guillotina.db.interfaces import IStorage
+from guillotina.db.storages.base import BaseStorage
+from guillotina.exceptions import ConflictIdOnContainer
+from guillotina.exceptions import TIDConflictError
+from zope.interface import implementer
+
+import asyncio
+import logging
+import random
+
+
+log = logging.getLogger("guillotina.storage")
+
+
+@implementer(IStorage)
+class MVCCStorage(BaseStorage):
+    '''
+    In-memory storage that keeps the committed versions of every object.
+
+    Transactions read the versions committed before their db transaction
+    started and their own changes. At commit updates only match objects
+    that still have the tid they were loaded with, like the `UPDATE` of
+    the postgresql storage, and conflicting commits raise the same errors.
+    Every query waits `latency` seconds to simulate a database server.
+    '''
+
+    _supports_unique_constraints = True
+
+    def __init__(self, read_only=False, name=None, transaction_strategy='resolve',
+                 cache_strategy='dummy', latency=0, latency_jitter=0, **options):
+        super().__init__(read_only, transaction_strategy=transaction_strategy,
+                         cache_strategy=cache_strategy)
+        self.__name__ = name
+        self._latency = latency
+        self._latency_jitter = latency_jitter
+        # oid -> list of (commit sequence, row), rows of deleted objects are None
+        self._versions = {}
+        # parent or annotated oid -> oids that were ever stored below it
+        self._children = {}
+        self._annotations = {}
+        # (parent or annotated oid, id) -> oids with a version stored there
+        self._child_ids = {}
+        self._annotation_ids = {}
+        self._blobs = {}
+        self._seq = 0
+        self._tid = 0
+        self._current_tid = 0
+        # commit sequence -> number of open db transactions reading it
+        self._snapshots = {}
+        self._metrics = {
+            'queries': 0,
+            'commits': 0,
+            'conflicts': 0
+        }
+
+    async def _query(self):
+        self._metrics['queries'] += 1
+        latency = self._latency
+        if self._latency_jitter:
+            latency += random.uniform(0, self._latency_jitter)
+        if latency:
+            await asyncio.sleep(latency)
+
+    def get_metrics(self):
+        return dict(
+            self._metrics,
+            objects=len(self._versions),
+            versions=sum(len(versions) for versions in self._versions.values()),
+            snapshots=sum(self._snapshots.values()))
+
+    async def finalize(self):
+        pass
+
+    async def initialize(self, loop=None, **kw):
+        pass
+
+    async def remove(self):
+        """Reset the tables"""
+        self._versions.clear()
+        self._children.clear()
+        self._annotations.clear()
+        self._child_ids.clear()
+        self._annotation_ids.clear()
+        self._blobs.clear()
+
+    async def open(self):
+        return self
+
+    async def close(self, con):
+        pass
+
+    async def root(self):
+        return await self.load(None, ROOT_ID)
+
+    def _get_snapshot(self, txn):
+        db_txn = getattr(txn, '_db_txn', None)
+        if db_txn is None or db_txn['snapshot'] is None:
+            return self._seq
+        return db_txn['snapshot']
+
+    def _get(self, txn, oid, snapshot=None):
+        db_txn = getattr(txn, '_db_txn', None)
+        if db_txn is not None:
+            if oid in db_txn['deleted']:
+                return None
+            if oid in db_txn['objects']:
+                return db_txn['objects'][oid][1]
+        if snapshot is None:
+            snapshot = self._get_snapshot(txn)
+        for seq, row in reversed(self._versions.get(oid, [])):
+            if seq <= snapshot:
+                return row
+        return None
+
+    def _get_latest(self, oid):
+        versions = self._versions.get(oid)
+        if versions:
+            return versions[-1][1]
+        return None
+
+    def _get_below(self, txn, index, oid, key):
+        '''
+        Rows of the snapshot of the transaction stored below an object
+        '''
+        candidates = index.get(oid, set())
+        # forget objects whose versions were all pruned
+        candidates.difference_update([
+            candidate for candidate in candidates if candidate not in self._versions])
+        candidates = set(candidates)
+        db_txn = getattr(txn, '_db_txn', None)
+        if db_txn is not None:
+            candidates.update(db_txn['objects'])
+        snapshot = self._get_snapshot(txn)
+        rows = []
+        for candidate in candidates:
+            row = self._get(txn, candidate, snapshot)
+            if row is not None and row[key] == oid:
+                rows.append(row)
+        rows.sort(key=lambda row: row['id'])
+        return rows
+
+    def _get_named(self, txn, index, oid, key, id):
+        '''
+        Row of the snapshot of the transaction stored below an object with
+        an id
+        '''
+        candidates = set(index.get((oid, id), ()))
+        db_txn = getattr(txn, '_db_txn', None)
+        if db_txn is not None:
+            candidates.update(db_txn['objects'])
+        snapshot = self._get_snapshot(txn)
+        for candidate in candidates:
+            row = self._get(txn, candidate, snapshot)
+            if row is not None and row[key] == oid and row['id'] == id:
+                return row
+
+    def _index_keys(self, row):
+        if row['parent_id'] is not None:
+            yield self._child_ids, (row['parent_id'], row['id'])
+        if row['of'] is not None:
+            yield self._annotation_ids, (row['of'], row['id'])
+
+    def _get_children(self, txn, oid):
+        return self._get_below(txn, self._children, oid, 'parent_id')
+
+    def _get_annotations(self, txn, oid):
+        return self._get_below(txn, self._annotations, oid, 'of')
+
+    async def load(self, txn, oid):
+        await self._query()
+        row = self._get(txn, oid)
+        if row is None:
+            raise KeyError(oid)
+        return row
+
+    def get_txn(self, txn):
+        if not getattr(txn, '_db_txn', None):
+            txn._db_txn = {
+                'snapshot': None,
+                'objects': {},
+                'deleted': [],
+                'blobs': [],
+                'deleted_blobs': []
+            }
+        return txn._db_txn
+
+    async def start_transaction(self, txn, retries=0):
+        await self._query()
+        db_txn = self.get_txn(txn)
+        self._release_snapshot(db_txn)
+        db_txn['snapshot'] = self._seq
+        self._snapshots[self._seq] = self._snapshots.get(self._seq, 0) + 1
+
+    def _release_snapshot(self, db_txn):
+        snapshot = db_txn['snapshot']
+        if snapshot is None:
+            return
+        db_txn['snapshot'] = None
+        self._snapshots[snapshot] -= 1
+        if self._snapshots[snapshot] == 0:
+            del self._snapshots[snapshot]
+
+    async def store(self, oid, old_serial, writer, obj, txn):
+        assert oid is not None
+        await self._query()
+        pickled = writer.serialize()  # This calls __getstate__ of obj
+        json = await writer.get_json()
+        part = writer.part
+        if part is None:
+            part = 0
+        update = not obj.__new_marker__ and obj._p_serial is not None
+        self.get_txn(txn)['objects'][oid] = (update, {
+            'zoid': oid,
+            'tid': txn._tid,
+            'size': len(pickled),
+            'part': part,
+            'resource': writer.resource,
+            'of': writer.of,
+            'serial': old_serial,
+            'parent_id': writer.parent_id,
+            'id': writer.id,
+            'type': writer.type,
+            'json': json,
+            'state': pickled
+        }, writer)
+        await txn._cache.store_object(obj, pickled)
+
+    async def delete(self, txn, oid):
+        await self._query()
+        self.get_txn(txn)['deleted'].append(oid)
+
+    async def get_next_tid(self, txn):
+        await self._query()
+        self._tid += 1
+        return self._tid
+
+    async def get_current_tid(self, txn):
+        await self._query()
+        return self._current_tid
+
+    async def last_transaction(self, txn):
+        return self._current_tid
+
+    async def get_conflicts(self, txn):
+        await self._query()
+        conflicts = []
+        for oid in txn.modified.keys():
+            row = self._get_latest(oid)
+            if row is not None and row['tid'] > txn._tid:
+                conflicts.append(row)
+        return conflicts
+
+    def _check(self, transaction, db_txn):
+        deleted = set(db_txn['deleted'])
+        ids = {}
+        for oid, (update, row, writer) in db_txn['objects'].items():
+            existing = self._get_latest(oid)
+            if update and (existing is None or existing['tid'] != row['serial']):
+                raise TIDConflictError(
+                    f'Mismatch of tid of object being updated. Another '
+                    f'transaction committed a change to the object first. '
+                    f'This should resolve on request retry.',
+                    oid, transaction, row['serial'], writer)
+            for key in ('parent_id', 'of'):
+                if (row[key] is not None and row[key] not in db_txn['objects'] and
+                        self._get_latest(row[key]) is None):
+                    raise TIDConflictError(
+                        f'Bad value inserting into database that could be caused '
+                        f'by a bad cache value. This should resolve on request retry.',
+                        oid, transaction, row['serial'], writer)
+            if row['parent_id'] is None:
+                continue
+            key = (row['parent_id'], row['id'])
+            if key in ids:
+                raise ConflictIdOnContainer(Exception('Duplicate id'))
+            ids[key] = oid
+            if existing is not None and (existing['parent_id'], existing['id']) == key:
+                continue
+            # look in the objects stored with the same id
+            for child in self._child_ids.get(key, ()):
+                if child == oid or child in deleted:
+                    continue
+                if child in db_txn['objects']:
+                    other = db_txn['objects'][child][1]
+                else:
+                    other = self._get_latest(child)
+                if other is not None and (other['parent_id'], other['id']) == key:
+                    raise ConflictIdOnContainer(Exception('Duplicate id'))
+
+    def _get_deleted(self, db_txn):
+        # children and annotations are deleted with their parent
+        deleted = set()
+        stack = list(db_txn['deleted'])
+        while len(stack) > 0:
+            oid = stack.pop()
+            if oid in deleted:
+                continue
+            deleted.add(oid)
+            for index, key in ((self._children, 'parent_id'), (self._annotations, 'of')):
+                for child in index.get(oid, ()):
+                    row = self._get_latest(child)
+                    if row is not None and row[key] == oid:
+                        stack.append(child)
+                for child, (update, row, writer) in db_txn['objects'].items():
+                    if row[key] == oid:
+                        stack.append(child)
+        return deleted
+
+    async def commit(self, transaction):
+        db_txn = transaction._db_txn
+        if not db_txn:
+            return transaction._tid
+        try:
+            await self._query()
+            try:
+                self._check(transaction, db_txn)
+            except (TIDConflictError, ConflictIdOnContainer):
+                self._metrics['conflicts'] += 1
+                raise
+            self._apply(transaction, db_txn)
+        finally:
+            self._release_snapshot(db_txn)
+            transaction._db_txn = None
+        return transaction._tid
+
+    def _apply(self, transaction, db_txn):
+        self._seq += 1
+        seq = self._seq
+        deleted = self._get_deleted(db_txn)
+        changed = set(deleted)
+        for oid, (update, row, writer) in db_txn['objects'].items():
+            if oid in deleted:
+                continue
+            self._versions.setdefault(oid, []).append((seq, row))
+            if row['parent_id'] is not None:
+                self._children.setdefault(row['parent_id'], set()).add(oid)
+            if row['of'] is not None:
+                self._annotations.setdefault(row['of'], set()).add(oid)
+            for index, key in self._index_keys(row):
+                index.setdefault(key, set()).add(oid)
+            changed.add(oid)
+        for oid in deleted:
+            if self._get_latest(oid) is not None:
+                self._versions[oid].append((seq, None))
+
+        for bid in db_txn['deleted_blobs']:
+            self._blobs.pop(bid, None)
+        for bid, blob in list(self._blobs.items()):
+            if blob['oid'] in deleted:
+                del self._blobs[bid]
+        for bid, oid, chunk_index, data in db_txn['blobs']:
+            chunks = self._blobs.setdefault(bid, {'oid': oid, 'chunks': {}})['chunks']
+            chunks[chunk_index] = data
+
+        self._current_tid = max(self._current_tid, transaction._tid)
+        self._metrics['commits'] += 1
+        self._prune(changed)
+
+    def _prune(self, oids):
+        '''
+        Drop the versions no open db transaction can read anymore
+        '''
+        oldest = min(self._snapshots) if self._snapshots else self._seq
+        for oid in oids:
+            versions = self._versions.get(oid)
+            if versions is None:
+                continue
+            idx = len(versions) - 1
+            while idx > 0 and versions[idx][0] > oldest:
+                idx -= 1
+            pruned = versions[:idx]
+            del versions[:idx]
+            kept = {key for seq, row in versions if row is not None
+                    for index, key in self._index_keys(row)}
+            for seq, row in pruned:
+                if row is None:
+                    continue
+                for index, key in self._index_keys(row):
+                    if key in kept or key not in index:
+                        continue
+                    index[key].discard(oid)
+                    if len(index[key]) == 0:
+                        del index[key]
+            if len(versions) == 1 and versions[0][1] is None:
+                del self._versions[oid]
+                self._children.pop(oid, None)
+                self._annotations.pop(oid, None)
+
+    async def abort(self, transaction):
+        db_txn = getattr(transaction, '_db_txn', None)
+        if db_txn:
+            self._release_snapshot(db_txn)
+        transaction._db_txn = None
+
+    # Introspection
+
+    async def get_page_of_keys(self, txn, oid, page=1, page_size=1000):
+        await self._query()
+        start = (page - 1) * page_size
+        return [row['id'] for row in self._get_children(txn, oid)[start:start + page_size]]
+
+    async def keys(self, txn, oid):
+        await self._query()
+        return self._get_children(txn, oid)
+
+    async def get_child(self, txn, parent_oid, id):
+        await self._query()
+        return self._get_named(txn, self._child_ids, parent_oid, 'parent_id', id)
+
+    async def get_children(self, txn, parent_oid, ids):
+        await self._query()
+        rows = []
+        for id in sorted(set(ids)):
+            row = self._get_named(txn, self._child_ids, parent_oid, 'parent_id', id)
+            if row is not None:
+                rows.append(row)
+        return rows
+
+    async def has_key(self, txn, parent_oid, id):
+        return await self.get_child(txn, parent_oid, id) is not None
+
+    async def len(self, txn, oid):
+        await self._query()
+        return len(self._get_children(txn, oid))
+
+    async def items(self, txn, oid, metadata_only=False):
+        await self._query()
+        for row in self._get_children(txn, oid):
+            yield row
+
+    async def get_annotation(self, txn, oid, id):
+        await self._query()
+        return self._get_named(txn, self._annotation_ids, oid, 'of', id)
+
+    async def get_annotation_keys(self, txn, oid):
+        await self._query()
+        return self._get_annotations(txn, oid)
+
+    async def write_blob_chunk(self, txn, bid, oid, chunk_index, data):
+        await self._query()
+        self.get_txn(txn)['blobs'].append((bid, oid, chunk_index, bytes(data)))
+
+    async def read_blob_chunk(self, txn, bid, chunk=0):
+        await self._query()
+        # chunks written by the transaction are not committed yet
+        for chunk_bid, oid, chunk_index, data in (txn._db_txn or {}).get('blobs', []):
+            if chunk_bid == bid and chunk_index == chunk:
+                return {
+                    'data': data
+                }
+        blob = self._blobs.get(bid)
+        if blob is None or chunk not in blob['chunks']:
+            return None
+        return {
+            'data': blob['chunks'][chunk]
+        }
+
+    async def read_blob_chunks(self, txn, bid):
+        await self._query()
+        blob = self._blobs.get(bid, {'chunks': {}})
+        for chunk_index in sorted(blob['chunks']):
+            yield {
+                'data': blob['chunks'][chunk_index]
+            }
+
+    async def get_page_of_blobs(self, txn, page=1, page_size=1000):
+        await self._query()
+        blobs = sorted((blob['oid'], bid) for bid, blob in self._blobs.items())
+        start = (page - 1) * page_size
+        return [{'bid': bid, 'zoid': oid} for oid, bid in blobs[start:start + page_size]]
+
+    async def del_blob(self, txn, bid):
+        await self._query()
+        self.get_txn(txn)['deleted_blobs'].append(bid)
+
+    def _get_rows(self, txn):
+        snapshot = self._get_snapshot(txn)
+        for oid in self._versions:
+            row = self._get(None, oid, snapshot)
+            if row is not None:
+                yield row
+
+    async def get_total_number_of_objects(self, txn):
+        await self._query()
+        return len(list(self._get_rows(txn)))
+
+    async def get_total_number_of_resources(self, txn):
+        await self._query()
+        return len([row for row in self._get_rows(txn) if row['resource']])
+
+    async def get_total_resources_of_type(self, txn, type_):
+        await self._query()
+        return len([row for row in self._get_rows(txn) if row['type'] == type_])
+
+    # Massive treatment without security
+    async def _get_page_resources_of_type(self, txn, type_, page, page_size,
+                                          metadata_only=False):
+        await self._query()
+        rows = sorted((row for row in self._get_rows(txn) if row['type'] == type_),
+                      key=lambda row: row['zoid'])
+        start = (page - 1) * page_size
+        return rows[start:start + page_size]
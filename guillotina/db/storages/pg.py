@@ -1,5 +1,7 @@
 import asyncio
+import collections
 import concurrent
+import hashlib
 import logging
 import time
 from asyncio import shield
@@ -8,15 +10,20 @@ import asyncpg
 import asyncpg.connection
 import ujson
 from guillotina._settings import app_settings
+from guillotina.db import READ_LSN_COOKIE
+from guillotina.db import READ_LSN_HEADER
 from guillotina.db import TRASHED_ID
 from guillotina.db.interfaces import IPostgresStorage
+from guillotina.db.interfaces import IWriter
 from guillotina.db.oid import MAX_OID_LENGTH
+from guillotina.db.reader import reader
 from guillotina.db.storages.base import BaseStorage
 from guillotina.db.storages.utils import SQLStatements
 from guillotina.db.storages.utils import get_table_definition
 from guillotina.db.storages.utils import register_sql
 from guillotina.exceptions import ConflictError
 from guillotina.exceptions import ConflictIdOnContainer
+from guillotina.exceptions import PoolExhaustedError
 from guillotina.exceptions import TIDConflictError
 from guillotina.profile import profilable
 from zope.interface import implementer
@@ -58,6 +65,20 @@ FROM {{table_name}}
 WHERE parent_id = $1::varchar({MAX_OID_LENGTH}) AND id = ANY($2)
 """)
 
+# metadata queries only send the state of rows that can not be used
+# without it, local roles and marker interfaces are part of the state.
+# Compressed states can not be searched and are always sent.
+METADATA_STATE = """CASE WHEN substring(state FROM 1 FOR 1) NOT IN ('\\x80'::bytea, '\\x01'::bytea)
+            OR position(convert_to('__acl__', 'UTF8') IN state) > 0
+            OR position(convert_to('__provides__', 'UTF8') IN state) > 0
+       THEN state END AS state"""
+
+register_sql('GET_CHILDREN_BATCH_METADATA', f"""
+SELECT zoid, tid, state_size, resource, type, {METADATA_STATE}, id
+FROM {{table_name}}
+WHERE parent_id = $1::varchar({MAX_OID_LENGTH}) AND id = ANY($2)
+""")
+
 register_sql('EXIST_CHILD', f"""
 SELECT zoid
 FROM {{table_name}}
@@ -136,8 +157,98 @@ register_sql(
 register_sql('NAIVE_UPDATE', _wrap_return_count(NAIVE_UPDATE))
 
 
+# update many objects at once, only the rows with matching tids are returned
+register_sql('BATCH_UPDATE', f"""
+UPDATE {{table_name}} AS ob
+SET
+    tid = $1::int,
+    state_size = u.state_size,
+    part = u.part,
+    resource = u.resource,
+    of = u.of,
+    otid = u.otid,
+    parent_id = u.parent_id,
+    id = u.id,
+    type = u.type,
+    json = u.json::json,
+    state = u.state
+FROM unnest(
+    $2::varchar({MAX_OID_LENGTH})[], $3::int[], $4::int[], $5::boolean[],
+    $6::varchar({MAX_OID_LENGTH})[], $7::int[], $8::varchar({MAX_OID_LENGTH})[],
+    $9::text[], $10::text[], $11::text[], $12::bytea[])
+    AS u(zoid, state_size, part, resource, of, otid, parent_id, id, type, json, state)
+WHERE
+    ob.zoid = u.zoid AND ob.tid = u.otid
+RETURNING ob.zoid""")
+
+
+# json of objects whose state did not change, rows are only written when
+# it is different
+register_sql('UPDATE_CHANGED_JSON', f"""
+UPDATE {{table_name}} AS ob
+SET json = u.json::json
+FROM unnest($1::varchar({MAX_OID_LENGTH})[], $2::text[]) AS u(zoid, json)
+WHERE ob.zoid = u.zoid AND ob.json IS DISTINCT FROM u.json::jsonb""")
+
+
+# objects stored without their json column until the projector fills it
+register_sql('CREATE_JSON_QUEUE', f"""
+CREATE TABLE IF NOT EXISTS {{table_name}}_json_queue (
+    zoid VARCHAR({MAX_OID_LENGTH}) NOT NULL PRIMARY KEY
+        REFERENCES {{table_name}} ON DELETE CASCADE,
+    tid BIGINT NOT NULL,
+    attempts INT NOT NULL DEFAULT 0,
+    retry_at TIMESTAMP WITH TIME ZONE
+);
+CREATE INDEX IF NOT EXISTS {{table_name}}_json_queue_tid ON {{table_name}}_json_queue (tid);
+""")
+
+register_sql('QUEUE_JSON', f"""
+INSERT INTO {{table_name}}_json_queue (zoid, tid)
+SELECT unnest($1::varchar({MAX_OID_LENGTH})[]), $2::bigint
+ON CONFLICT (zoid) DO UPDATE SET tid = EXCLUDED.tid, attempts = 0, retry_at = NULL""")
+
+# rows being written by an open transaction are left for the next batch
+register_sql('CLAIM_JSON_QUEUE', f"""
+SELECT q.zoid, q.tid
+FROM {{table_name}}_json_queue q
+WHERE q.retry_at IS NULL OR q.retry_at <= now()
+ORDER BY q.tid
+LIMIT $1::int
+FOR UPDATE SKIP LOCKED""")
+
+register_sql('UPDATE_JSON', f"""
+UPDATE {{table_name}} AS ob
+SET json = u.json::json
+FROM unnest($1::varchar({MAX_OID_LENGTH})[], $2::bigint[], $3::text[])
+    AS u(zoid, tid, json)
+WHERE ob.zoid = u.zoid AND ob.tid = u.tid AND ob.zoid IN (
+    SELECT zoid FROM {{table_name}}
+    WHERE zoid = ANY($1::varchar({MAX_OID_LENGTH})[])
+    FOR UPDATE SKIP LOCKED)
+RETURNING ob.zoid""")
+
+register_sql('DELETE_JSON_QUEUE', f"""
+DELETE FROM {{table_name}}_json_queue
+WHERE zoid = ANY($1::varchar({MAX_OID_LENGTH})[])""")
+
+# objects that failed are retried later with an increasing delay
+register_sql('RETRY_JSON_QUEUE', f"""
+UPDATE {{table_name}}_json_queue
+SET attempts = attempts + 1,
+    retry_at = now() + least(2 ^ attempts, $2::int) * interval '1 second'
+WHERE zoid = ANY($1::varchar({MAX_OID_LENGTH})[])""")
+
+# do not wait for objects that failed
+register_sql('MIN_JSON_QUEUE_TID',
+             "SELECT min(tid) FROM {table_name}_json_queue WHERE attempts = 0")
+
+
 NEXT_TID = "SELECT nextval('tid_sequence');"
+NEXT_TID_BLOCK = "SELECT nextval('tid_sequence') AS tid FROM generate_series(1, $1::int);"
 MAX_TID = "SELECT last_value FROM tid_sequence;"
+CURRENT_WAL_LSN = "SELECT pg_current_wal_lsn()::text;"
+REPLAY_WAL_LSN = "SELECT pg_last_wal_replay_lsn()::text;"
 
 
 register_sql(
@@ -148,6 +259,8 @@ register_sql(
 register_sql('NUM_ROWS', "SELECT count(*) FROM {table_name}")
 
 
+
+
 register_sql('NUM_RESOURCES', "SELECT count(*) FROM {table_name} WHERE resource is TRUE")
 
 register_sql(
@@ -163,6 +276,15 @@ LIMIT $2::int
 OFFSET $3::int
 """)
 
+register_sql('RESOURCES_BY_TYPE_METADATA', f"""
+SELECT zoid, tid, state_size, resource, type, {METADATA_STATE}, id
+FROM {{table_name}}
+WHERE type=$1::TEXT
+ORDER BY zoid
+LIMIT $2::int
+OFFSET $3::int
+""")
+
 
 register_sql('GET_CHILDREN', f"""
 SELECT zoid, tid, state_size, resource, type, state, id
@@ -170,6 +292,12 @@ FROM {{table_name}}
 WHERE parent_id = $1::VARCHAR({MAX_OID_LENGTH})
 """)
 
+register_sql('GET_CHILDREN_METADATA', f"""
+SELECT zoid, tid, state_size, resource, type, {METADATA_STATE}, id
+FROM {{table_name}}
+WHERE parent_id = $1::VARCHAR({MAX_OID_LENGTH})
+""")
+
 
 register_sql('TRASH_PARENT_ID', f"""
 UPDATE {{table_name}}
@@ -195,6 +323,87 @@ AND chunk_index = $2::int
 """)
 
 
+register_sql('READ_BLOB_CHUNK_BATCH', f"""
+SELECT * from {{table_name}}
+WHERE bid = $1::VARCHAR({MAX_OID_LENGTH})
+AND chunk_index = ANY($2::int[])
+""")
+
+
+# chunks are stored once by the sha256 of their data and referenced by
+# the rows of the blobs table, a trigger drops the ones no row refers to
+register_sql('CREATE_BLOB_CHUNKS', """
+ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS hash VARCHAR(64);
+CREATE TABLE IF NOT EXISTS {table_name}_chunks (
+    hash VARCHAR(64) NOT NULL PRIMARY KEY,
+    refcount INT NOT NULL,
+    data BYTEA
+);
+CREATE OR REPLACE FUNCTION {table_name}_chunks_decref() RETURNS trigger AS $$
+BEGIN
+    UPDATE {table_name}_chunks SET refcount = refcount - 1 WHERE hash = OLD.hash;
+    DELETE FROM {table_name}_chunks WHERE hash = OLD.hash AND refcount <= 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+""")
+
+register_sql('CREATE_BLOB_CHUNKS_TRIGGER', """
+CREATE TRIGGER {table_name}_chunks_decref
+AFTER DELETE ON {table_name}
+FOR EACH ROW WHEN (OLD.hash IS NOT NULL)
+EXECUTE PROCEDURE {table_name}_chunks_decref()
+""")
+
+register_sql('HAS_BLOB_CHUNK_DATA', """
+SELECT 1 FROM {table_name}_chunks WHERE hash = $1::VARCHAR(64)
+""")
+
+# references to chunks that were already stored are counted at commit so
+# rows of shared chunks are only locked while committing, rows are locked
+# in the order of their hash to not deadlock with other commits
+register_sql('INCREF_BLOB_CHUNKS', """
+WITH refs AS (
+    SELECT * FROM unnest($1::VARCHAR(64)[], $2::INT[]) AS r(hash, count)
+), locked AS (
+    SELECT hash FROM {table_name}_chunks
+    WHERE hash IN (SELECT hash FROM refs)
+    ORDER BY hash FOR UPDATE
+)
+UPDATE {table_name}_chunks c SET refcount = c.refcount + refs.count
+FROM refs, locked
+WHERE c.hash = refs.hash AND locked.hash = refs.hash
+""")
+
+# concurrent writers of the same new chunk only store its data once
+register_sql('INSERT_BLOB_CHUNK_DATA', """
+INSERT INTO {table_name}_chunks (hash, refcount, data)
+VALUES ($1::VARCHAR(64), 1, $2::BYTEA)
+ON CONFLICT (hash) DO UPDATE SET refcount = {table_name}_chunks.refcount + 1
+""")
+
+register_sql('INSERT_BLOB_CHUNK_REF', f"""
+INSERT INTO {{table_name}}
+(bid, zoid, chunk_index, hash)
+VALUES ($1::VARCHAR({MAX_OID_LENGTH}), $2::VARCHAR({MAX_OID_LENGTH}),
+        $3::INT, $4::VARCHAR(64))
+""")
+
+register_sql('READ_BLOB_CHUNK_REF', f"""
+SELECT b.bid, b.zoid, b.chunk_index, COALESCE(b.data, c.data) AS data
+FROM {{table_name}} b LEFT JOIN {{table_name}}_chunks c ON c.hash = b.hash
+WHERE b.bid = $1::VARCHAR({MAX_OID_LENGTH})
+AND b.chunk_index = $2::int
+""")
+
+register_sql('READ_BLOB_CHUNK_REF_BATCH', f"""
+SELECT b.bid, b.zoid, b.chunk_index, COALESCE(b.data, c.data) AS data
+FROM {{table_name}} b LEFT JOIN {{table_name}}_chunks c ON c.hash = b.hash
+WHERE b.bid = $1::VARCHAR({MAX_OID_LENGTH})
+AND b.chunk_index = ANY($2::int[])
+""")
+
+
 register_sql('DELETE_BLOB', f"""
 DELETE FROM {{table_name}} WHERE bid = $1::VARCHAR({MAX_OID_LENGTH});
 """)
@@ -218,6 +427,14 @@ LIMIT $2::int
 OFFSET $3::int
 """)
 
+register_sql('BATCHED_GET_BLOBS', """
+SELECT DISTINCT bid, zoid
+FROM {table_name}
+ORDER BY zoid, bid
+LIMIT $1::int
+OFFSET $2::int
+""")
+
 register_sql('DELETE_OBJECT', f"""
 DELETE FROM {{table_name}}
 WHERE zoid = $1::varchar({MAX_OID_LENGTH});
@@ -239,6 +456,27 @@ RETURNING id;
 BAD_CONNECTION_RESTART_DELAY = 0.25
 
 
+def parse_lsn(value):
+    '''
+    Convert a textual wal position (`16/B374D848`) to an integer
+    '''
+    try:
+        high, low = value.split('/')
+        return (int(high, 16) << 32) + int(low, 16)
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def get_request_lsn(request):
+    '''
+    Get the wal position of the last commit the client of the request has seen
+    '''
+    value = request.headers.get(READ_LSN_HEADER)
+    if value is None:
+        value = request.cookies.get(READ_LSN_COOKIE)
+    return parse_lsn(value)
+
+
 class LightweightConnection(asyncpg.connection.Connection):
     '''
     See asyncpg.connection.Connection._get_reset_query to see
@@ -342,6 +580,361 @@ class PGVacuum:
         await self._queue.join()
 
 
+class PGJSONProjector:
+    '''
+    Fill the json column of objects stored with `deferred_json` after
+    their transaction committed.
+
+    Every process works on the same queue table, rows are claimed with
+    SKIP LOCKED so a batch is only projected once.
+    '''
+
+    # seconds, objects that failed are retried after 1, 2, 4... seconds
+    _max_retry_delay = 300
+
+    def __init__(self, storage, loop, batch_size=100, interval=1.0):
+        self._storage = storage
+        self._loop = loop
+        self._batch_size = batch_size
+        self._interval = interval
+        self._wakeup = asyncio.Event(loop=loop)
+        self._closed = False
+        self._projected = 0
+
+    async def initialize(self):
+        while not self._closed:
+            try:
+                projected = await self.project()
+            except (concurrent.futures.CancelledError, RuntimeError):
+                # we're okay with the task getting cancelled
+                return
+            except Exception:
+                log.warning('Error projecting json of objects', exc_info=True)
+                projected = 0
+            if projected < self._batch_size:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self._interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    def wake(self):
+        self._wakeup.set()
+
+    async def project(self):
+        storage = self._storage
+        table_name = storage._objects_table_name
+        conn = await storage.open()
+        try:
+            async with conn.transaction():
+                claimed = await conn.fetch(
+                    storage._sql.get('CLAIM_JSON_QUEUE', table_name), self._batch_size)
+                if len(claimed) == 0:
+                    return 0
+                columns, stale, failed = await self.get_json(claimed)
+                result = await conn.fetch(
+                    storage._sql.get('UPDATE_JSON', table_name), *columns)
+                projected = [record['zoid'] for record in result]
+                # objects locked by a transaction writing them stay queued,
+                # rows of deleted objects and of versions that are not
+                # current anymore are removed
+                await conn.execute(
+                    storage._sql.get('DELETE_JSON_QUEUE', table_name),
+                    projected + stale)
+                if len(failed) > 0:
+                    await conn.execute(
+                        storage._sql.get('RETRY_JSON_QUEUE', table_name),
+                        failed, self._max_retry_delay)
+        finally:
+            await storage.close(conn)
+        self._projected += len(projected)
+        return len(projected)
+
+    async def get_json(self, claimed):
+        from guillotina.db.cache.dummy import DummyCache
+        from guillotina.db.transaction_manager import TransactionManager
+        from guillotina.tests.utils import get_mocked_request
+        from guillotina.tests.utils import login
+        # security indexes are computed with the interaction of a request,
+        # get_current_request finds it in this frame
+        request = get_mocked_request()
+        login(request)
+        tm = TransactionManager(self._storage)
+        txn = await tm.begin(request=request)
+        # a cached state of an annotation could be older than the object
+        txn._cache = DummyCache(txn)
+        columns = ([], [], [])
+        stale = []
+        failed = []
+        parents = {}
+        try:
+            for record in claimed:
+                try:
+                    ob = await self._load(txn, record['zoid'], parents)
+                    if ob._p_serial != record['tid']:
+                        stale.append(record['zoid'])
+                        continue
+                    json = await IWriter(ob).get_json()
+                except KeyError:
+                    stale.append(record['zoid'])
+                    continue
+                except Exception:
+                    # retried later instead of blocking the queue
+                    log.warning(f'Error projecting json of object {record["zoid"]}',
+                                exc_info=True)
+                    failed.append(record['zoid'])
+                    continue
+                values = (ob._p_oid, ob._p_serial, ujson.dumps(json))
+                for column, value in zip(columns, values):
+                    column.append(value)
+        finally:
+            await tm.abort(txn=txn)
+        return columns, stale, failed
+
+    async def _load(self, txn, oid, parents):
+        # catalog data like the path needs the parents of the object
+        row = await self._storage.load(txn, oid)
+        ob = reader(row)
+        ob._p_jar = txn
+        parent_id = row['parent_id']
+        if parent_id == TRASHED_ID:
+            # deleted, the vacuum removes it from the queue
+            raise KeyError(oid)
+        if parent_id is not None:
+            if parent_id not in parents:
+                parents[parent_id] = await self._load(txn, parent_id, parents)
+            ob.__parent__ = parents[parent_id]
+        return ob
+
+    def get_metrics(self):
+        return {
+            'batch_size': self._batch_size,
+            'projected': self._projected
+        }
+
+    async def finalize(self):
+        self._closed = True
+        self.wake()
+
+
+class PGTIDAllocator:
+    '''
+    Reserve blocks of tids from the sequence and hand them out without
+    querying the database for every transaction.
+
+    A new block is requested in the background before the current one
+    runs out. Blocks are always reserved after the previous one so tids
+    given out by an allocator keep increasing.
+    '''
+
+    def __init__(self, storage, block_size):
+        self._storage = storage
+        self._block_size = block_size
+        self._low_water = max(block_size // 4, 1)
+        self._tids = collections.deque()
+        self._refill_task = None
+        self._allocated = 0
+        self._refills = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    async def get_next_tid(self):
+        if len(self._tids) <= self._low_water:
+            self._schedule_refill()
+        if len(self._tids) == 0:
+            self._waits += 1
+            start = time.time()
+            try:
+                while len(self._tids) == 0:
+                    self._schedule_refill()
+                    await shield(self._refill_task)
+            finally:
+                self._wait_time += time.time() - start
+        self._allocated += 1
+        return self._tids.popleft()
+
+    def _schedule_refill(self):
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self._refill())
+            self._refill_task.add_done_callback(self._refill_done)
+
+    def _refill_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            log.warning('Error reserving block of tids', exc_info=task.exception())
+
+    async def _refill(self):
+        conn = await self._storage.open()
+        try:
+            records = await conn.fetch(NEXT_TID_BLOCK, self._block_size)
+        finally:
+            await self._storage.close(conn)
+        self._tids.extend(sorted([record['tid'] for record in records]))
+        self._refills += 1
+
+    def get_metrics(self):
+        return {
+            'block_size': self._block_size,
+            'available': len(self._tids),
+            'allocated': self._allocated,
+            'refills': self._refills,
+            'waits': self._waits,
+            'wait_time': self._wait_time
+        }
+
+    async def finalize(self):
+        if self._refill_task is not None:
+            self._refill_task.cancel()
+
+
+class PGPoolMonitor:
+    '''
+    Keep track of the connections used from a pool.
+
+    In adaptive mode, the number of connections that can be used starts at
+    `size` and grows up to `max_size` while callers keep waiting for a
+    connection. It shrinks again when the connections are not all in use
+    for a while; idle connections are then closed by asyncpg.
+
+    With `max_waiters`, callers fail right away with PoolExhaustedError
+    instead of waiting when that many are already waiting.
+    '''
+
+    buckets = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+    def __init__(self, size, max_size=None, max_waiters=None,
+                 grow_after=0.1, shrink_after=60):
+        self._size = self._min_size = size
+        self._max_size = max(max_size or size, size)
+        self._max_waiters = max_waiters
+        self._grow_after = grow_after
+        self._shrink_after = shrink_after
+        self._connections = set()
+        # slots given out to callers that are still acquiring a connection
+        self._reserved = 0
+        self._waiters = collections.deque()
+        self._grow_handle = None
+        self._last_full = time.time()
+        self._histogram = [0] * (len(self.buckets) + 1)
+        self._acquired = 0
+        self._rejected = 0
+        self._timeouts = 0
+
+    @property
+    def max_size(self):
+        return self._max_size
+
+    @property
+    def in_use(self):
+        return len(self._connections)
+
+    def owns(self, conn):
+        return conn in self._connections
+
+    async def acquire(self, pool, timeout):
+        start = time.time()
+        if self.in_use + self._reserved >= self._size or len(self._waiters) > 0:
+            if self._max_waiters is not None and len(self._waiters) >= self._max_waiters:
+                self._rejected += 1
+                raise PoolExhaustedError(
+                    f'{len(self._waiters)} waiting for a database connection')
+            await self._wait(timeout)
+        else:
+            self._reserved += 1
+        try:
+            remaining = None
+            if timeout is not None:
+                remaining = max(timeout - (time.time() - start), 0)
+            conn = await pool.acquire(timeout=remaining)
+            self._connections.add(conn)
+        except asyncio.TimeoutError:
+            self._timeouts += 1
+            raise
+        finally:
+            self._reserved -= 1
+            self._wake()
+        if self.in_use >= self._size:
+            self._last_full = time.time()
+        self._acquired += 1
+        self._observe(time.time() - start)
+        return conn
+
+    async def _wait(self, timeout):
+        waiter = asyncio.get_event_loop().create_future()
+        self._waiters.append(waiter)
+        self._schedule_grow()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as ex:
+            if waiter.done() and not waiter.cancelled():
+                # got a slot right when giving up, pass it on
+                self._reserved -= 1
+                self._wake()
+            if isinstance(ex, asyncio.TimeoutError):
+                self._timeouts += 1
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+
+    def release(self, conn):
+        if conn not in self._connections:
+            return False
+        self._connections.discard(conn)
+        if (self._size > self._min_size and len(self._waiters) == 0 and
+                time.time() - self._last_full > self._shrink_after):
+            self._size -= 1
+            self._last_full = time.time()
+        self._wake()
+        return True
+
+    def _wake(self):
+        while len(self._waiters) > 0 and self.in_use + self._reserved < self._size:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                # slot is handed over to the waiter
+                self._reserved += 1
+                waiter.set_result(None)
+
+    def _schedule_grow(self):
+        if self._grow_handle is None and self._size < self._max_size:
+            self._grow_handle = asyncio.get_event_loop().call_later(
+                self._grow_after, self._grow)
+
+    def _grow(self):
+        self._grow_handle = None
+        if len(self._waiters) > 0 and self._size < self._max_size:
+            # callers waited too long, use another connection
+            self._size += 1
+            self._wake()
+            self._schedule_grow()
+
+    def _observe(self, duration):
+        for idx, bucket in enumerate(self.buckets):
+            if duration <= bucket:
+                break
+        else:
+            idx = len(self.buckets)
+        self._histogram[idx] += 1
+
+    def get_metrics(self):
+        histogram = {}
+        for bucket, count in zip(self.buckets, self._histogram):
+            histogram[f'<={bucket}'] = count
+        histogram['>{}'.format(self.buckets[-1])] = self._histogram[-1]
+        return {
+            'size': self._size,
+            'min_size': self._min_size,
+            'max_size': self._max_size,
+            'in_use': self.in_use,
+            'idle': max(self._size - self.in_use, 0),
+            'waiters': len(self._waiters),
+            'acquired': self._acquired,
+            'rejected': self._rejected,
+            'timeouts': self._timeouts,
+            'acquire_time': histogram
+        }
+
+
 @implementer(IPostgresStorage)
 class PostgresqlStorage(BaseStorage):
     """Storage to a relational database, based on invalidation polling"""
@@ -352,6 +945,12 @@ class PostgresqlStorage(BaseStorage):
     _pool = None
     _large_record_size = 1 << 24
     _vacuum_class = PGVacuum
+    _tid_allocator_class = PGTIDAllocator
+    _json_projector_class = PGJSONProjector
+    _supports_blob_dedup = True
+    # strategies comparing tids of different transactions need them to be
+    # issued in commit order and can not use pre-allocated blocks of tids
+    _ordered_tid_strategies = ('simple', 'resolve', 'resolve_readcommitted')
     _objects_table_name = 'objects'
     _blobs_table_name = 'blobs'
 
@@ -397,7 +996,10 @@ class PostgresqlStorage(BaseStorage):
     def __init__(self, dsn=None, partition=None, read_only=False, name=None,
                  pool_size=13, transaction_strategy='resolve_readcommitted',
                  conn_acquire_timeout=20, cache_strategy='dummy',
-                 objects_table_name='objects', blobs_table_name='blobs', **options):
+                 objects_table_name='objects', blobs_table_name='blobs',
+                 tid_block_size=1, read_dsn=None, read_pool_size=None,
+                 pool_max_size=None, pool_max_waiters=None, deferred_json=False,
+                 json_batch_size=100, blob_dedup=False, **options):
         super(PostgresqlStorage, self).__init__(
             read_only, transaction_strategy=transaction_strategy,
             cache_strategy=cache_strategy)
@@ -415,8 +1017,52 @@ class PostgresqlStorage(BaseStorage):
         self._objects_table_name = objects_table_name
         self._blobs_table_name = blobs_table_name
         self._sql = SQLStatements()
+        self._read_dsn = read_dsn
+        self._read_pool_size = read_pool_size or pool_size
+        self._read_pool = None
+        self._pool_monitor = PGPoolMonitor(
+            pool_size, max_size=pool_max_size, max_waiters=pool_max_waiters)
+        self._read_pool_monitor = PGPoolMonitor(
+            self._read_pool_size, max_waiters=pool_max_waiters)
+        self._replica_conns = set()
+        self._replica_lsn = 0
+        self._tid_allocator = None
+        if tid_block_size > 1 and self._tid_allocator_class is not None:
+            if transaction_strategy in self._ordered_tid_strategies:
+                log.warning(f'Can not use tid blocks with the {transaction_strategy} '
+                            f'transaction strategy. Allocating tids one by one.')
+            else:
+                self._tid_allocator = self._tid_allocator_class(self, tid_block_size)
+        if deferred_json and self._tid_allocator is not None:
+            # tids of blocks are not committed in order, wait_for_json can
+            # not tell what is projected by the oldest queued tid
+            log.warning('Can not defer json with tid blocks. Writing json on commit.')
+            deferred_json = False
+        self._deferred_json = deferred_json and self._json_projector_class is not None
+        self._json_batch_size = json_batch_size
+        self._json_projector = self._json_projector_task = None
+        if blob_dedup and not self._supports_blob_dedup:
+            log.warning(f'Blob deduplication is not supported by {self.__class__.__name__}')
+        self._blob_dedup = blob_dedup and self._supports_blob_dedup
+
+    @property
+    def tid_allocator(self):
+        return self._tid_allocator
+
+    def get_pool_metrics(self):
+        metrics = {
+            'primary': self._pool_monitor.get_metrics()
+        }
+        if self._read_dsn is not None:
+            metrics['replica'] = self._read_pool_monitor.get_metrics()
+        return metrics
 
     async def finalize(self):
+        if self._tid_allocator is not None:
+            await self._tid_allocator.finalize()
+        if self._json_projector is not None:
+            await self._json_projector.finalize()
+            self._json_projector_task.cancel()
         await self._vacuum.finalize()
         self._vacuum_task.cancel()
         pool = await self.get_pool()
@@ -428,6 +1074,8 @@ class PostgresqlStorage(BaseStorage):
         # this step is happening at the end of application shutdown and
         # connections should not be staying open at this step
         pool.terminate()
+        if self._read_pool is not None:
+            self._read_pool.terminate()
 
     async def create(self):
         # Check DB
@@ -469,10 +1117,11 @@ class PostgresqlStorage(BaseStorage):
         except asyncio.TimeoutError:
             pass
         pool.terminate()
+        self._pool_monitor.release(self._read_conn)
         # re-bind, throw conflict error so the request is restarted...
         self._pool = await asyncpg.create_pool(
             dsn=self._dsn,
-            max_size=self._pool_size,
+            max_size=self._pool_monitor.max_size,
             min_size=2,
             loop=self._pool._loop,
             connection_class=app_settings['pg_connection_class'],
@@ -502,6 +1151,8 @@ WHERE tc.constraint_name = '{}_parent_id_id_key' AND tc.constraint_type = 'UNIQU
         if loop is None:
             loop = asyncio.get_event_loop()
         await self.get_pool(loop)  # initialize
+        if self._read_dsn is not None:
+            await self.get_read_pool(loop)
 
         # shared read connection on all transactions
         self._read_conn = await self.open()
@@ -542,6 +1193,17 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN bid TYPE varchar({MAX_OID_LENG
             await self._read_conn.execute(f'''
 ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LENGTH})''')
 
+        # chunks of blobs written with blob_dedup only have a hash and are
+        # read from the chunks table even when it is turned off again
+        self._blob_hashes = self._blob_dedup
+        if self._blob_dedup and not self._read_only:
+            await self.initialize_blob_dedup()
+        elif self._supports_blob_dedup:
+            self._blob_hashes = await self._read_conn.fetchval('''
+SELECT 1 FROM pg_attribute
+WHERE attrelid = to_regclass($1) AND attname = 'hash' AND NOT attisdropped''',
+                self._blobs_table_name) is not None
+
         self._vacuum = self._vacuum_class(self, loop)
         self._vacuum_task = asyncio.Task(self._vacuum.initialize(), loop=loop)
 
@@ -553,19 +1215,79 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
                         'No database vacuuming will be done here anymore.')
 
         self._vacuum_task.add_done_callback(vacuum_done)
+
+        if self._deferred_json and not self._read_only:
+            await self._read_conn.execute(
+                self._sql.get('CREATE_JSON_QUEUE', self._objects_table_name))
+            self._json_projector = self._json_projector_class(
+                self, loop, batch_size=self._json_batch_size)
+            self._json_projector_task = asyncio.Task(
+                self._json_projector.initialize(), loop=loop)
         self._connection_initialized_on = time.time()
 
+    async def initialize_blob_dedup(self):
+        await self._read_conn.execute(
+            self._sql.get('CREATE_BLOB_CHUNKS', self._blobs_table_name))
+        result = await self._read_conn.fetchval(
+            'SELECT 1 FROM pg_trigger WHERE tgname = $1',
+            f'{self._blobs_table_name}_chunks_decref')
+        if result is None:
+            try:
+                await self._read_conn.execute(
+                    self._sql.get('CREATE_BLOB_CHUNKS_TRIGGER', self._blobs_table_name))
+            except asyncpg.exceptions.DuplicateObjectError:
+                # created by another process at the same time
+                pass
+
     async def get_pool(self, loop=None, **kw):
         if self._pool is None:
             self._pool = await asyncpg.create_pool(
                 dsn=self._dsn,
-                max_size=self._pool_size,
+                max_size=self._pool_monitor.max_size,
                 min_size=2,
                 connection_class=app_settings['pg_connection_class'],
                 loop=loop,
                 **kw)
         return self._pool
 
+    async def get_read_pool(self, loop=None, **kw):
+        if self._read_pool is None:
+            self._read_pool = await asyncpg.create_pool(
+                dsn=self._read_dsn,
+                max_size=self._read_pool_size,
+                min_size=2,
+                connection_class=app_settings['pg_connection_class'],
+                loop=loop,
+                **kw)
+        return self._read_pool
+
+    @property
+    def has_read_replica(self):
+        return self._read_dsn is not None
+
+    async def use_read_replica(self, request):
+        '''
+        Read only requests are sent to the read replica unless the client
+        committed at a wal position the replica has not replayed yet.
+        '''
+        if (self._read_dsn is None or request is None or
+                getattr(request, '_db_write_enabled', True)):
+            return False
+        lsn = get_request_lsn(request)
+        if lsn is None:
+            return True
+        if lsn > self._replica_lsn:
+            conn = await self.open_replica()
+            try:
+                # null when the server is not a standby, then we can not
+                # tell if it has the commit
+                replayed = parse_lsn(await conn.fetchval(REPLAY_WAL_LSN))
+            finally:
+                await self.close(conn)
+            if replayed is not None:
+                self._replica_lsn = max(self._replica_lsn, replayed)
+        return lsn <= self._replica_lsn
+
     async def initialize_tid_statements(self):
         self._stmt_next_tid = await self._read_conn.prepare(NEXT_TID)
         self._stmt_max_tid = await self._read_conn.prepare(MAX_TID)
@@ -573,27 +1295,45 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
     async def remove(self):
         """Reset the tables"""
         async with (await self.get_pool()).acquire() as conn:
+            await conn.execute("DROP TABLE IF EXISTS {}_json_queue;".format(
+                self._objects_table_name))
             await conn.execute("DROP TABLE IF EXISTS {};".format(self._blobs_table_name))
             await conn.execute("DROP TABLE IF EXISTS {};".format(self._objects_table_name))
 
     async def open(self):
         pool = await self.get_pool()
         try:
-            conn = await pool.acquire(timeout=self._conn_acquire_timeout)
+            conn = await self._pool_monitor.acquire(pool, self._conn_acquire_timeout)
             return conn
         except asyncpg.exceptions.InterfaceError as ex:
             async with self._lock:
                 await self._check_bad_connection(ex)
 
+    async def open_replica(self):
+        pool = await self.get_read_pool()
+        conn = await self._read_pool_monitor.acquire(pool, self._conn_acquire_timeout)
+        self._replica_conns.add(conn)
+        return conn
+
     async def close(self, con):
+        if con in self._replica_conns:
+            self._replica_conns.discard(con)
+            self._read_pool_monitor.release(con)
+            pool = await self.get_read_pool()
+        else:
+            self._pool_monitor.release(con)
+            pool = await self.get_pool()
         try:
             await shield(
-                asyncio.wait_for((await self.get_pool()).release(con, timeout=1), 1))
+                asyncio.wait_for(pool.release(con, timeout=1), 1))
         except (asyncio.CancelledError, RuntimeError, asyncio.TimeoutError,
                 asyncpg.exceptions.ConnectionDoesNotExistError):
             pass
 
     async def terminate(self, conn):
+        self._replica_conns.discard(conn)
+        self._pool_monitor.release(conn)
+        self._read_pool_monitor.release(conn)
         conn.terminate()
 
     async def load(self, txn, oid):
@@ -611,8 +1351,12 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
         pickled = writer.serialize()  # This calls __getstate__ of obj
         if len(pickled) >= self._large_record_size:
             log.info(f"Large object {obj.__class__}: {len(pickled)}")
-        json_dict = await writer.get_json()
-        json = ujson.dumps(json_dict)
+        if self._json_projector is not None and writer.resource:
+            json = None
+            self._defer_json(txn, [oid])
+        else:
+            json_dict = await writer.get_json()
+            json = ujson.dumps(json_dict)
         part = writer.part
         if part is None:
             part = 0
@@ -674,6 +1418,128 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
                               'This should not happen. tid: {}'.format(txn._tid))
         await txn._cache.store_object(obj, pickled)
 
+    @profilable
+    async def store_batch(self, txn, objects):
+        updates = []
+        for oid, old_serial, writer, obj in objects:
+            if obj.__new_marker__ or obj._p_serial is None:
+                await self.store(oid, old_serial, writer, obj, txn)
+            else:
+                updates.append((oid, old_serial, writer, obj))
+        if len(updates) == 0:
+            return
+
+        # always lock rows in the same order to prevent deadlocks between
+        # transactions updating the same objects
+        updates.sort(key=lambda item: item[0])
+        columns = [[] for _ in range(11)]
+        pickles = {}
+        deferred = []
+        for oid, old_serial, writer, obj in updates:
+            pickled = writer.serialize()  # This calls __getstate__ of obj
+            if len(pickled) >= self._large_record_size:
+                log.info(f"Large object {obj.__class__}: {len(pickled)}")
+            pickles[oid] = pickled
+            part = writer.part
+            if part is None:
+                part = 0
+            if self._json_projector is not None and writer.resource:
+                json = None
+                deferred.append(oid)
+            else:
+                json = ujson.dumps(await writer.get_json())
+            values = (oid, len(pickled), part, writer.resource, writer.of, old_serial,
+                      writer.parent_id, writer.id, writer.type, json, pickled)
+            for column, value in zip(columns, values):
+                column.append(value)
+
+        sql = self._sql.get('BATCH_UPDATE', self._objects_table_name)
+        conn = await txn.get_connection()
+        async with txn._lock:
+            try:
+                result = await conn.fetch(sql, txn._tid, *columns)
+            except asyncpg.exceptions.UniqueViolationError as ex:
+                if 'Key (parent_id, id)' in ex.detail:
+                    raise ConflictIdOnContainer(ex)
+                raise
+            except asyncpg.exceptions._base.InterfaceError as ex:
+                if 'another operation is in progress' in ex.args[0]:
+                    raise ConflictError(f'asyncpg error, another operation in progress.')
+                raise
+            except asyncpg.exceptions.DeadlockDetectedError:
+                raise ConflictError(f'Deadlock detected.')
+        if len(result) != len(updates):
+            stored = set([record['zoid'] for record in result])
+            for oid, old_serial, writer, obj in updates:
+                if oid not in stored:
+                    raise TIDConflictError(
+                        f'Mismatch of tid of object being updated. Another '
+                        f'transaction committed a change to the object first. '
+                        f'This should resolve on request retry.',
+                        oid, txn, old_serial, writer)
+        for oid, old_serial, writer, obj in updates:
+            await txn._cache.store_object(obj, pickles[oid])
+        if len(deferred) > 0:
+            self._defer_json(txn, deferred)
+
+    async def store_json(self, txn, objects):
+        oids = []
+        jsons = []
+        # same lock order as the batched update
+        for oid, writer, obj in sorted(objects, key=lambda item: item[0]):
+            if not writer.resource:
+                continue
+            oids.append(oid)
+            jsons.append(ujson.dumps(await writer.get_json()))
+        if len(oids) == 0:
+            return
+        conn = await txn.get_connection()
+        sql = self._sql.get('UPDATE_CHANGED_JSON', self._objects_table_name)
+        async with txn._lock:
+            await conn.execute(sql, oids, jsons)
+
+    def _defer_json(self, txn, oids):
+        for hook, args, kws in txn.get_tpc_commit_hooks():
+            if hook == self._txn_queue_json:
+                args[0].update(oids)
+                return
+        txn.add_tpc_commit_hook(self._txn_queue_json, set(oids))
+
+    async def _txn_queue_json(self, txn, oids):
+        # queued in the transaction of the objects so the projector only
+        # sees them once they are committed
+        conn = await txn.get_connection()
+        sql = self._sql.get('QUEUE_JSON', self._objects_table_name)
+        async with txn._lock:
+            await conn.execute(sql, list(oids), txn._tid)
+        txn.add_after_commit_hook(self._txn_json_commit_hook)
+
+    async def _txn_json_commit_hook(self, status):
+        if status:
+            self._json_projector.wake()
+
+    async def wait_for_json(self, tid, timeout=None):
+        '''
+        Wait until the json column of every object stored up to `tid` is
+        filled. Returns False if `timeout` expired first.
+        '''
+        if self._json_projector is None:
+            return True
+        start = time.time()
+        sql = self._sql.get('MIN_JSON_QUEUE_TID', self._objects_table_name)
+        while True:
+            conn = await self.open()
+            try:
+                pending = await conn.fetchval(sql)
+            finally:
+                await self.close(conn)
+            if pending is None or pending > tid:
+                return True
+            if timeout is not None and time.time() - start >= timeout:
+                return False
+            self._json_projector.wake()
+            await asyncio.sleep(0.05)
+
     async def _txn_oid_commit_hook(self, status, oid):
         await self._vacuum.add_to_queue(oid)
 
@@ -693,6 +1559,8 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
                 return await self.restart_connection()
 
     async def get_next_tid(self, txn):
+        if self._tid_allocator is not None:
+            return await self._tid_allocator.get_next_tid()
         async with self._lock:
             # we do not use transaction lock here but a storage lock because
             # a storage object has a shard conn for reads
@@ -784,11 +1652,19 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
 
     async def commit(self, transaction):
         if transaction._db_txn is not None:
+            if len(transaction._blob_chunk_refs) > 0:
+                await self._incref_blob_chunks(transaction)
             async with transaction._lock:
                 await transaction._db_txn.commit()
         elif (self._transaction_strategy not in ('none', 'tidonly') and
                 not transaction._skip_commit):
             log.warning('Do not have db transaction to commit')
+        if (self._read_dsn is not None and transaction._db_conn is not None and
+                not transaction._skip_commit):
+            # clients send it back to know when the replica has the commit
+            async with transaction._lock:
+                transaction._commit_lsn = await transaction._db_conn.fetchval(
+                    CURRENT_WAL_LSN)
         return transaction._tid
 
     async def abort(self, transaction):
@@ -832,6 +1708,12 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
         async with txn._lock:
             return await conn.fetch(sql, parent_oid, ids)
 
+    async def get_children_metadata(self, txn, parent_oid, ids):
+        conn = await txn.get_connection()
+        sql = self._sql.get('GET_CHILDREN_BATCH_METADATA', self._objects_table_name)
+        async with txn._lock:
+            return await conn.fetch(sql, parent_oid, ids)
+
     async def has_key(self, txn, parent_oid, id):
         sql = self._sql.get('EXIST_CHILD', self._objects_table_name)
         async with txn._lock:
@@ -848,9 +1730,11 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
             result = await conn.fetchval(sql, oid)
         return result
 
-    async def items(self, txn, oid):
+    async def items(self, txn, oid, metadata_only=False):
         conn = await txn.get_connection()
-        sql = self._sql.get('GET_CHILDREN', self._objects_table_name)
+        sql = self._sql.get(
+            'GET_CHILDREN_METADATA' if metadata_only else 'GET_CHILDREN',
+            self._objects_table_name)
         async for record in conn.cursor(sql, oid):
             # locks are dangerous in cursors since comsuming code might do
             # sub-queries and they you end up with a deadlock
@@ -876,6 +1760,18 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
         return items
 
     async def write_blob_chunk(self, txn, bid, oid, chunk_index, data):
+        if oid not in txn._blob_oids:
+            await self._ensure_blob_object(txn, oid)
+            txn._blob_oids.add(oid)
+        conn = await txn.get_connection()
+        if self._blob_dedup:
+            return await self._write_blob_chunk_ref(conn, txn, bid, oid, chunk_index, data)
+        sql = self._sql.get('INSERT_BLOB_CHUNK', self._blobs_table_name)
+        async with txn._lock:
+            return await conn.execute(
+                sql, bid, oid, chunk_index, data)
+
+    async def _ensure_blob_object(self, txn, oid):
         sql = self._sql.get('HAS_OBJECT', self._objects_table_name)
         async with txn._lock:
             result = await self.get_one_row(txn, sql, oid)
@@ -887,17 +1783,55 @@ ALTER TABLE {self._blobs_table_name} ALTER COLUMN zoid TYPE varchar({MAX_OID_LEN
                 await conn.execute(f'''INSERT INTO {self._objects_table_name}
 (zoid, tid, state_size, part, resource, type)
 VALUES ($1::varchar({MAX_OID_LENGTH}), -1, 0, 0, TRUE, 'stub')''', oid)
-        conn = await txn.get_connection()
-        sql = self._sql.get('INSERT_BLOB_CHUNK', self._blobs_table_name)
+
+    async def _write_blob_chunk_ref(self, conn, txn, bid, oid, chunk_index, data):
+        chunk_hash = hashlib.sha256(data).hexdigest()
         async with txn._lock:
+            exists = await conn.fetchval(
+                self._sql.get('HAS_BLOB_CHUNK_DATA', self._blobs_table_name), chunk_hash)
+            if exists is None:
+                # first time this data is stored
+                await conn.execute(
+                    self._sql.get('INSERT_BLOB_CHUNK_DATA', self._blobs_table_name),
+                    chunk_hash, data)
+            else:
+                txn._blob_chunk_refs[chunk_hash] += 1
             return await conn.execute(
-                sql, bid, oid, chunk_index, data)
+                self._sql.get('INSERT_BLOB_CHUNK_REF', self._blobs_table_name),
+                bid, oid, chunk_index, chunk_hash)
+
+    async def _incref_blob_chunks(self, txn):
+        hashes = sorted(txn._blob_chunk_refs)
+        conn = await txn.get_connection()
+        async with txn._lock:
+            result = await conn.execute(
+                self._sql.get('INCREF_BLOB_CHUNKS', self._blobs_table_name),
+                hashes, [txn._blob_chunk_refs[chunk_hash] for chunk_hash in hashes])
+        if result != f'UPDATE {len(hashes)}':
+            # the last reference to a chunk was removed since it was written
+            raise TIDConflictError(
+                f'Blob chunk removed by another transaction. '
+                f'This should resolve on request retry.')
 
     async def read_blob_chunk(self, txn, bid, chunk=0):
-        sql = self._sql.get('READ_BLOB_CHUNK', self._blobs_table_name)
+        if self._blob_hashes:
+            sql = self._sql.get('READ_BLOB_CHUNK_REF', self._blobs_table_name)
+        else:
+            sql = self._sql.get('READ_BLOB_CHUNK', self._blobs_table_name)
         async with txn._lock:
             return await self.get_one_row(txn, sql, bid, chunk)
 
+    async def read_blob_chunk_batch(self, txn, bid, chunks):
+        if self._blob_hashes:
+            sql = self._sql.get('READ_BLOB_CHUNK_REF_BATCH', self._blobs_table_name)
+        else:
+            sql = self._sql.get('READ_BLOB_CHUNK_BATCH', self._blobs_table_name)
+        conn = await txn.get_connection()
+        async with txn._lock:
+            records = await conn.fetch(sql, bid, chunks)
+        records = {record['chunk_index']: record for record in records}
+        return [records.get(chunk) for chunk in chunks]
+
     async def read_blob_chunks(self, txn, bid):
         conn = await txn.get_connection()
         async for record in conn.cursor(bid):
@@ -905,6 +1839,12 @@ VALUES ($1::varchar({MAX_OID_LENGTH}), -1, 0, 0, TRUE, 'stub')''', oid)
             # sub-queries and they you end up with a deadlock
             yield record
 
+    async def get_page_of_blobs(self, txn, page=1, page_size=1000):
+        conn = await txn.get_connection()
+        sql = self._sql.get('BATCHED_GET_BLOBS', self._blobs_table_name)
+        async with txn._lock:
+            return await conn.fetch(sql, page_size, (page - 1) * page_size)
+
     async def del_blob(self, txn, bid):
         conn = await txn.get_connection()
         sql = self._sql.get('DELETE_BLOB', self._blobs_table_name)
@@ -933,11 +1873,14 @@ VALUES ($1::varchar({MAX_OID_LENGTH}), -1, 0, 0, TRUE, 'stub')''', oid)
         return result
 
     # Massive treatment without security
-    async def _get_page_resources_of_type(self, txn, type_, page, page_size):
+    async def _get_page_resources_of_type(self, txn, type_, page, page_size,
+                                          metadata_only=False):
         conn = await txn.get_connection()
         async with txn._lock:
             keys = []
-            sql = self._sql.get('RESOURCES_BY_TYPE', self._objects_table_name)
+            sql = self._sql.get(
+                'RESOURCES_BY_TYPE_METADATA' if metadata_only else 'RESOURCES_BY_TYPE',
+                self._objects_table_name)
             for record in await conn.fetch(
                     sql, type_, page_size, (page - 1) * page_size):
                 keys.append(record)
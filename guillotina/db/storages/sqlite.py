@@ -0,0 +1,646 @@
+from guillotina.db.interfaces import IStorage
+from guillotina.db.oid import MAX_OID_LENGTH
+from guillotina.db.storages.base import BaseStorage
+from guillotina.db.storages.utils import SQLStatements
+from guillotina.db.storages.utils import register_sql
+from guillotina.exceptions import ConflictIdOnContainer
+from guillotina.exceptions import TIDConflictError
+from guillotina.profile import profilable
+from zope.interface import implementer
+
+import asyncio
+import logging
+import os
+import queue
+import sqlite3
+import tempfile
+import threading
+import time
+import ujson
+
+
+log = logging.getLogger("guillotina.storage")
+
+
+CREATE_OBJECTS = f"""
+CREATE TABLE IF NOT EXISTS {{objects_table_name}} (
+    zoid VARCHAR({MAX_OID_LENGTH}) NOT NULL PRIMARY KEY,
+    tid INTEGER NOT NULL,
+    state_size INTEGER NOT NULL,
+    part INTEGER NOT NULL,
+    resource BOOLEAN NOT NULL,
+    of VARCHAR({MAX_OID_LENGTH}) REFERENCES {{objects_table_name}} ON DELETE CASCADE,
+    otid INTEGER,
+    parent_id VARCHAR({MAX_OID_LENGTH}) REFERENCES {{objects_table_name}} ON DELETE CASCADE,
+    id TEXT,
+    type TEXT NOT NULL,
+    json TEXT,
+    state BLOB,
+    UNIQUE (parent_id, id)
+)"""
+
+CREATE_BLOBS = f"""
+CREATE TABLE IF NOT EXISTS {{blobs_table_name}} (
+    bid VARCHAR({MAX_OID_LENGTH}) NOT NULL,
+    zoid VARCHAR({MAX_OID_LENGTH}) NOT NULL
+        REFERENCES {{objects_table_name}} ON DELETE CASCADE,
+    chunk_index INTEGER NOT NULL,
+    data BLOB,
+    PRIMARY KEY (bid, zoid, chunk_index)
+)"""
+
+# the tid sequence is a table so processes sharing the file do not
+# hand out the same tids
+CREATE_TID_SEQUENCE = """
+CREATE TABLE IF NOT EXISTS {objects_table_name}_tid_sequence (
+    id INTEGER NOT NULL PRIMARY KEY CHECK (id = 0),
+    tid INTEGER NOT NULL
+)"""
+
+INITIALIZE_TID_SEQUENCE = """
+INSERT OR IGNORE INTO {objects_table_name}_tid_sequence (id, tid) VALUES (0, 0)"""
+
+_initialize_statements = [
+    CREATE_OBJECTS,
+    CREATE_BLOBS,
+    CREATE_TID_SEQUENCE,
+    INITIALIZE_TID_SEQUENCE,
+    'CREATE INDEX IF NOT EXISTS {objects_table_name}_of ON {objects_table_name} (of)',
+    'CREATE INDEX IF NOT EXISTS {objects_table_name}_parent ON {objects_table_name} (parent_id)',
+    'CREATE INDEX IF NOT EXISTS {objects_table_name}_type ON {objects_table_name} (type)',
+    'CREATE INDEX IF NOT EXISTS {blobs_table_name}_zoid ON {blobs_table_name} (zoid)'
+]
+
+register_sql('SQLITE_NEXT_TID', """
+UPDATE {table_name}_tid_sequence SET tid = tid + 1""")
+
+register_sql('SQLITE_CURRENT_TID', """
+SELECT tid FROM {table_name}_tid_sequence""")
+
+_OBJECT_COLUMNS = 'zoid, tid, state_size, resource, of, parent_id, id, type, state'
+_CHILD_COLUMNS = 'zoid, tid, state_size, resource, type, state, id'
+
+register_sql('SQLITE_GET_OID', f"""
+SELECT {_OBJECT_COLUMNS} FROM {{table_name}} WHERE zoid = ?""")
+
+register_sql('SQLITE_GET_CHILDREN_KEYS', """
+SELECT id FROM {table_name} WHERE parent_id = ?""")
+
+register_sql('SQLITE_GET_CHILD', f"""
+SELECT {_CHILD_COLUMNS} FROM {{table_name}} WHERE parent_id = ? AND id = ?""")
+
+register_sql('SQLITE_GET_CHILDREN', f"""
+SELECT {_CHILD_COLUMNS} FROM {{table_name}} WHERE parent_id = ?""")
+
+# lists of ids are sent as one json parameter instead of a placeholder
+# for every id so the statement can be cached
+register_sql('SQLITE_GET_CHILDREN_BATCH', f"""
+SELECT {_CHILD_COLUMNS} FROM {{table_name}}
+WHERE parent_id = ? AND id IN (SELECT value FROM json_each(?))""")
+
+register_sql('SQLITE_EXIST_CHILD', """
+SELECT zoid FROM {table_name} WHERE parent_id = ? AND id = ?""")
+
+register_sql('SQLITE_NUM_CHILDREN', """
+SELECT count(*) FROM {table_name} WHERE parent_id = ?""")
+
+register_sql('SQLITE_BATCHED_GET_CHILDREN_KEYS', """
+SELECT id FROM {table_name} WHERE parent_id = ? ORDER BY zoid LIMIT ? OFFSET ?""")
+
+register_sql('SQLITE_GET_ANNOTATION', f"""
+SELECT {_CHILD_COLUMNS}, parent_id FROM {{table_name}} WHERE of = ? AND id = ?""")
+
+register_sql('SQLITE_GET_ANNOTATIONS_KEYS', """
+SELECT id, parent_id FROM {table_name} WHERE of = ?""")
+
+register_sql('SQLITE_NUM_ROWS', "SELECT count(*) FROM {table_name}")
+
+register_sql('SQLITE_NUM_RESOURCES', "SELECT count(*) FROM {table_name} WHERE resource")
+
+register_sql('SQLITE_NUM_RESOURCES_BY_TYPE', """
+SELECT count(*) FROM {table_name} WHERE type = ?""")
+
+register_sql('SQLITE_RESOURCES_BY_TYPE', f"""
+SELECT {_CHILD_COLUMNS} FROM {{table_name}}
+WHERE type = ? ORDER BY zoid LIMIT ? OFFSET ?""")
+
+register_sql('SQLITE_TXN_CONFLICTS_ON_OIDS', """
+SELECT zoid, tid, state_size, resource, type, id FROM {table_name}
+WHERE tid > ? AND zoid IN (SELECT value FROM json_each(?))""")
+
+register_sql('SQLITE_UPSERT', """
+INSERT INTO {table_name}
+(zoid, tid, state_size, part, resource, of, otid, parent_id, id, type, json, state)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (zoid) DO UPDATE SET
+    tid = excluded.tid,
+    state_size = excluded.state_size,
+    part = excluded.part,
+    resource = excluded.resource,
+    of = excluded.of,
+    otid = excluded.otid,
+    parent_id = excluded.parent_id,
+    id = excluded.id,
+    type = excluded.type,
+    json = excluded.json,
+    state = excluded.state""")
+
+# only updates rows that still have the tid the object was loaded with
+register_sql('SQLITE_UPDATE', """
+UPDATE {table_name}
+SET
+    tid = ?2,
+    state_size = ?3,
+    part = ?4,
+    resource = ?5,
+    of = ?6,
+    otid = ?7,
+    parent_id = ?8,
+    id = ?9,
+    type = ?10,
+    json = ?11,
+    state = ?12
+WHERE zoid = ?1 AND tid = ?7""")
+
+register_sql('SQLITE_DELETE_OBJECT', "DELETE FROM {table_name} WHERE zoid = ?")
+
+register_sql('SQLITE_UPDATE_JSON', """
+UPDATE {table_name} SET json = ?2 WHERE zoid = ?1 AND json IS NOT ?2""")
+
+register_sql('SQLITE_INSERT_STUB', """
+INSERT OR IGNORE INTO {table_name} (zoid, tid, state_size, part, resource, type)
+VALUES (?, -1, 0, 0, 1, 'stub')""")
+
+register_sql('SQLITE_INSERT_BLOB_CHUNK', """
+INSERT OR REPLACE INTO {table_name} (bid, zoid, chunk_index, data) VALUES (?, ?, ?, ?)""")
+
+register_sql('SQLITE_READ_BLOB_CHUNK', """
+SELECT * FROM {table_name} WHERE bid = ? AND chunk_index = ?""")
+
+register_sql('SQLITE_READ_BLOB_CHUNKS', """
+SELECT * FROM {table_name} WHERE bid = ? ORDER BY chunk_index""")
+
+register_sql('SQLITE_BATCHED_GET_BLOBS', """
+SELECT DISTINCT bid, zoid FROM {table_name} ORDER BY zoid, bid LIMIT ? OFFSET ?""")
+
+register_sql('SQLITE_DELETE_BLOB', "DELETE FROM {table_name} WHERE bid = ?")
+
+
+def _fetchall(conn, sql, args):
+    return [dict(row) for row in conn.execute(sql, args)]
+
+
+def _fetchone(conn, sql, args):
+    row = conn.execute(sql, args).fetchone()
+    if row is not None:
+        row = dict(row)
+    return row
+
+
+def _fetchval(conn, sql, args):
+    row = conn.execute(sql, args).fetchone()
+    if row is not None:
+        return row[0]
+
+
+def _execute(conn, sql, args):
+    conn.execute(sql, args)
+
+
+def _next_tid(conn, update_sql, select_sql):
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        conn.execute(update_sql)
+        tid = conn.execute(select_sql).fetchone()[0]
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return tid
+
+
+def _write_transaction(conn, sql, writes):
+    '''
+    Write all changes of a transaction, returns the oids of objects that
+    were changed by another transaction without writing anything.
+    '''
+    mismatched = []
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        # objects can be written before the parent they reference
+        conn.execute('PRAGMA defer_foreign_keys = ON')
+        upserts = []
+        for oid, (update, values, writer) in writes['objects'].items():
+            if update:
+                if conn.execute(sql['SQLITE_UPDATE'], values).rowcount != 1:
+                    mismatched.append(oid)
+            else:
+                upserts.append(values)
+        if len(mismatched) > 0:
+            conn.execute('ROLLBACK')
+            return mismatched
+        conn.executemany(sql['SQLITE_UPSERT'], upserts)
+        conn.executemany(sql['SQLITE_UPDATE_JSON'], writes['json'])
+        conn.executemany(sql['SQLITE_DELETE_OBJECT'], [(oid,) for oid in writes['deleted']])
+        conn.executemany(sql['SQLITE_DELETE_BLOB'], [(bid,) for bid in writes['deleted_blobs']])
+        spool = writes['blobs']
+        if spool is not None:
+            # blobs can be written for objects that are not stored yet
+            conn.executemany(sql['SQLITE_INSERT_STUB'], [(oid,) for oid in spool.oids()])
+            conn.executemany(sql['SQLITE_INSERT_BLOB_CHUNK'], spool.rows())
+        conn.execute('COMMIT')
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    return mismatched
+
+
+class BlobSpool:
+    '''
+    Temporary file with the blob chunks written by a transaction, they are
+    only read back when the transaction reads them or at commit.
+    '''
+
+    def __init__(self):
+        self._file = tempfile.TemporaryFile()
+        self._size = 0
+        self._chunks = {}
+
+    def reserve(self, size):
+        offset = self._size
+        self._size += size
+        return offset
+
+    def write(self, offset, data):
+        os.pwrite(self._file.fileno(), data, offset)
+
+    def add(self, bid, oid, chunk_index, offset, size):
+        self._chunks[(bid, chunk_index)] = (oid, offset, size)
+
+    def get(self, bid, chunk_index):
+        try:
+            oid, offset, size = self._chunks[(bid, chunk_index)]
+        except KeyError:
+            return None
+        return {
+            'bid': bid,
+            'zoid': oid,
+            'chunk_index': chunk_index,
+            'data': os.pread(self._file.fileno(), size, offset)
+        }
+
+    def discard(self, bid):
+        for key in [key for key in self._chunks if key[0] == bid]:
+            del self._chunks[key]
+
+    def oids(self):
+        return set(oid for oid, offset, size in self._chunks.values())
+
+    def rows(self):
+        fd = self._file.fileno()
+        for (bid, chunk_index), (oid, offset, size) in self._chunks.items():
+            yield bid, oid, chunk_index, os.pread(fd, size, offset)
+
+    def close(self):
+        self._file.close()
+
+
+class SQLiteThread(threading.Thread):
+    '''
+    Run all the sqlite3 calls of a storage on one thread with its own
+    connection. Calls are queued and their results are set on futures of
+    the event loop that made them.
+    '''
+
+    def __init__(self, filename, timeout=20):
+        super().__init__(name=f'sqlite-{filename}', daemon=True)
+        self._filename = filename
+        self._timeout = timeout
+        self._queue = queue.Queue()
+        self._calls = 0
+
+    def run(self):
+        # statements are compiled once and kept in the statement cache of
+        # the connection
+        conn = sqlite3.connect(
+            self._filename, timeout=self._timeout, isolation_level=None,
+            check_same_thread=False, cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode = WAL')
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA foreign_keys = ON')
+        try:
+            while True:
+                call = self._queue.get()
+                if call is None:
+                    break
+                loop, future, func, args = call
+                try:
+                    result = func(conn, *args)
+                except BaseException as ex:
+                    loop.call_soon_threadsafe(_set_exception, future, ex)
+                else:
+                    loop.call_soon_threadsafe(_set_result, future, result)
+        finally:
+            conn.close()
+
+    async def call(self, func, *args):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._calls += 1
+        self._queue.put((loop, future, func, args))
+        return await future
+
+    def stop(self):
+        self._queue.put(None)
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+
+def _close_spool(writes):
+    if writes['blobs'] is not None:
+        writes['blobs'].close()
+
+
+def _set_result(future, result):
+    if not future.cancelled():
+        future.set_result(result)
+
+
+def _set_exception(future, ex):
+    if not future.cancelled():
+        future.set_exception(ex)
+
+
+@implementer(IStorage)
+class SQLiteStorage(BaseStorage):
+    '''
+    Storage in a sqlite database file for single node deployments.
+
+    Changes of a transaction are kept in memory, blob chunks in a temporary
+    file, and written at commit in one sqlite transaction, updates only
+    match rows that still have the tid the objects were loaded with.
+    '''
+
+    _supports_unique_constraints = True
+    _supports_skip_locked = False
+    _objects_table_name = 'objects'
+    _blobs_table_name = 'blobs'
+
+    def __init__(self, filename='g.sqlite', read_only=False, name=None,
+                 transaction_strategy='writeset', cache_strategy='dummy',
+                 objects_table_name='objects', blobs_table_name='blobs',
+                 timeout=20, **options):
+        super().__init__(read_only, transaction_strategy=transaction_strategy,
+                         cache_strategy=cache_strategy)
+        self.__name__ = name
+        self._filename = filename
+        self._timeout = timeout
+        self._objects_table_name = objects_table_name
+        self._blobs_table_name = blobs_table_name
+        self._sql = SQLStatements()
+        self._thread = None
+
+    async def fetch(self, sql, *args):
+        return await self._thread.call(_fetchall, sql, args)
+
+    async def fetchrow(self, sql, *args):
+        return await self._thread.call(_fetchone, sql, args)
+
+    async def fetchval(self, sql, *args):
+        return await self._thread.call(_fetchval, sql, args)
+
+    async def execute(self, sql, *args):
+        return await self._thread.call(_execute, sql, args)
+
+    async def initialize(self, loop=None, **kw):
+        self._thread = SQLiteThread(self._filename, timeout=self._timeout)
+        self._thread.start()
+        if not self._read_only:
+            await self.create()
+
+    async def create(self):
+        for statement in _initialize_statements:
+            await self.execute(statement.format(
+                objects_table_name=self._objects_table_name,
+                blobs_table_name=self._blobs_table_name))
+
+    async def finalize(self):
+        if self._thread is not None:
+            self._thread.stop()
+            await asyncio.get_event_loop().run_in_executor(None, self._thread.join)
+            self._thread = None
+
+    async def remove(self):
+        """Reset the tables"""
+        for table_name in (f'{self._objects_table_name}_tid_sequence',
+                           self._blobs_table_name, self._objects_table_name):
+            await self.execute(f'DROP TABLE IF EXISTS {table_name}')
+
+    async def open(self):
+        return self
+
+    async def close(self, con):
+        pass
+
+    def get_metrics(self):
+        return {
+            'calls': self._thread._calls,
+            'pending': self._thread.pending
+        }
+
+    async def load(self, txn, oid):
+        result = await self.fetchrow(
+            self._sql.get('SQLITE_GET_OID', self._objects_table_name), oid)
+        if result is None:
+            raise KeyError(oid)
+        return result
+
+    def get_txn(self, txn):
+        if not getattr(txn, '_db_txn', None):
+            txn._db_txn = {
+                'objects': {},
+                'deleted': [],
+                'json': [],
+                'blobs': None,
+                'deleted_blobs': []
+            }
+        return txn._db_txn
+
+    async def start_transaction(self, txn, retries=0):
+        self.get_txn(txn)
+
+    @profilable
+    async def store(self, oid, old_serial, writer, obj, txn):
+        assert oid is not None
+        pickled = writer.serialize()  # This calls __getstate__ of obj
+        json = ujson.dumps(await writer.get_json())
+        part = writer.part
+        if part is None:
+            part = 0
+        update = not obj.__new_marker__ and obj._p_serial is not None
+        self.get_txn(txn)['objects'][oid] = (update, (
+            oid, txn._tid, len(pickled), part, writer.resource, writer.of,
+            old_serial, writer.parent_id, writer.id, writer.type, json, pickled), writer)
+        await txn._cache.store_object(obj, pickled)
+
+    async def store_json(self, txn, objects):
+        writes = self.get_txn(txn)
+        for oid, writer, obj in objects:
+            if writer.resource:
+                writes['json'].append((oid, ujson.dumps(await writer.get_json())))
+
+    async def delete(self, txn, oid):
+        self.get_txn(txn)['deleted'].append(oid)
+
+    async def get_next_tid(self, txn):
+        return await self._thread.call(
+            _next_tid, self._sql.get('SQLITE_NEXT_TID', self._objects_table_name),
+            self._sql.get('SQLITE_CURRENT_TID', self._objects_table_name))
+
+    async def get_current_tid(self, txn):
+        return await self.fetchval(
+            self._sql.get('SQLITE_CURRENT_TID', self._objects_table_name))
+
+    async def get_conflicts(self, txn):
+        if len(txn.modified) == 0:
+            return []
+        sql = self._sql.get('SQLITE_TXN_CONFLICTS_ON_OIDS', self._objects_table_name)
+        return await self.fetch(sql, txn._tid, ujson.dumps(list(txn.modified.keys())))
+
+    async def commit(self, transaction):
+        writes = transaction._db_txn
+        if not writes:
+            return transaction._tid
+        sql = {name: self._sql.get(name, table_name) for name, table_name in (
+            ('SQLITE_UPDATE', self._objects_table_name),
+            ('SQLITE_UPSERT', self._objects_table_name),
+            ('SQLITE_UPDATE_JSON', self._objects_table_name),
+            ('SQLITE_DELETE_OBJECT', self._objects_table_name),
+            ('SQLITE_INSERT_STUB', self._objects_table_name),
+            ('SQLITE_DELETE_BLOB', self._blobs_table_name),
+            ('SQLITE_INSERT_BLOB_CHUNK', self._blobs_table_name))}
+        start = time.time()
+        try:
+            mismatched = await self._thread.call(
+                _write_transaction, sql, writes)
+        except sqlite3.IntegrityError as ex:
+            if 'UNIQUE constraint failed' in str(ex):
+                raise ConflictIdOnContainer(ex)
+            raise TIDConflictError(
+                f'Bad value inserting into database that could be caused '
+                f'by a bad cache value. This should resolve on request retry.')
+        finally:
+            transaction._db_txn = None
+            _close_spool(writes)
+        if len(mismatched) > 0:
+            oid = mismatched[0]
+            update, values, writer = writes['objects'][oid]
+            raise TIDConflictError(
+                f'Mismatch of tid of object being updated. Another '
+                f'transaction committed a change to the object first. '
+                f'This should resolve on request retry.',
+                oid, transaction, values[6], writer)
+        log.debug(f'Committed {transaction._tid} in {time.time() - start}')
+        return transaction._tid
+
+    async def abort(self, transaction):
+        writes = getattr(transaction, '_db_txn', None)
+        transaction._db_txn = None
+        if writes:
+            _close_spool(writes)
+
+    # Introspection
+
+    async def get_page_of_keys(self, txn, oid, page=1, page_size=1000):
+        sql = self._sql.get('SQLITE_BATCHED_GET_CHILDREN_KEYS', self._objects_table_name)
+        return [record['id'] for record in await self.fetch(
+            sql, oid, page_size, (page - 1) * page_size)]
+
+    async def keys(self, txn, oid):
+        sql = self._sql.get('SQLITE_GET_CHILDREN_KEYS', self._objects_table_name)
+        return await self.fetch(sql, oid)
+
+    async def get_child(self, txn, parent_oid, id):
+        sql = self._sql.get('SQLITE_GET_CHILD', self._objects_table_name)
+        return await self.fetchrow(sql, parent_oid, id)
+
+    async def get_children(self, txn, parent_oid, ids):
+        sql = self._sql.get('SQLITE_GET_CHILDREN_BATCH', self._objects_table_name)
+        return await self.fetch(sql, parent_oid, ujson.dumps(list(ids)))
+
+    async def has_key(self, txn, parent_oid, id):
+        sql = self._sql.get('SQLITE_EXIST_CHILD', self._objects_table_name)
+        return await self.fetchrow(sql, parent_oid, id) is not None
+
+    async def len(self, txn, oid):
+        sql = self._sql.get('SQLITE_NUM_CHILDREN', self._objects_table_name)
+        return await self.fetchval(sql, oid)
+
+    async def items(self, txn, oid, metadata_only=False):
+        sql = self._sql.get('SQLITE_GET_CHILDREN', self._objects_table_name)
+        for record in await self.fetch(sql, oid):
+            yield record
+
+    async def get_annotation(self, txn, oid, id):
+        sql = self._sql.get('SQLITE_GET_ANNOTATION', self._objects_table_name)
+        return await self.fetchrow(sql, oid, id)
+
+    async def get_annotation_keys(self, txn, oid):
+        sql = self._sql.get('SQLITE_GET_ANNOTATIONS_KEYS', self._objects_table_name)
+        return await self.fetch(sql, oid)
+
+    async def write_blob_chunk(self, txn, bid, oid, chunk_index, data):
+        writes = self.get_txn(txn)
+        if writes['blobs'] is None:
+            writes['blobs'] = BlobSpool()
+        spool = writes['blobs']
+        offset = spool.reserve(len(data))
+        await asyncio.get_event_loop().run_in_executor(
+            None, spool.write, offset, data)
+        spool.add(bid, oid, chunk_index, offset, len(data))
+
+    async def read_blob_chunk(self, txn, bid, chunk=0):
+        # chunks written by the transaction are not in the database yet
+        spool = (txn._db_txn or {}).get('blobs')
+        if spool is not None:
+            result = await asyncio.get_event_loop().run_in_executor(
+                None, spool.get, bid, chunk)
+            if result is not None:
+                return result
+        sql = self._sql.get('SQLITE_READ_BLOB_CHUNK', self._blobs_table_name)
+        return await self.fetchrow(sql, bid, chunk)
+
+    async def read_blob_chunks(self, txn, bid):
+        sql = self._sql.get('SQLITE_READ_BLOB_CHUNKS', self._blobs_table_name)
+        for record in await self.fetch(sql, bid):
+            yield record
+
+    async def get_page_of_blobs(self, txn, page=1, page_size=1000):
+        sql = self._sql.get('SQLITE_BATCHED_GET_BLOBS', self._blobs_table_name)
+        return await self.fetch(sql, page_size, (page - 1) * page_size)
+
+    async def del_blob(self, txn, bid):
+        writes = self.get_txn(txn)
+        if writes['blobs'] is not None:
+            writes['blobs'].discard(bid)
+        writes['deleted_blobs'].append(bid)
+
+    async def get_total_number_of_objects(self, txn):
+        return await self.fetchval(self._sql.get('SQLITE_NUM_ROWS', self._objects_table_name))
+
+    async def get_total_number_of_resources(self, txn):
+        return await self.fetchval(
+            self._sql.get('SQLITE_NUM_RESOURCES', self._objects_table_name))
+
+    async def get_total_resources_of_type(self, txn, type_):
+        sql = self._sql.get('SQLITE_NUM_RESOURCES_BY_TYPE', self._objects_table_name)
+        return await self.fetchval(sql, type_)
+
+    # Massive treatment without security
+    async def _get_page_resources_of_type(self, txn, type_, page, page_size,
+                                          metadata_only=False):
+        sql = self._sql.get('SQLITE_RESOURCES_BY_TYPE', self._objects_table_name)
+        return await self.fetch(sql, type_, page_size, (page - 1) * page_size)
@@ -2,3 +2,4 @@ from . import dbresolve  # noqa
 from . import none  # noqa
 from . import resolve  # noqa
 from . import simple  # noqa
+from . import writeset  # noqa
@@ -1,6 +1,9 @@
 
 
 class BaseStrategy:
+    # store modified objects with one statement instead of one per object
+    batch_store = False
+
     def __init__(self, transaction):
         self._storage = transaction._manager._storage
         self._transaction = transaction
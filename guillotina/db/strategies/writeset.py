@@ -0,0 +1,29 @@
+from guillotina import configure
+from guillotina.db.interfaces import IDBTransactionStrategy
+from guillotina.db.interfaces import ITransaction
+from guillotina.db.strategies.simple import SimpleStrategy
+
+
+@configure.adapter(
+    for_=ITransaction, provides=IDBTransactionStrategy, name="writeset")
+class WriteSetStrategy(SimpleStrategy):
+    '''
+    Only detect conflicts on the objects written by the transaction.
+
+    The db transaction is started at the commit phase and modified objects
+    are updated in one statement that only matches rows that still have the
+    tid the objects were loaded with. There is no voting so commits do not
+    need to query the shared read connection for conflicting writes.
+    '''
+
+    batch_store = True
+
+    async def tpc_begin(self):
+        pass
+
+    async def tpc_commit(self):
+        await self.retrieve_tid()
+        await self._storage.start_transaction(self._transaction)
+
+    async def tpc_vote(self):
+        return True
@@ -1,10 +1,14 @@
+from collections import Counter
 from collections import OrderedDict
 from guillotina._settings import app_settings
 from guillotina.component import get_adapter
+from guillotina.db.codec import state_digest
 from guillotina.db.interfaces import IStorageCache
 from guillotina.db.interfaces import ITransaction
 from guillotina.db.interfaces import ITransactionStrategy
 from guillotina.db.interfaces import IWriter
+from guillotina.db.reader import ghost_reader
+from guillotina.db.reader import metadata_reader
 from guillotina.db.reader import reader as default_reader
 from guillotina.exceptions import ConflictError
 from guillotina.exceptions import ReadOnlyError
@@ -96,12 +100,17 @@ class Transaction(object):
         # List of (hook, args, kws) tuples added by addAfterCommitHook().
         self._after_commit = []
 
+        # List of (hook, args, kws) tuples added by add_tpc_commit_hook().
+        self._tpc_commit = []
+
         logger.debug("new transaction")
 
         # Connection to DB
         self._db_conn = None
         # Transaction on DB
         self._db_txn = None
+        # wal position of the commit, set by storages with read replicas
+        self._commit_lsn = None
         # Lock on the transaction
         # some databases need to lock during queries
         # this provides a lock for each transaction
@@ -117,6 +126,12 @@ class Transaction(object):
                                   name=manager._storage._cache_strategy)
 
         self._query_count_start = self._query_count_end = 0
+        # modified objects not written since their state did not change
+        self._skipped = 0
+        # objects blob chunks were written for, known to be in the database
+        self._blob_oids = set()
+        # references to stored blob chunks to count at commit
+        self._blob_chunk_refs = Counter()
 
     def get_query_count(self):
         '''
@@ -135,7 +150,11 @@ class Transaction(object):
 
     async def get_connection(self):
         if self._db_conn is None:
-            self._db_conn = await self._manager._storage.open()
+            storage = self._manager._storage
+            if await storage.use_read_replica(self.request):
+                self._db_conn = await storage.open_replica()
+            else:
+                self._db_conn = await storage.open()
             self._query_count_start = self.get_query_count()
         return self._db_conn
 
@@ -177,6 +196,27 @@ class Transaction(object):
         kwargs.update(kws)
         self._after_commit.append((hook, real_args + tuple(args), kwargs))
 
+    def get_tpc_commit_hooks(self):
+        """ See ITransaction.
+        """
+        return iter(self._tpc_commit)
+
+    def add_tpc_commit_hook(self, hook, *real_args, args=[], kws=None, **kwargs):
+        """ See ITransaction.
+        """
+        if kws is None:
+            kws = {}
+        kwargs.update(kws)
+        self._tpc_commit.append((hook, real_args + tuple(args), kwargs))
+
+    async def _call_tpc_commit_hooks(self):
+        # unlike other hooks, these are not cleared after they are called
+        # because a restarted commit needs to write them again
+        for hook, args, kws in self._tpc_commit:
+            result = lazy_apply(hook, self, *args, **kws)
+            if asyncio.iscoroutine(result):
+                await result
+
     @profilable
     async def _call_after_commit_hooks(self, status=True):
         # Avoid to abort anything at the end if no hooks are registred.
@@ -211,6 +251,8 @@ class Transaction(object):
         # make sure this is reset on retries
         self._after_commit = []
         self._before_commit = []
+        self._tpc_commit = []
+        self._skipped = 0
 
     def check_read_only(self):
         if self.request is None:
@@ -290,6 +332,7 @@ class Transaction(object):
 
         obj = default_reader(result)
         obj._p_jar = self
+        obj._p_digest = state_digest(result['state'])
         if obj.__immutable_cache__:
             # ttl of zero means we want to provide a hard cache here
             self._manager._hard_cache[oid] = result
@@ -363,12 +406,50 @@ class Transaction(object):
             serial = getattr(obj, "_p_serial", 0)
 
         writer = IWriter(obj)
+        if self._unchanged(obj, writer):
+            return (oid, writer, obj)
         await self._manager._storage.store(oid, serial, writer, obj, self)
         obj._p_serial = self._tid
         obj._p_oid = oid
         if obj._p_jar is None:
             obj._p_jar = self
 
+    def _unchanged(self, obj, writer):
+        """
+        Modified objects with the same state and location they were loaded
+        with do not need to be written. Their json is computed from
+        annotations, behaviors and parents too, the storage still updates it
+        """
+        digest = obj._p_digest
+        if digest is None:
+            return False
+        obj._p_digest = state_digest(writer.serialize())
+        if obj._p_digest != digest:
+            return False
+        self._skipped += 1
+        self._manager._storage._skipped += 1
+        return True
+
+    @profilable
+    async def _store_objects(self, objects):
+        batch = []
+        unchanged = []
+        for oid, obj in objects.items():
+            if obj._p_jar is not self and obj._p_jar is not None:
+                raise Exception(f'Invalid reference to txn: {obj}')
+            writer = IWriter(obj)
+            if self._unchanged(obj, writer):
+                unchanged.append((oid, writer, obj))
+            else:
+                batch.append((oid, getattr(obj, "_p_serial", 0), writer, obj))
+        await self._manager._storage.store_batch(self, batch)
+        for oid, _, _, obj in batch:
+            obj._p_serial = self._tid
+            obj._p_oid = oid
+            if obj._p_jar is None:
+                obj._p_jar = self
+        return unchanged
+
     @profilable
     async def tpc_commit(self):
         """Commit changes to an object"""
@@ -376,12 +457,21 @@ class Transaction(object):
         for oid, obj in self.added.items():
             await self._store_object(obj, oid, True)
             obj.__new_marker__ = False
-        for oid, obj in self.modified.items():
-            await self._store_object(obj, oid)
+        if self._strategy.batch_store:
+            unchanged = await self._store_objects(self.modified)
+        else:
+            unchanged = []
+            for oid, obj in self.modified.items():
+                skipped = await self._store_object(obj, oid)
+                if skipped is not None:
+                    unchanged.append(skipped)
+        if len(unchanged) > 0:
+            await self._manager._storage.store_json(self, unchanged)
         for oid, obj in self.deleted.items():
             if obj._p_jar is not self and obj._p_jar is not None:
                 raise Exception(f'Invalid reference to txn: {obj}')
             await self._manager._storage.delete(self, oid)
+        await self._call_tpc_commit_hooks()
 
     @profilable
     async def tpc_vote(self):
@@ -402,7 +492,10 @@ class Transaction(object):
         self.added = {}
         self.modified = {}
         self.deleted = {}
+        self._tpc_commit = []
         self._db_txn = None
+        self._blob_oids = set()
+        self._blob_chunk_refs = Counter()
 
     # Inspection
 
@@ -426,28 +519,57 @@ class Transaction(object):
 
         return self._fill_object(result, parent)
 
-    def _fill_object(self, item, parent):
-        obj = default_reader(item)
+    def _fill_object(self, item, parent, reader=None):
+        if reader is None:
+            obj = default_reader(item)
+        else:
+            obj = reader(item)
         obj.__parent__ = parent
         obj._p_jar = self
+        obj._p_digest = state_digest(item['state'])
         return obj
 
-    async def _get_batch_children(self, parent, keys):
-        for litem in await self._manager._storage.get_children(
-                self, parent._p_oid, keys):
+    async def _get_batch_children(self, parent, keys, reader=None, metadata_only=False):
+        storage = self._manager._storage
+        if metadata_only:
+            items = await storage.get_children_metadata(self, parent._p_oid, keys)
+        else:
+            items = await storage.get_children(self, parent._p_oid, keys)
+        missing = []
+        for litem in items:
+            if litem['state'] is None:
+                obj = metadata_reader(litem)
+                if obj is None:
+                    # class of the type is not available, load the state
+                    missing.append(litem['id'])
+                    continue
+                obj.__parent__ = parent
+                obj._p_jar = self
+                yield obj
+                continue
             if len(litem['state']) < self._cache.max_cache_record_size:
                 await self._cache.set(litem, container=parent, id=litem['id'])
                 self._cache._stored += 1
-            yield self._fill_object(litem, parent)
+            yield self._fill_object(litem, parent, reader)
+        if len(missing) > 0:
+            async for litem in self._get_batch_children(parent, missing, reader):
+                yield litem
 
-    async def get_children(self, parent, keys):
+    async def get_children(self, parent, keys, metadata_only=False):
         '''
         More performant way to get groups of items.
         - look at cache
         - batch get from storage
         - async for iterate items
         - store retrieved values in storage
+
+        With `metadata_only`, objects are loaded without their state where
+        possible and only provide the id, name, type, uuid and parent.
         '''
+        reader = None
+        if app_settings.get('ghost_objects', False):
+            # defer unpickling until more than the row metadata is used
+            reader = ghost_reader
         lookup_group = []  # backlog of object that need to be looked up
         for key in keys:
             item = await self._cache.get(container=parent, id=key)
@@ -455,7 +577,8 @@ class Transaction(object):
                 self._cache._misses += 1
                 lookup_group.append(key)
                 if len(lookup_group) > 15:  # limit batch size
-                    async for litem in self._get_batch_children(parent, lookup_group):
+                    async for litem in self._get_batch_children(
+                            parent, lookup_group, reader, metadata_only):
                         yield litem
                     lookup_group = []
                 continue
@@ -463,15 +586,17 @@ class Transaction(object):
             self._cache._hits += 1
             if len(lookup_group) > 0:
                 # we need to clear this buffer first before we can yield this item
-                async for litem in self._get_batch_children(parent, lookup_group):
+                async for litem in self._get_batch_children(
+                        parent, lookup_group, reader, metadata_only):
                     yield litem
                 lookup_group = []
 
-            yield self._fill_object(item, parent)
+            yield self._fill_object(item, parent, reader)
 
         # flush the rest
         if len(lookup_group) > 0:
-            async for item in self._get_batch_children(parent, lookup_group):
+            async for item in self._get_batch_children(
+                    parent, lookup_group, reader, metadata_only):
                 yield item
 
     @profilable
@@ -484,10 +609,10 @@ class Transaction(object):
         return await self._manager._storage.len(self, oid)
 
     @profilable
-    async def items(self, container):
+    async def items(self, container, metadata_only=False):
         # XXX not using cursor because we can't cache with cursor results...
         keys = await self.keys(container._p_oid)
-        async for item in self.get_children(container, keys):
+        async for item in self.get_children(container, keys, metadata_only):
             yield item.__name__, item
 
     @profilable
@@ -509,6 +634,7 @@ class Transaction(object):
             obj = reader(result)
         obj.__of__ = base_obj._p_oid
         obj._p_jar = self
+        obj._p_digest = state_digest(result['state'])
         return obj
 
     @profilable
@@ -520,6 +646,17 @@ class Transaction(object):
     async def del_blob(self, bid):
         return await self._manager._storage.del_blob(self, bid)
 
+    async def iterate_blobs(self, page_size=1000):
+        page = 1
+        blobs = await self._manager._storage.get_page_of_blobs(
+            self, page=page, page_size=page_size)
+        while len(blobs) > 0:
+            for blob in blobs:
+                yield blob
+            page += 1
+            blobs = await self._manager._storage.get_page_of_blobs(
+                self, page=page, page_size=page_size)
+
     async def write_blob_chunk(self, bid, oid, chunk_index, data):
         return await self._manager._storage.write_blob_chunk(self, bid, oid, chunk_index, data)
 
@@ -529,6 +666,9 @@ class Transaction(object):
     async def read_blob_chunks(self, bid):
         return await self._manager._storage.read_blob_chunks(self, bid)
 
+    async def read_blob_chunk_batch(self, bid, chunks):
+        return await self._manager._storage.read_blob_chunk_batch(self, bid, chunks)
+
     async def get_total_number_of_objects(self):
         return await self._manager._storage.get_total_number_of_objects(self)
 
@@ -539,16 +679,16 @@ class Transaction(object):
         return await self._manager._storage.get_total_resources_of_type(
             self, type_)
 
-    async def _get_resources_of_type(self, type_, page_size=1000):
+    async def _get_resources_of_type(self, type_, page_size=1000, metadata_only=False):
         page = 1
         keys = await self._manager._storage._get_page_resources_of_type(
-            self, type_, page=page, page_size=page_size)
+            self, type_, page=page, page_size=page_size, metadata_only=metadata_only)
         while len(keys) > 0:
             for key in keys:
                 yield key
             page += 1
             keys = await self._manager._storage._get_page_resources_of_type(
-                self, type_, page=page, page_size=page_size)
+                self, type_, page=page, page_size=page_size, metadata_only=metadata_only)
 
     async def get_page_of_keys(self, parent_oid, page=1, page_size=1000):
         return await self._manager._storage.get_page_of_keys(
@@ -1,6 +1,7 @@
 from guillotina import configure
 from guillotina._settings import app_settings
 from guillotina.component import query_adapter
+from guillotina.db.codec import encode_state
 from guillotina.db.interfaces import IWriter
 from guillotina.db.orm.interfaces import IBaseObject
 from guillotina.interfaces import ICatalogDataAdapter
@@ -19,6 +20,7 @@ class Writer(object):
 
     def __init__(self, obj):
         self._obj = obj
+        self._state = None
 
     async def get_json(self):
         return None
@@ -40,7 +42,12 @@ class Writer(object):
         return getattr(self._obj, '__partition_id__', 0)
 
     def serialize(self):
-        return pickle.dumps(self._obj, protocol=pickle.HIGHEST_PROTOCOL)
+        # the transaction serializes to compare with the loaded state
+        # before the storage writes it
+        if self._state is None:
+            self._state = encode_state(
+                pickle.dumps(self._obj, protocol=pickle.HIGHEST_PROTOCOL))
+        return self._state
 
     @property
     def parent_id(self):
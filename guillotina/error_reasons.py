@@ -24,3 +24,5 @@ ALREADY_INSTALLED = ErrorReason('alreadyInstalled', 'Addon already installed')
 NOT_INSTALLED = ErrorReason('notInstalled', 'Addon not installed')
 UNRETRYALBE_REQUEST = ErrorReason(
     'unretriableRequest', 'Request retry attempted but not allowed due to error type')
+POOL_EXHAUSTED = ErrorReason(
+    'poolExhausted', 'Too many requests waiting for a database connection')
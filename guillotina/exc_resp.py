@@ -4,6 +4,7 @@ from guillotina.exceptions import ConflictIdOnContainer
 from guillotina.exceptions import DeserializationError
 from guillotina.exceptions import InvalidContentType
 from guillotina.exceptions import NotAllowedContentType
+from guillotina.exceptions import PoolExhaustedError
 from guillotina.exceptions import PreconditionFailed
 from guillotina.exceptions import Unauthorized
 from guillotina.exceptions import UnRetryableRequestError
@@ -11,6 +12,7 @@ from guillotina.interfaces import IErrorResponseException
 from guillotina.response import HTTPConflict
 from guillotina.response import HTTPExpectationFailed
 from guillotina.response import HTTPPreconditionFailed
+from guillotina.response import HTTPServiceUnavailable
 from guillotina.response import Response
 
 import json
@@ -46,6 +48,12 @@ def deserialization_error_handler(exc, error='', eid=None) -> Response:
     return HTTPPreconditionFailed(content=data)
 
 
+def pool_exhausted_error_handler(exc, error='', eid=None) -> Response:
+    data = render_error_response(
+        'PoolExhaustedError', error_reasons.POOL_EXHAUSTED, eid)
+    return HTTPServiceUnavailable(content=data, headers={'Retry-After': '1'})
+
+
 def register_handler_factory(ExceptionKlass, factory):
     configure.adapter(
         for_=ExceptionKlass,
@@ -88,3 +96,8 @@ register_handler_factory(
     exception_handler_factory(error_reasons.UNAUTHORIZED,
                               'Unauthorized',
                               serialize_exc=True, klass=HTTPExpectationFailed))
+
+
+register_handler_factory(
+    PoolExhaustedError,
+    pool_exhausted_error_handler)
@@ -163,6 +163,13 @@ class BlobChunkNotFound(Exception):
     pass
 
 
+class StateNotLoadedError(Exception):
+    '''
+    The object was loaded with only its metadata and the attribute needs
+    the state of the object
+    '''
+
+
 class ResourceLockedTimeout(Exception):
     '''
     The resource you are trying to lock for writing is already locked by
@@ -221,3 +228,15 @@ class ServerClosingException(Exception):
     '''
     Server closing, can not perform action
     '''
+
+
+class JobPoolFullException(Exception):
+    '''
+    Too many jobs pending in the job pool
+    '''
+
+
+class PoolExhaustedError(Exception):
+    '''
+    Too many requests waiting for a database connection
+    '''
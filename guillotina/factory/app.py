@@ -135,6 +135,7 @@ _dotted_name_settings = (
     'pg_connection_class',
     'oid_generator',
     'cors_renderer',
+    'json_dumps',
     'check_writable_request'
 )
 
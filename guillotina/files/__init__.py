@@ -3,10 +3,16 @@ from .const import CHUNK_SIZE  # noqa
 from .const import MAX_REQUEST_CACHE_SIZE  # noqa
 from .const import MAX_RETRIES  # noqa
 from .field import BaseCloudFile  # noqa
+from .localfile import LocalFile  # noqa
+from .localfile import LocalFileStorageManagerAdapter  # noqa
 from .manager import FileManager  # noqa
 from .utils import convert_base64_to_binary  # noqa
 from .utils import get_contenttype  # noqa
+from .utils import parse_range_header  # noqa
 from .utils import read_request_data  # noqa
+from .utils import RequestDataCache  # noqa
+from .utils import upload_metrics  # noqa
+from .utils import UploadChecksum  # noqa
 from guillotina.exceptions import UnRetryableRequestError  # noqa
 
 
@@ -184,11 +184,18 @@ class DBFileStorageManagerAdapter:
         blob = Blob(self.context)
         await dm.update(_blob=blob)
 
-    async def iter_data(self):
+    async def iter_data(self, read_ahead=None):
         file = self.field.get(self.field.context or self.context)
         blob = file._blob
         bfile = blob.open()
-        async for chunk in bfile.iter_async_read():
+        async for chunk in bfile.iter_async_read(read_ahead=read_ahead):
+            yield chunk
+
+    async def iter_data_range(self, start, end, read_ahead=None):
+        file = self.field.get(self.field.context or self.context)
+        blob = file._blob
+        bfile = blob.open()
+        async for chunk in bfile.iter_async_read_range(start, end, read_ahead=read_ahead):
             yield chunk
 
     async def append(self, dm, iterable, offset) -> int:
@@ -1,3 +1,7 @@
 MAX_REQUEST_CACHE_SIZE = 6 * 1024 * 1024
 CHUNK_SIZE = 1024 * 1024 * 5
 MAX_RETRIES = 5
+# requests with more ranges are answered with the whole file
+MAX_RANGES = 20
+# checksums of unfinished tus uploads kept by each process
+MAX_UPLOAD_CHECKSUMS = 1000
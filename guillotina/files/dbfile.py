@@ -1,7 +1,22 @@
 from .field import BaseCloudFile
+from guillotina._settings import app_settings
+from guillotina.blob import Blob
+from guillotina.component import get_utility
+from guillotina.db.orm.base import BaseObject
+from guillotina.db.reader import reader
+from guillotina.interfaces import IApplication
+from guillotina.interfaces import IDatabase
 from guillotina.interfaces import IDBFile
 from zope.interface import implementer
 
+import asyncio
+import copy
+import logging
+import time
+
+
+logger = logging.getLogger('guillotina')
+
 
 @implementer(IDBFile)
 class DBFile(BaseCloudFile):
@@ -27,3 +42,191 @@ class DBFile(BaseCloudFile):
     @size.setter
     def size(self, val):
         pass
+
+
+def _find_blob_ids(value, before, found, seen):
+    if isinstance(value, Blob):
+        found.add(value.bid)
+        return
+    if isinstance(value, (BaseObject, type)) or id(value) in seen:
+        # other persistent objects are checked on their own
+        return
+    seen.add(id(value))
+    if isinstance(value, dict):
+        if value.get('last_activity', before) < before:
+            # data of an upload abandoned for too long
+            return
+        values = value.values()
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        values = value
+    elif hasattr(value, '__dict__'):
+        values = vars(value).values()
+    else:
+        return
+    for item in values:
+        _find_blob_ids(item, before, found, seen)
+
+
+async def get_blob_ids(txn, oid, max_age):
+    '''
+    Blobs the state of an object and its annotations refer to. The ones
+    of uploads with no activity for max_age seconds are left out.
+
+    States are loaded from the storage, a cached state could miss a blob
+    that was just written.
+    '''
+    storage = txn._manager._storage
+    before = time.time() - max_age
+    found = set()
+    seen = set()
+    try:
+        ob = reader(await storage.load(txn, oid))
+    except KeyError:
+        return found
+    _find_blob_ids(ob.__getstate__(), before, found, seen)
+    for record in await storage.get_annotation_keys(txn, oid):
+        result = await storage.get_annotation(txn, oid, record['id'])
+        if result is None:
+            continue
+        _find_blob_ids(reader(result).__getstate__(), before, found, seen)
+    return found
+
+
+async def find_orphaned_blobs(txn, max_age=None):
+    '''
+    Blobs no object refers to anymore: the ones of replaced files that
+    were not deleted, of aborted uploads and of uploads abandoned for
+    max_age seconds.
+
+    Only the object a blob belongs to is checked, blobs are not shared by
+    objects (see `copy_blobs`).
+
+    :returns: (bid, zoid) of the blobs
+    '''
+    if max_age is None:
+        max_age = app_settings['blob_gc']['max_age']
+    orphans = []
+    zoid = None
+    referenced = set()
+    async for record in txn.iterate_blobs():
+        if record['zoid'] != zoid:
+            zoid = record['zoid']
+            referenced = await get_blob_ids(txn, zoid, max_age)
+        if record['bid'] not in referenced:
+            orphans.append((record['bid'], zoid))
+    return orphans
+
+
+async def vacuum_blobs(tm, max_age=None, dry_run=False, batch_size=None, pause=None):
+    '''
+    Remove orphaned blobs in batches of batch_size blobs, each one in its
+    own transaction, waiting pause seconds in between. The references are
+    checked again in the transaction removing the blobs, so blobs used
+    again since they were found, like the ones of resumed uploads, are kept.
+
+    :returns: (bid, zoid) of the removed blobs
+    '''
+    settings = app_settings['blob_gc']
+    if max_age is None:
+        max_age = settings['max_age']
+    if batch_size is None:
+        batch_size = settings['batch_size']
+    if pause is None:
+        pause = settings['pause']
+
+    txn = await tm.begin()
+    try:
+        orphans = await find_orphaned_blobs(txn, max_age)
+    finally:
+        await tm.abort(txn=txn)
+    if dry_run:
+        return orphans
+
+    removed = []
+    for start in range(0, len(orphans), batch_size):
+        if start > 0:
+            await asyncio.sleep(pause)
+        txn = await tm.begin()
+        try:
+            referenced = {}
+            for bid, zoid in orphans[start:start + batch_size]:
+                if zoid not in referenced:
+                    referenced[zoid] = await get_blob_ids(txn, zoid, max_age)
+                if bid in referenced[zoid]:
+                    continue
+                await txn.del_blob(bid)
+                removed.append((bid, zoid))
+        except Exception:
+            await tm.abort(txn=txn)
+            raise
+        await tm.commit(txn=txn)
+    return removed
+
+
+async def copy_blobs(value, ob, txn):
+    '''
+    Copy of a value with the blobs of the db files it holds copied to
+    new blobs of ob. Objects do not share blobs, so the blob collector only
+    checks the object a blob belongs to.
+    '''
+    if isinstance(value, DBFile) and value._blob is not None:
+        blob = Blob(ob)
+        source = value._blob.open(transaction=txn)
+        target = blob.open('w', transaction=txn)
+        for chunk_index in range(value._blob.chunks):
+            await target.async_write_chunk(await source.async_read_chunk(chunk_index))
+        value = copy.copy(value)
+        value._blob = blob
+    elif type(value) is dict:
+        value = {key: await copy_blobs(item, ob, txn) for key, item in value.items()}
+    elif type(value) in (list, tuple):
+        value = type(value)([await copy_blobs(item, ob, txn) for item in value])
+    return value
+
+
+class BlobGCUtility:
+    '''
+    Remove the orphaned blobs of every database every `interval` seconds.
+    Other settings override the ones of `blob_gc`
+    '''
+
+    def __init__(self, settings=None, loop=None):
+        settings = settings or {}
+        self._interval = settings.get('interval', 60 * 60)
+        self._max_age = settings.get('max_age')
+        self._batch_size = settings.get('batch_size')
+        self._pause = settings.get('pause')
+        self._runs = 0
+        self._removed = 0
+
+    async def initialize(self, app=None):
+        while True:
+            await asyncio.sleep(self._interval)
+            await self.run()
+
+    async def run(self):
+        root = get_utility(IApplication, name='root')
+        for _id, db in root:
+            if not IDatabase.providedBy(db):
+                continue
+            try:
+                removed = await vacuum_blobs(
+                    db.get_transaction_manager(), max_age=self._max_age,
+                    batch_size=self._batch_size, pause=self._pause)
+            except Exception:
+                logger.warning(f'Error removing orphaned blobs of database {_id}',
+                               exc_info=True)
+                continue
+            if len(removed) > 0:
+                logger.info(f'Removed {len(removed)} orphaned blobs of database {_id}')
+            self._removed += len(removed)
+        self._runs += 1
+
+    async def finalize(self, app=None):
+        pass
+
+    def get_metrics(self):
+        return {
+            'runs': self._runs,
+            'removed': self._removed
+        }
@@ -0,0 +1,294 @@
+from .const import CHUNK_SIZE
+from .field import BaseCloudFile
+from functools import partial
+from guillotina import configure
+from guillotina._settings import app_settings
+from guillotina.content import get_all_behaviors
+from guillotina.content import get_cached_factory
+from guillotina.db.oid import get_short_oid
+from guillotina.db.oid import OID_DELIMITER
+from guillotina.interfaces import ICloudFileField
+from guillotina.interfaces import IFileCleanup
+from guillotina.interfaces import IFileStorageManager
+from guillotina.interfaces import ILocalFile
+from guillotina.interfaces import ILocalFileField
+from guillotina.interfaces import IObjectRemovedEvent
+from guillotina.interfaces import IRequest
+from guillotina.interfaces import IResource
+from guillotina.schema import get_fields
+from guillotina.transactions import get_transaction
+from guillotina.utils import import_class
+from guillotina.utils import run_async
+from zope.interface import implementer
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+import uuid
+
+
+logger = logging.getLogger('guillotina')
+
+TMP_DIRECTORY = 'tmp'
+
+
+@implementer(ILocalFile)
+class LocalFile(BaseCloudFile):
+    """File stored in a directory tree on the local disk"""
+
+
+def get_storage_path(db_id):
+    return os.path.join(app_settings['local_file_storage']['path'], db_id)
+
+
+def get_object_path(oid):
+    '''
+    Directory of the files of an object, relative to the storage path.
+    Objects are spread over two levels of directories by their oid
+    '''
+    short_oid = get_short_oid(oid)
+    return os.path.join(
+        short_oid[:2], short_oid[2:4], oid.replace(OID_DELIMITER, '-'))
+
+
+def _create(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    open(path, 'wb').close()
+
+
+def _open_at(path, offset):
+    # requests are replayed on conflict errors, data past the offset of the
+    # upload is from an attempt that did not commit
+    fi = open(path, 'r+b')
+    fi.seek(offset)
+    fi.truncate()
+    return fi
+
+
+def _store(tmp_path, path):
+    md5 = hashlib.md5()
+    with open(tmp_path, 'rb') as fi:
+        for chunk in iter(partial(fi.read, CHUNK_SIZE), b''):
+            md5.update(chunk)
+        size = fi.tell()
+        os.fsync(fi.fileno())
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # the temporary file is kept until the transaction is committed so a
+    # replayed request can store it again, files are never visible half
+    # written
+    try:
+        os.link(tmp_path, path)
+    except OSError:
+        shutil.copyfile(tmp_path, path + '.tmp')
+        os.rename(path + '.tmp', path)
+    return size, md5.hexdigest()
+
+
+def _remove(paths):
+    for path in paths:
+        try:
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning(f'Error removing local file {path}', exc_info=True)
+
+
+async def _remove_after_commit(status, paths):
+    if status:
+        await run_async(_remove, paths)
+
+
+@configure.adapter(
+    for_=(IResource, IRequest, ILocalFileField),
+    provides=IFileStorageManager)
+class LocalFileStorageManagerAdapter:
+    '''
+    Store files in a directory tree on the local disk or a network mount.
+
+    Uploads are written to a temporary file that is linked in place when
+    the upload finishes. The temporary file and replaced files are removed
+    once the transaction is committed.
+    '''
+
+    file_class = LocalFile
+
+    def __init__(self, context, request, field):
+        self.context = context
+        self.request = request
+        self.field = field
+
+    @property
+    def storage_path(self):
+        return get_storage_path(get_transaction(self.request).manager.db_id)
+
+    def _get_file(self):
+        try:
+            return self.field.get(self.field.context or self.context)
+        except AttributeError:
+            return None
+
+    def get_file_path(self):
+        file = self._get_file()
+        if not ILocalFile.providedBy(file) or not file.uri:
+            return None
+        return os.path.join(self.storage_path, file.uri)
+
+    def exists(self):
+        path = self.get_file_path()
+        return path is not None and os.path.exists(path)
+
+    async def start(self, dm):
+        uri = os.path.join(TMP_DIRECTORY, uuid.uuid4().hex)
+        await run_async(_create, os.path.join(self.storage_path, uri))
+        await dm.update(_tmp_uri=uri)
+
+    async def iter_data(self, **kwargs):
+        async for chunk in self.iter_data_range(0, None):
+            yield chunk
+
+    async def iter_data_range(self, start, end, **kwargs):
+        fi = await run_async(open, self.get_file_path(), 'rb')
+        try:
+            await run_async(fi.seek, start)
+            while end is None or start < end:
+                size = CHUNK_SIZE if end is None else min(CHUNK_SIZE, end - start)
+                chunk = await run_async(fi.read, size)
+                if not chunk:
+                    break
+                start += len(chunk)
+                yield chunk
+        finally:
+            fi.close()
+
+    async def append(self, dm, iterable, offset) -> int:
+        fi = await run_async(
+            _open_at, os.path.join(self.storage_path, dm.get('_tmp_uri')), offset)
+        size = 0
+        try:
+            async for chunk in iterable:
+                size += len(chunk)
+                await run_async(fi.write, chunk)
+        finally:
+            await run_async(fi.close)
+        return size
+
+    async def finish(self, dm):
+        uri = os.path.join(get_object_path(self.context._p_oid), uuid.uuid4().hex)
+        tmp_path = os.path.join(self.storage_path, dm.get('_tmp_uri'))
+        size, md5 = await run_async(
+            _store, tmp_path, os.path.join(self.storage_path, uri))
+
+        txn = get_transaction(self.request)
+        removed = [tmp_path]
+        file = self._get_file()
+        if ILocalFile.providedBy(file) and file.uri:
+            cleanup = IFileCleanup(self.context, None)
+            if cleanup is None or cleanup.should_clean(file=file):
+                removed.append(os.path.join(self.storage_path, file.uri))
+            else:
+                await dm.update(_previous_uri=file.uri)
+        txn.add_after_commit_hook(_remove_after_commit, removed)
+
+        await dm.update(uri=uri, size=size, md5=md5, _tmp_uri=None)
+
+    async def copy(self, to_storage_manager, dm):
+        await to_storage_manager.start(dm)
+        await to_storage_manager.append(dm, self.iter_data(), 0)
+        await to_storage_manager.finish(dm)
+        await dm.finish()
+
+
+def local_files_enabled():
+    return import_class(app_settings['cloud_storage']).isOrExtends(ILocalFileField)
+
+
+@configure.subscriber(for_=(IResource, IObjectRemovedEvent))
+def remove_object_files(obj, event):
+    txn = obj._p_jar
+    if txn is None or obj._p_oid is None or not local_files_enabled():
+        return
+    path = os.path.join(
+        get_storage_path(txn.manager.db_id), get_object_path(obj._p_oid))
+    txn.add_after_commit_hook(_remove_after_commit, [path])
+
+
+async def get_file_uris(ob):
+    '''
+    Local files an object refers to, in its schema and its behaviors
+    '''
+    contexts = []
+    factory = get_cached_factory(ob.type_name)
+    if factory.schema is not None:
+        contexts.append((factory.schema, ob))
+    contexts.extend(await get_all_behaviors(ob))
+
+    uris = set()
+    for schema, context in contexts:
+        for name, field in get_fields(schema).items():
+            if not ICloudFileField.providedBy(field):
+                continue
+            value = getattr(context, name, None)
+            if ILocalFile.providedBy(value):
+                uris.add(value.uri)
+                uris.add(getattr(value, '_previous_uri', None))
+    return uris
+
+
+def _find_files(storage_path, before):
+    '''
+    Files modified before the given time, by the oid of the object they
+    belong to. Temporary files are returned with no oid
+    '''
+    found = {}
+    for dirpath, _, filenames in os.walk(storage_path):
+        parts = os.path.relpath(dirpath, storage_path).split(os.sep)
+        if parts == [TMP_DIRECTORY]:
+            oid = None
+        elif len(parts) == 3:
+            oid = parts[2].replace('-', OID_DELIMITER)
+        else:
+            continue
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            if os.path.getmtime(path) < before:
+                found.setdefault(oid, []).append(path)
+    return found
+
+
+async def vacuum(txn, max_age=None, dry_run=False):
+    '''
+    Remove files no object refers to anymore: the ones of deleted objects,
+    of aborted transactions and abandoned uploads. Children of deleted
+    folders can still be loaded until the database vacuum removed them,
+    their files are kept until then. Only files older than max_age seconds
+    are removed so the ones of uploads in progress are kept.
+
+    :returns: paths of the removed files
+    '''
+    if max_age is None:
+        max_age = app_settings['local_file_storage']['max_age']
+    storage_path = get_storage_path(txn.manager.db_id)
+    found = await run_async(_find_files, storage_path, time.time() - max_age)
+
+    removed = []
+    for oid, paths in found.items():
+        if oid is not None:
+            try:
+                ob = await txn.get(oid)
+            except KeyError:
+                pass
+            else:
+                uris = await get_file_uris(ob)
+                paths = [path for path in paths
+                         if os.path.relpath(path, storage_path) not in uris]
+        removed.extend(paths)
+
+    if not dry_run:
+        await run_async(_remove, removed)
+    return removed
@@ -1,13 +1,22 @@
+import asyncio
 import base64
+import inspect
+import logging
 import posixpath
+import time
 import uuid
 
+from aiohttp.web import FileResponse
 from aiohttp.web import StreamResponse
+from collections import OrderedDict
 from guillotina import configure
 from guillotina._settings import app_settings
 from guillotina.component import get_adapter
 from guillotina.component import get_multi_adapter
+from guillotina.files.utils import parse_range_header
 from guillotina.files.utils import read_request_data
+from guillotina.files.utils import upload_metrics
+from guillotina.files.utils import UploadChecksum
 from guillotina.interfaces import IAbsoluteURL
 from guillotina.interfaces import ICloudFileField
 from guillotina.interfaces import IFileManager
@@ -18,12 +27,110 @@ from guillotina.interfaces import IUploadDataManager
 from guillotina.response import HTTPConflict
 from guillotina.response import HTTPNotFound
 from guillotina.response import HTTPPreconditionFailed
+from guillotina.response import HTTPRequestRangeNotSatisfiable
 from guillotina.response import Response
+from guillotina.transactions import get_transaction
 from guillotina.utils import apply_coroutine
 from guillotina.utils import import_class
+from guillotina.utils import run_async
 from zope.interface import alsoProvides
 
 from .const import CHUNK_SIZE
+from .const import MAX_UPLOAD_CHECKSUMS
+
+
+logger = logging.getLogger('guillotina')
+
+# checksums of the data received so far of unfinished tus uploads, by upload id
+_upload_checksums = OrderedDict()
+
+
+def _set_upload_checksum(status, upload_id, checksum):
+    if not status:
+        return
+    if checksum is None:
+        _upload_checksums.pop(upload_id, None)
+        return
+    _upload_checksums[upload_id] = checksum
+    _upload_checksums.move_to_end(upload_id)
+    while len(_upload_checksums) > MAX_UPLOAD_CHECKSUMS:
+        _upload_checksums.popitem(last=False)
+
+
+def _get_sendfile_args():
+    # FileResponse._sendfile is private to aiohttp, only use the signatures
+    # it is known to have
+    try:
+        params = list(inspect.signature(FileResponse._sendfile).parameters)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    if params == ['self', 'request', 'fobj', 'count']:
+        return 'count'
+    if params == ['self', 'request', 'fobj', 'offset', 'count']:
+        return 'offset'
+
+
+_sendfile_args = _get_sendfile_args()
+
+
+def _open_at(path, offset):
+    fobj = open(path, 'rb')
+    fobj.seek(offset)
+    return fobj
+
+
+class SendfileResponse(FileResponse):
+    '''
+    Send count bytes of a file from start with sendfile when the response is
+    prepared. Unlike `FileResponse`, status and headers are left to the file
+    manager
+    '''
+
+    def __init__(self, path, start=0, count=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self._offset = start
+        self._count = count
+
+    async def prepare(self, request):
+        if self.prepared or self._eof_sent:
+            # aiohttp prepares returned responses again once they are sent
+            return
+        loop = asyncio.get_event_loop()
+        fobj = await loop.run_in_executor(None, _open_at, self._path, self._offset)
+        try:
+            if self._use_sendfile(request):
+                if _sendfile_args == 'count':
+                    return await self._sendfile(request, fobj, self._count)
+                return await self._sendfile(request, fobj, self._offset, self._count)
+            return await self._send_chunks(request, fobj)
+        finally:
+            await loop.run_in_executor(None, fobj.close)
+
+    def _use_sendfile(self, request):
+        # the fallback of aiohttp, also used for tls and compressed responses,
+        # reads whole chunks past count so only plain sockets are handed over
+        if (_sendfile_args is None or
+                getattr(FileResponse._sendfile, '__name__', None) != '_sendfile_system'):
+            return False
+        transport = request.transport
+        if transport is None or self.compression:
+            return False
+        return (transport.get_extra_info('sslcontext') is None and
+                transport.get_extra_info('socket') is not None)
+
+    async def _send_chunks(self, request, fobj):
+        writer = await StreamResponse.prepare(self, request)
+        loop = asyncio.get_event_loop()
+        remaining = self._count
+        while remaining > 0:
+            chunk = await loop.run_in_executor(
+                None, fobj.read, min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            await writer.write(chunk)
+            remaining -= len(chunk)
+        await writer.drain()
+        return writer
 
 
 @configure.adapter(
@@ -44,15 +151,41 @@ class FileManager(object):
         self.dm = get_adapter(
             self.file_storage_manager, IUploadDataManager)
 
-    async def prepare_download(self, disposition=None, filename=None,
-                               content_type=None, size=None, **kwargs):
+    def _get_file(self):
+        try:
+            return self.field.get(self.field.context or self.context)
+        except AttributeError:
+            return None
+
+    @property
+    def supports_ranges(self):
+        return hasattr(self.file_storage_manager, 'iter_data_range')
+
+    def get_file_path(self):
+        '''
+        Path of the file data on the local disk, None when the storage manager
+        does not keep files there
+        '''
+        if hasattr(self.file_storage_manager, 'get_file_path'):
+            return self.file_storage_manager.get_file_path()
+
+    def get_etag(self, file):
+        if file is None:
+            return None
+        if file.md5:
+            return '"{}"'.format(file.md5)
+        blob = getattr(file, '_blob', None)
+        if blob is not None:
+            # blobs get a new id every time the file is uploaded
+            return '"{}"'.format(blob.bid)
+
+    async def get_download_response(self, disposition=None, filename=None,
+                                    content_type=None, size=None, status=200,
+                                    sendfile=False, start=0, count=None):
         if disposition is None:
             disposition = self.request.query.get('disposition', 'attachment')
 
-        try:
-            file = self.field.get(self.field.context or self.context)
-        except AttributeError:
-            file = None
+        file = self._get_file()
 
         if file is None and filename is None:
             raise HTTPNotFound(content={
@@ -64,12 +197,30 @@ class FileManager(object):
             'Content-Disposition': '{}; filename="{}"'.format(
                 disposition, filename or file.filename)
         })
-
-        download_resp = StreamResponse(headers=headers)
+        if self.supports_ranges:
+            headers['Accept-Ranges'] = 'bytes'
+            etag = self.get_etag(file)
+            if etag is not None:
+                headers['ETag'] = etag
+
+        path = self.get_file_path() if sendfile else None
+        if path is not None:
+            # the data is sent when the response is prepared
+            download_resp = SendfileResponse(
+                path, start, count or size or file.size, headers=headers, status=status)
+        else:
+            download_resp = StreamResponse(headers=headers, status=status)
         download_resp.content_type = content_type or file.guess_content_type()
-        if size or file.size:
-            download_resp.content_length = size or file.size
+        if count or size or file.size:
+            download_resp.content_length = count or size or file.size
 
+        return download_resp
+
+    async def prepare_download(self, disposition=None, filename=None,
+                               content_type=None, size=None, sendfile=False,
+                               **kwargs):
+        download_resp = await self.get_download_response(
+            disposition, filename, content_type, size, sendfile=sendfile)
         await download_resp.prepare(self.request)
         return download_resp
 
@@ -87,13 +238,89 @@ class FileManager(object):
         await download_resp.write_eof()
         return download_resp
 
+    def get_ranges(self, size=None):
+        '''
+        Byte ranges requested with the `Range` header, None to send the whole
+        file
+        '''
+        if 'Range' not in self.request.headers or not self.supports_ranges:
+            return None
+        file = self._get_file()
+        size = size or (file.size if file is not None else None)
+        if not size:
+            return None
+        if_range = self.request.headers.get('If-Range')
+        if if_range is not None and if_range != self.get_etag(file):
+            # file changed since the client got the first part
+            return None
+        return parse_range_header(self.request.headers['Range'], size)
+
     async def download(self, disposition=None, filename=None, content_type=None,
                        size=None, **kwargs):
+        ranges = self.get_ranges(size)
+        if ranges is not None:
+            return await self.download_ranges(
+                ranges, disposition, filename, content_type, size, **kwargs)
         download_resp = await self.prepare_download(
-            disposition, filename, content_type, size, **kwargs)
-        async for chunk in self.file_storage_manager.iter_data(**kwargs):
-            await download_resp.write(chunk)
-            await download_resp.drain()
+            disposition, filename, content_type, size, sendfile=True, **kwargs)
+        if not isinstance(download_resp, SendfileResponse):
+            async for chunk in self.file_storage_manager.iter_data(**kwargs):
+                await download_resp.write(chunk)
+                await download_resp.drain()
+        await download_resp.write_eof()
+        return download_resp
+
+    async def download_ranges(self, ranges, disposition=None, filename=None,
+                              content_type=None, size=None, **kwargs):
+        if size is None:
+            size = self._get_file().size
+        if len(ranges) == 0:
+            raise HTTPRequestRangeNotSatisfiable(headers={
+                'Content-Range': f'bytes */{size}'
+            })
+        if len(ranges) == 1:
+            start, end = ranges[0]
+            download_resp = await self.get_download_response(
+                disposition, filename, content_type, size, status=206,
+                sendfile=True, start=start, count=end - start + 1)
+            download_resp.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+            if isinstance(download_resp, SendfileResponse):
+                await download_resp.prepare(self.request)
+                await download_resp.write_eof()
+                return download_resp
+            parts = [(b'', start, end)]
+            closing = b''
+        else:
+            download_resp = await self.get_download_response(
+                disposition, filename, content_type, size, status=206)
+            boundary = uuid.uuid4().hex
+            part_type = download_resp.content_type
+            parts = []
+            for start, end in ranges:
+                parts.append(((
+                    f'--{boundary}\r\n'
+                    f'Content-Type: {part_type}\r\n'
+                    f'Content-Range: bytes {start}-{end}/{size}\r\n\r\n').encode('ascii'),
+                    start, end))
+            closing = f'--{boundary}--\r\n'.encode('ascii')
+            download_resp.content_length = sum(
+                len(header) + end - start + 1 + 2 for header, start, end in parts
+            ) + len(closing)
+            download_resp.headers['Content-Type'] = (
+                f'multipart/byteranges; boundary={boundary}')
+
+        await download_resp.prepare(self.request)
+        for header, start, end in parts:
+            if header:
+                await download_resp.write(header)
+            async for chunk in self.file_storage_manager.iter_data_range(
+                    start, end + 1, **kwargs):
+                await download_resp.write(chunk)
+                await download_resp.drain()
+            if header:
+                await download_resp.write(b'\r\n')
+        if closing:
+            await download_resp.write(closing)
         await download_resp.write_eof()
         return download_resp
 
@@ -116,13 +343,84 @@ class FileManager(object):
             head_response['Upload-Length'] = str(self.dm.get('size'))
         return Response(headers=head_response)
 
-    async def _iterate_request_data(self):
+    async def _read_request_data(self, queue):
+        try:
+            while True:
+                data = await read_request_data(self.request, CHUNK_SIZE)
+                await queue.put(data)
+                if not data:
+                    break
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            await queue.put(ex)
+
+    async def _iterate_request_data(self, checksum=None):
+        '''
+        Request data in chunks of CHUNK_SIZE. The next chunks are read from
+        the network, up to the `upload_read_ahead` setting, and the checksum
+        computed in a thread while the storage writes the previous one
+        '''
         self.request._last_read_pos = 0
-        data = await read_request_data(self.request, CHUNK_SIZE)
-
-        while data:
-            yield data
-            data = await read_request_data(self.request, CHUNK_SIZE)
+        read_ahead = app_settings.get('upload_read_ahead', 0)
+        queue = asyncio.Queue(maxsize=max(read_ahead // CHUNK_SIZE, 1))
+        reader = asyncio.ensure_future(self._read_request_data(queue))
+        hashing = None
+        started = time.time()
+        read_wait = 0.0
+        size = 0
+        try:
+            while True:
+                start = time.time()
+                data = await queue.get()
+                read_wait += time.time() - start
+                if hashing is not None:
+                    await hashing
+                    hashing = None
+                if isinstance(data, Exception):
+                    raise data
+                if not data:
+                    break
+                size += len(data)
+                if checksum is not None:
+                    # hashlib releases the GIL while hashing large data
+                    hashing = asyncio.ensure_future(run_async(checksum.update, data))
+                yield data
+        finally:
+            if not reader.done():
+                reader.cancel()
+            if hashing is not None:
+                await asyncio.wait([hashing])
+            upload_metrics.add(size, time.time() - started, read_wait)
+
+    async def _verify_checksum(self, checksum, sha256=None):
+        md5 = self.dm.get('md5')
+        if checksum is None:
+            if md5 or sha256:
+                logger.warning(
+                    f'Can not verify the checksum of an upload of {self.context._p_oid}, '
+                    f'it was received by several processes')
+            return
+        mismatch = checksum.verify(md5=md5, sha256=sha256)
+        if mismatch is not None:
+            raise HTTPPreconditionFailed(content={
+                'reason': f'Upload {mismatch} checksum does not match the data'
+            })
+        if not md5:
+            await self.dm.update(md5=checksum.md5)
+
+    def _get_upload_checksum(self, offset):
+        '''
+        Checksum of the data of the tus upload received so far, None when it
+        was partly received by another process
+        '''
+        if offset == 0:
+            return UploadChecksum()
+        checksum = _upload_checksums.get(self.dm.get('_upload_id'))
+        if checksum is None or checksum.offset != offset:
+            return None
+        # only changed once this request is committed
+        return checksum.copy()
 
     async def tus_patch(self, *args, **kwargs):
         await self.dm.load()
@@ -150,8 +448,9 @@ class FileManager(object):
                           f'object offset {ob_offset}'
             })
 
+        checksum = self._get_upload_checksum(offset)
         read_bytes = await self.file_storage_manager.append(
-            self.dm, self._iterate_request_data(), offset)
+            self.dm, self._iterate_request_data(checksum), offset)
 
         if to_upload and read_bytes != to_upload:
             # check length matches if provided
@@ -170,11 +469,15 @@ class FileManager(object):
         }
 
         if self.dm.get('size') is not None and self.dm.get_offset() >= self.dm.get('size'):
+            await self._verify_checksum(checksum, self.dm.get('_sha256'))
+            checksum = None
             await self.file_storage_manager.finish(self.dm)
             await self.dm.finish()
             headers['Tus-Upload-Finished'] = '1'
         else:
             await self.dm.save()
+        get_transaction(self.request).add_after_commit_hook(
+            _set_upload_checksum, self.dm.get('_upload_id'), checksum)
 
         return Response(headers=headers)
 
@@ -201,6 +504,8 @@ class FileManager(object):
         if 'UPLOAD-MD5' in self.request.headers:
             md5 = self.request.headers['UPLOAD-MD5']
 
+        sha256 = self.request.headers.get('UPLOAD-SHA256')
+
         if 'UPLOAD-EXTENSION' in self.request.headers:
             extension = self.request.headers['UPLOAD-EXTENSION']
 
@@ -229,7 +534,9 @@ class FileManager(object):
             extension=extension,
             size=size,
             deferred_length=deferred_length,
-            offset=0)
+            offset=0,
+            _sha256=sha256,
+            _upload_id=uuid.uuid4().hex)
 
         await self.file_storage_manager.start(self.dm)
         await self.dm.save()
@@ -276,14 +583,17 @@ class FileManager(object):
             size=size)
         await self.file_storage_manager.start(self.dm)
 
+        checksum = UploadChecksum()
         read_bytes = await self.file_storage_manager.append(
-            self.dm, self._iterate_request_data(), 0)
+            self.dm, self._iterate_request_data(checksum), 0)
 
         if read_bytes != size:
             raise HTTPPreconditionFailed(content={
                 'reason': 'Upload size does not match what was provided'
             })
 
+        await self._verify_checksum(
+            checksum, self.request.headers.get('X-UPLOAD-SHA256HASH'))
         await self.file_storage_manager.finish(self.dm)
         await self.dm.finish()
 
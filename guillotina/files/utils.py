@@ -1,3 +1,4 @@
+from .const import MAX_RANGES
 from .const import MAX_REQUEST_CACHE_SIZE
 from guillotina.exceptions import UnRetryableRequestError
 from guillotina.utils import get_content_path
@@ -5,11 +6,129 @@ from guillotina.utils import to_str
 
 import asyncio
 import base64
+import bisect
+import hashlib
 import mimetypes
 import os
 import uuid
 
 
+class RequestDataCache:
+    '''
+    Chunks of request data kept to replay the request on conflict errors.
+
+    Chunks are stored as they were read, replaying with the same chunk size
+    returns them without copying.
+    '''
+
+    def __init__(self, chunks=None):
+        self.chunks = []
+        self.offsets = []
+        self.size = 0
+        for chunk in chunks or []:
+            self.append(chunk)
+
+    def __len__(self):
+        return self.size
+
+    def append(self, data):
+        if len(data) == 0:
+            return
+        self.chunks.append(data)
+        self.offsets.append(self.size)
+        self.size += len(data)
+
+    def read(self, pos, size):
+        idx = bisect.bisect_right(self.offsets, pos) - 1
+        if idx < 0:
+            return b''
+        chunk = self.chunks[idx]
+        if self.offsets[idx] == pos and (
+                len(chunk) == size or (len(chunk) < size and idx == len(self.chunks) - 1)):
+            return chunk
+        parts = []
+        end = min(pos + size, self.size)
+        while pos < end:
+            start = pos - self.offsets[idx]
+            part = memoryview(self.chunks[idx])[start:start + end - pos]
+            parts.append(part)
+            pos += len(part)
+            idx += 1
+        return b''.join(parts)
+
+
+class UploadChecksum:
+    '''
+    MD5 and SHA256 of the data of an upload, computed while it is received.
+    `offset` is the number of bytes hashed so far
+    '''
+
+    def __init__(self):
+        self.offset = 0
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+
+    def update(self, data):
+        self._md5.update(data)
+        self._sha256.update(data)
+        self.offset += len(data)
+
+    def copy(self):
+        checksum = UploadChecksum()
+        checksum.offset = self.offset
+        checksum._md5 = self._md5.copy()
+        checksum._sha256 = self._sha256.copy()
+        return checksum
+
+    @property
+    def md5(self):
+        return self._md5.hexdigest()
+
+    @property
+    def sha256(self):
+        return self._sha256.hexdigest()
+
+    def verify(self, md5=None, sha256=None):
+        '''
+        Name of the first expected checksum that does not match the data,
+        None when they all match
+        '''
+        for name, expected in (('md5', md5), ('sha256', sha256)):
+            if expected and expected.strip().lower() != getattr(self, name):
+                return name
+
+
+class UploadMetrics:
+    '''
+    Throughput of the uploads of this process. `read_wait` is the time spent
+    waiting for data from the network, the rest of the time is spent storing it
+    '''
+
+    def __init__(self):
+        self.requests = 0
+        self.bytes = 0
+        self.time = 0.0
+        self.read_wait = 0.0
+
+    def add(self, size, elapsed, read_wait):
+        self.requests += 1
+        self.bytes += size
+        self.time += elapsed
+        self.read_wait += read_wait
+
+    def get_metrics(self):
+        return {
+            'requests': self.requests,
+            'bytes': self.bytes,
+            'time': self.time,
+            'read_wait': self.read_wait,
+            'throughput': self.bytes / self.time if self.time else 0.0
+        }
+
+
+upload_metrics = UploadMetrics()
+
+
 async def read_request_data(request, chunk_size):
     '''
     cachable request data reader to help with conflict error requests
@@ -22,9 +141,7 @@ async def read_request_data(request, chunk_size):
                 # so retrying this request is not supported and we need to throw
                 # another error
                 raise UnRetryableRequestError()
-            start = request._last_read_pos
-            end = request._last_read_pos + chunk_size
-            data = request._cache_data[start:end]
+            data = request._cache_data.read(request._last_read_pos, chunk_size)
             request._last_read_pos += len(data)
             if request._last_read_pos >= len(request._cache_data):
                 # done reading cache data
@@ -32,7 +149,7 @@ async def read_request_data(request, chunk_size):
             return data
 
     if not hasattr(request, '_cache_data'):
-        request._cache_data = b''
+        request._cache_data = RequestDataCache()
 
     try:
         data = await request.content.readexactly(chunk_size)
@@ -44,12 +161,53 @@ async def read_request_data(request, chunk_size):
             # we only allow caching up to chunk size, otherwise, no cache data..
             request._cache_data = None
         else:
-            request._cache_data += data
+            request._cache_data.append(data)
 
     request._last_read_pos += len(data)
     return data
 
 
+def parse_range_header(header, size):
+    '''
+    Get the (start, end) byte positions, end included, requested by a
+    `Range` header for a file of the given size.
+
+    Returns None when the header can not be used and the whole file should
+    be sent, and an empty list when none of the ranges can be satisfied.
+    '''
+    unit, _, ranges_spec = header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+    specs = [spec.strip() for spec in ranges_spec.split(',') if spec.strip()]
+    if len(specs) == 0 or len(specs) > MAX_RANGES:
+        return None
+    ranges = []
+    for spec in specs:
+        start, sep, end = spec.partition('-')
+        try:
+            if not sep:
+                return None
+            if start == '':
+                # suffix range with the last bytes of the file
+                length = int(end)
+                if length <= 0:
+                    continue
+                ranges.append((max(size - length, 0), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end != '' else None
+        except ValueError:
+            return None
+        if start < 0 or (end is not None and end < start):
+            return None
+        if start >= size:
+            continue
+        if end is None or end >= size:
+            end = size - 1
+        ranges.append((start, end))
+    return ranges
+
+
 def get_contenttype(
         file=None,
         filename=None,
@@ -3,6 +3,7 @@ from zope.interface import Interface
 
 from .async_util import IAsyncJobPool  # noqa
 from .async_util import IAsyncUtility  # noqa
+from .async_util import IBlobGCUtility  # noqa
 from .async_util import IQueueUtility  # noqa
 from .behaviors import IAsyncBehavior  # noqa
 from .behaviors import IBehavior  # noqa
@@ -73,6 +74,8 @@ from .files import IFileCleanup  # noqa
 from .files import IFileField  # noqa
 from .files import IFileManager  # noqa
 from .files import IFileStorageManager  # noqa
+from .files import ILocalFile  # noqa
+from .files import ILocalFileField  # noqa
 from .files import IUploadDataManager  # noqa
 from .json import IFactorySerializeToJson  # noqa
 from .json import IJSONToValue  # noqa
@@ -20,3 +20,7 @@ class IQueueUtility(IAsyncUtility):
 
 class IAsyncJobPool(IAsyncUtility):
     pass
+
+
+class IBlobGCUtility(IAsyncUtility):
+    pass
@@ -36,9 +36,10 @@ class IAsyncContainer(Interface):
         asynchronously delete sub object
         """
 
-    async def async_items():  # type: ignore
+    async def async_items(suppress_events=False, metadata_only=False):  # type: ignore
         """
-        asynchronously get items
+        asynchronously get items, with `metadata_only` the items are loaded
+        without their state and only provide id, name, type, uuid and parent
         """
 
     async def async_len():  # type: ignore
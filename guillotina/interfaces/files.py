@@ -54,6 +54,19 @@ class IFileStorageManager(Interface):
         iterate through data in file
         '''
 
+    async def iter_data_range(start, end):
+        '''
+        iterate through data in file from byte start up to byte end, not
+        included. optional, files of storage managers without it are always
+        downloaded whole
+        '''
+
+    def get_file_path():  # type: ignore
+        '''
+        path of the file data on the local disk, files of storage managers
+        returning one are sent with sendfile. optional
+        '''
+
     async def append(data):
         '''
         append data to the file
@@ -180,3 +193,14 @@ class IDBFileField(ICloudFileField):
 class IDBFile(IFile):
     """Marker for a DBFile
     """
+
+
+class ILocalFileField(ICloudFileField):
+    '''
+    Store files in a directory tree on the local disk
+    '''
+
+
+class ILocalFile(IFile):
+    """Marker for a LocalFile
+    """
@@ -8,6 +8,7 @@ from guillotina.component import get_multi_adapter
 from guillotina.component import query_utility
 from guillotina.content import get_all_behaviors
 from guillotina.content import get_cached_factory
+from guillotina.db.reader import MetadataGhost
 from guillotina.directives import merged_tagged_value_dict
 from guillotina.directives import read_permission
 from guillotina.interfaces import IAbsoluteURL
@@ -178,14 +179,13 @@ class SerializeFolderToJson(SerializeToJson):
             result['items'] = []
         else:
             result['items'] = []
-            async for ident, member in self.context.async_items(suppress_events=True):
+            async for ident, member in self.context.async_items(
+                    suppress_events=True, metadata_only=True):
                 if not ident.startswith('_') and bool(
                         security.check_permission(
                         'guillotina.AccessContent', member)):
                     result['items'].append(
-                        await get_multi_adapter(
-                            (member, self.request),
-                            IResourceSerializeToJsonSummary)())
+                        await serialize_summary(self.context, member, self.request))
         result['length'] = length
 
         return result
@@ -215,3 +215,17 @@ class DefaultJSONSummarySerializer(object):
             'UID': self.context.uuid
         })
         return summary
+
+
+async def serialize_summary(container, member, request):
+    """Serialize the summary of a child of container.
+
+    The default summary only uses metadata, other summary serializers get
+    the member loaded with its state when it was loaded with metadata only.
+    """
+    serializer = get_multi_adapter((member, request), IResourceSerializeToJsonSummary)
+    if (isinstance(member, MetadataGhost) and
+            type(serializer) is not DefaultJSONSummarySerializer):
+        member = await container.async_get(member.__name__, suppress_events=True)
+        serializer = get_multi_adapter((member, request), IResourceSerializeToJsonSummary)
+    return await serializer()
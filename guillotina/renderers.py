@@ -1,17 +1,28 @@
 from aiohttp.web import Response as aioResponse
+from aiohttp.web import StreamResponse
 from datetime import datetime
 from guillotina import configure
+from guillotina._settings import app_settings
 from guillotina.interfaces import IResponse
 from guillotina.interfaces.security import PermissionSetting
 from guillotina.profile import profilable
+from typing import AsyncIterator
 from typing import Dict
 from typing import Optional
 from zope.interface.interface import InterfaceClass
 
+import inspect
 import json
+import logging
 import ujson
 
 
+logger = logging.getLogger('guillotina')
+
+# size of the buffered chunks written to a streamed response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
 class GuillotinaJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, complex):
@@ -37,6 +48,103 @@ class GuillotinaJSONEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
+def json_dumps(value) -> str:
+    return json.dumps(value, cls=GuillotinaJSONEncoder)
+
+
+def _fast_default(obj):
+    if isinstance(obj, datetime):
+        return obj.isoformat()
+    elif isinstance(obj, PermissionSetting):
+        return obj.get_name()
+    elif isinstance(obj, InterfaceClass):
+        return [x.__module__ + '.' + x.__name__ for x in obj.__iro__]  # noqa
+    elif isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f'{obj!r} is not JSON serializable')
+
+
+_native_types = (str, int, bool, type(None))
+
+# most decimals ujson before 2.0 encodes floats with
+_DOUBLE_PRECISION = 15
+
+
+def _is_exact(value):
+    try:
+        # the ujson decoder before 2.0 is not precise either
+        return float(ujson.dumps(value, double_precision=_DOUBLE_PRECISION)) == value
+    except (OverflowError, ValueError):
+        return False
+
+
+def _normalize(value):
+    if isinstance(value, _native_types):
+        return value
+    elif isinstance(value, float):
+        # ujson before 2.0 rounds floats to 15 decimals, leave the ones it
+        # can not encode exactly to GuillotinaJSONEncoder
+        if _is_exact(value):
+            return value
+        raise TypeError(f'{value!r} is not encoded exactly')
+    elif isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return _normalize(_fast_default(value))
+
+
+try:
+    ujson.dumps(None, default=_fast_default)
+    _ujson_default = True
+except TypeError:
+    # versions before 2.0 have no default hook
+    _ujson_default = False
+
+
+def fast_json_dumps(value) -> str:
+    '''
+    Encode with ujson, converting the values of the types guillotina renders
+    like `GuillotinaJSONEncoder`. Values of other types are encoded with it.
+
+    ujson versions before 2.0 have no hook for other types and round floats,
+    values are converted before encoding them and values with floats that
+    would be rounded are encoded with `GuillotinaJSONEncoder`.
+    '''
+    try:
+        if _ujson_default:
+            return ujson.dumps(value, default=_fast_default, escape_forward_slashes=False)
+        return ujson.dumps(_normalize(value), double_precision=_DOUBLE_PRECISION,
+                           escape_forward_slashes=False)
+    except (TypeError, OverflowError):
+        return json_dumps(value)
+
+
+def is_streamed(value) -> bool:
+    '''
+    If the value returned by a view is an async generator or a dict with
+    async generators as values, which are rendered while they are iterated
+    '''
+    if IResponse.providedBy(value):
+        value = value.content
+    if inspect.isasyncgen(value):
+        return True
+    if isinstance(value, dict):
+        return any(inspect.isasyncgen(item) for item in value.values())
+    return False
+
+
+async def collect_streamed(value):
+    '''
+    Iterate the async generators of a streamed value into lists
+    '''
+    if inspect.isasyncgen(value):
+        return [item async for item in value]
+    if isinstance(value, dict) and is_streamed(value):
+        return {key: await collect_streamed(item) for key, item in value.items()}
+    return value
+
+
 class Renderer:
     content_type: str
 
@@ -47,12 +155,22 @@ class Renderer:
     def get_body(self, value) -> Optional[bytes]:
         return str(value).encode('utf-8')
 
+    async def iter_body(self, value) -> AsyncIterator[bytes]:
+        '''
+        Encode a streamed value, renderers that can not encode it
+        incrementally render it once it is collected
+        '''
+        body = self.get_body(await collect_streamed(value))
+        if body is not None:
+            yield body
+
     @profilable
     async def __call__(self, value) -> aioResponse:
         '''
         Value can be:
         - Guillotina response object
         - serializable value
+        - streamed value, see `is_streamed`
         '''
         status = 200
         headers: Dict[str, str] = {}
@@ -65,9 +183,47 @@ class Renderer:
             'Content-Type': self.content_type
         })
 
+        if is_streamed(value):
+            return await self.stream(value, status, headers)
+
         return aioResponse(
             body=self.get_body(value), status=status, headers=headers)
 
+    async def stream(self, value, status, headers) -> StreamResponse:
+        '''
+        Send the value with chunked encoding while it is encoded. The
+        response is prepared here so the cors headers are added first.
+        '''
+        cors_renderer = app_settings['cors_renderer'](self.request)
+        cors_headers = await cors_renderer.get_headers()
+        cors_headers.update(headers)
+        resp = StreamResponse(status=status, headers=cors_headers)
+        resp.enable_chunked_encoding()
+        await resp.prepare(self.request)
+
+        buffer = bytearray()
+        try:
+            async for chunk in self.iter_body(value):
+                buffer += chunk
+                if len(buffer) >= STREAM_CHUNK_SIZE:
+                    # waits for slow clients once the transport buffer is full
+                    await resp.write(bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await resp.write(bytes(buffer))
+        except Exception:
+            # the status is sent already, close the connection without
+            # ending the chunked body so the client sees it is incomplete
+            logger.error('Error streaming response', exc_info=True)
+            self.request._view_error = True
+            resp.force_close()
+            transport = self.request.transport
+            if transport is not None:
+                transport.close()
+            return resp
+        await resp.write_eof()
+        return resp
+
 
 @configure.renderer(name='application/json')
 @configure.renderer(name='*/*')
@@ -76,10 +232,33 @@ class RendererJson(Renderer):
 
     def get_body(self, value) -> Optional[bytes]:
         if value is not None:
-            value = json.dumps(value, cls=GuillotinaJSONEncoder)
+            value = app_settings['json_dumps'](value)
             return value.encode('utf-8')
         return None
 
+    async def iter_body(self, value) -> AsyncIterator[bytes]:
+        dumps = app_settings['json_dumps']
+        if inspect.isasyncgen(value):
+            yield b'['
+            first = True
+            async for item in value:
+                if not first:
+                    yield b','
+                first = False
+                yield dumps(item).encode('utf-8')
+            yield b']'
+        elif isinstance(value, dict) and is_streamed(value):
+            yield b'{'
+            for idx, (key, item) in enumerate(value.items()):
+                if idx > 0:
+                    yield b','
+                yield dumps(key).encode('utf-8') + b':'
+                async for chunk in self.iter_body(item):
+                    yield chunk
+            yield b'}'
+        else:
+            yield dumps(value).encode('utf-8')
+
 
 class StringRenderer(Renderer):
     content_type = 'text/plain'
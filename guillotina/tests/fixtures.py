@@ -1,5 +1,6 @@
 import asyncio
 import os
+import tempfile
 from unittest import mock
 
 import aiohttp
@@ -67,6 +68,14 @@ def get_db_settings():
     if annotations['testdatabase'] == 'DUMMY':
         return settings
 
+    if annotations['testdatabase'] == 'sqlite':
+        for name in ('db', 'db-custom'):
+            settings['databases'][name].update({
+                'storage': 'sqlite',
+                'filename': os.path.join(annotations['sqlite_dir'], 'g.sqlite')
+            })
+        return settings
+
     settings['databases']['db']['storage'] = 'postgresql'
 
     settings['databases']['db']['dsn'] = {
@@ -112,6 +121,10 @@ def db():
     """
     if annotations['testdatabase'] == 'DUMMY':
         yield
+    elif annotations['testdatabase'] == 'sqlite':
+        with tempfile.TemporaryDirectory() as sqlite_dir:
+            annotations['sqlite_dir'] = sqlite_dir
+            yield sqlite_dir
     else:
         import pytest_docker_fixtures
         if annotations['testdatabase'] == 'cockroachdb':
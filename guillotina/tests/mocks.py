@@ -1,3 +1,4 @@
+from collections import Counter
 from guillotina.component import get_adapter
 from guillotina.db.cache.dummy import DummyCache
 from guillotina.db.interfaces import IStorage
@@ -36,6 +37,8 @@ class MockTransaction:
         self._lock = asyncio.Lock()
         self._status = 'started'
         self._db_conn = None
+        self._blob_oids = set()
+        self._blob_chunk_refs = Counter()
 
     async def get_connection(self):
         return self._db_conn
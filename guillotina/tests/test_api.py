@@ -6,6 +6,7 @@ from zope.interface import Interface
 
 from guillotina import configure
 from guillotina import schema
+from guillotina._settings import app_settings
 from guillotina.addons import Addon
 from guillotina.behaviors.dublincore import IDublinCore
 from guillotina.behaviors.attachment import IAttachment
@@ -757,6 +758,70 @@ async def test_items(container_requester):
         item = response['items'][0]
         assert 'guillotina.behaviors.dublincore.IDublinCore' not in item
 
+        response, _ = await requester(
+            'GET', '/db/guillotina/@items?page_size=10&summary=true')
+        assert [i['UID'] for i in response['items']] == items[:10]
+        assert set(response['items'][0].keys()) == {'@id', '@name', '@type', '@uid', 'UID'}
+
+
+async def test_children_are_ghosts_with_ghost_objects(container_requester):
+    app_settings['ghost_objects'] = True
+    try:
+        async with container_requester as requester:
+            for idx in range(3):
+                _, status = await requester(
+                    'POST', '/db/guillotina',
+                    data=json.dumps({
+                        '@type': 'Item',
+                        'id': f'foobar{idx}',
+                        'title': f'Foobar {idx}'
+                    }))
+                assert status == 201
+            response, _ = await requester('GET', '/db/guillotina/@items?include=title')
+            assert sorted(i['title'] for i in response['items']) == [
+                'Foobar 0', 'Foobar 1', 'Foobar 2']
+
+            request = utils.get_mocked_request(requester.db)
+            root = await utils.get_root(request)
+            async with managed_transaction(request=request, write=True):
+                container = await root.async_get('guillotina')
+                async for child in container.async_values(suppress_events=True):
+                    assert object.__getattribute__(child, '_BaseObject__ghost') is not None
+                    assert child.id.startswith('foobar')
+                    # the state is loaded once it is used
+                    child.title = child.title + ' changed'
+                    assert object.__getattribute__(child, '_BaseObject__ghost') is None
+                    child._p_register()
+
+            response, _ = await requester('GET', '/db/guillotina/@items?include=title')
+            assert sorted(i['title'] for i in response['items']) == [
+                'Foobar 0 changed', 'Foobar 1 changed', 'Foobar 2 changed']
+    finally:
+        app_settings['ghost_objects'] = False
+
+
+async def test_ids_and_items_are_streamed(container_requester):
+    async with container_requester as requester:
+        for idx in range(3):
+            await requester(
+                'POST', '/db/guillotina',
+                data=json.dumps({
+                    '@type': 'Item',
+                    'id': f'foobar{idx}'
+                }))
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/@ids')
+        assert status == 200
+        assert headers['Transfer-Encoding'] == 'chunked'
+        assert sorted(response) == ['foobar0', 'foobar1', 'foobar2']
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/@items?page_size=2')
+        assert headers['Transfer-Encoding'] == 'chunked'
+        assert len(response['items']) == 2
+        assert response['total'] == 3
+        assert response['page_size'] == 2
+
 
 async def test_debug_headers(container_requester):
     async with container_requester as requester:
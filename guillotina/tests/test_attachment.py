@@ -1,10 +1,15 @@
 from guillotina.behaviors.attachment import IAttachment
+from guillotina.blob import Blob
 from guillotina.component import get_multi_adapter
+from guillotina.files import upload_metrics
+from guillotina.files.dbfile import vacuum_blobs
 from guillotina.interfaces import IFileManager
 from guillotina.tests import utils
 from guillotina.transactions import managed_transaction
 
+import hashlib
 import json
+import os
 import random
 
 
@@ -268,6 +273,96 @@ async def test_copy_file_ob(container_requester):
             assert existing_bid != attachment.file._blob.bid
 
 
+async def test_tus_checksums(container_requester):
+    async with container_requester as requester:
+        _, status = await requester(
+            'POST',
+            '/db/guillotina/',
+            data=json.dumps({
+                '@type': 'Item',
+                '@behaviors': [IAttachment.__identifier__],
+                'id': 'foobar'
+            })
+        )
+        assert status == 201
+
+        data = os.urandom(1024 * 1024 * 2)
+        for md5, expected in (('foobar', 412), (hashlib.md5(data).hexdigest(), 200)):
+            response, status = await requester(
+                'POST',
+                '/db/guillotina/foobar/@tusupload/file',
+                headers={
+                    'UPLOAD-LENGTH': str(len(data)),
+                    'UPLOAD-MD5': md5,
+                    'UPLOAD-SHA256': hashlib.sha256(data).hexdigest(),
+                    'TUS-RESUMABLE': '1.0.0',
+                    'TUS-OVERRIDE-UPLOAD': '1'
+                }
+            )
+            assert status == 201
+
+            for offset in (0, 1024 * 1024):
+                response, status = await requester(
+                    'PATCH',
+                    '/db/guillotina/foobar/@tusupload/file',
+                    headers={
+                        'CONTENT-LENGTH': str(1024 * 1024),
+                        'TUS-RESUMABLE': '1.0.0',
+                        'upload-offset': str(offset)
+                    },
+                    data=data[offset:offset + 1024 * 1024]
+                )
+            # checked when the upload finishes
+            assert status == expected
+
+        response, status = await requester('GET', '/db/guillotina/foobar')
+        assert response[IAttachment.__identifier__]['file']['md5'] == md5
+
+
+async def test_upload_checksums(container_requester):
+    async with container_requester as requester:
+        _, status = await requester(
+            'POST',
+            '/db/guillotina/',
+            data=json.dumps({
+                '@type': 'Item',
+                '@behaviors': [IAttachment.__identifier__],
+                'id': 'foobar'
+            })
+        )
+        assert status == 201
+
+        data = os.urandom(1024 * 1024 * 6)
+        metrics = upload_metrics.get_metrics()
+        _, status = await requester(
+            'PATCH',
+            '/db/guillotina/foobar/@upload/file',
+            data=data,
+            headers={
+                'x-upload-size': str(len(data)),
+                'x-upload-sha256hash': hashlib.sha256(b'foobar').hexdigest()
+            }
+        )
+        assert status == 412
+
+        _, status = await requester(
+            'PATCH',
+            '/db/guillotina/foobar/@upload/file',
+            data=data,
+            headers={
+                'x-upload-size': str(len(data)),
+                'x-upload-sha256hash': hashlib.sha256(data).hexdigest()
+            }
+        )
+        assert status == 200
+        assert upload_metrics.get_metrics()['bytes'] == metrics['bytes'] + len(data) * 2
+
+        # computed when not given
+        response, status = await requester('GET', '/db/guillotina/foobar')
+        assert response[IAttachment.__identifier__]['file']['md5'] == hashlib.md5(
+            data).hexdigest()
+
+
 async def test_tus_unfinished_error(container_requester):
     async with container_requester as requester:
         _, status = await requester(
@@ -531,3 +626,159 @@ async def test_file_head_not_found(container_requester):
         response, status, headers = await requester.make_request(
             'HEAD', '/db/guillotina/foobar/@download/file', accept='application/json')
         assert status == 404
+
+
+async def test_download_ranges(container_requester):
+    async with container_requester as requester:
+        _, status = await requester(
+            'POST',
+            '/db/guillotina/',
+            data=json.dumps({
+                '@type': 'Item',
+                '@behaviors': [IAttachment.__identifier__],
+                'id': 'foobar'
+            })
+        )
+        assert status == 201
+        data = os.urandom(1024 * 1024 * 6)
+        response, status = await requester(
+            'PATCH',
+            '/db/guillotina/foobar/@upload/file',
+            data=data,
+            headers={
+                'x-upload-size': str(len(data))
+            }
+        )
+        assert status == 200
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file',
+            headers={'Range': 'bytes=5242870-5242889'})
+        assert status == 206
+        assert response == data[5242870:5242890]
+        assert headers['Content-Range'] == f'bytes 5242870-5242889/{len(data)}'
+        assert headers['Accept-Ranges'] == 'bytes'
+        etag = headers['ETag']
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file',
+            headers={'Range': 'bytes=-10', 'If-Range': etag})
+        assert status == 206
+        assert response == data[-10:]
+
+        # the whole file is sent if it changed
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file',
+            headers={'Range': 'bytes=-10', 'If-Range': '"foobar"'})
+        assert status == 200
+        assert len(response) == len(data)
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file',
+            headers={'Range': 'bytes=0-1,10-'})
+        assert status == 206
+        boundary = headers['Content-Type'].split('boundary=')[1]
+        assert int(headers['Content-Length']) == len(response)
+        parts = response.split(f'--{boundary}'.encode('ascii'))
+        assert parts[-1] == b'--\r\n'
+        assert parts[1].endswith(b'\r\n\r\n' + data[0:2] + b'\r\n')
+        assert f'Content-Range: bytes 10-{len(data) - 1}/{len(data)}'.encode(
+            'ascii') in parts[2]
+        assert parts[2].endswith(b'\r\n\r\n' + data[10:] + b'\r\n')
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file',
+            headers={'Range': f'bytes={len(data)}-'})
+        assert status == 416
+        assert headers['Content-Range'] == f'bytes */{len(data)}'
+
+
+async def test_vacuum_blobs(container_requester):
+    async with container_requester as requester:
+        _, status = await requester(
+            'POST',
+            '/db/guillotina/',
+            data=json.dumps({
+                '@type': 'Item',
+                '@behaviors': [IAttachment.__identifier__],
+                'id': 'foobar'
+            })
+        )
+        assert status == 201
+        _, status = await requester(
+            'PATCH',
+            '/db/guillotina/foobar/@upload/file',
+            data=b'X' * 1024,
+            headers={
+                'x-upload-size': '1024'
+            }
+        )
+        assert status == 200
+
+        # unfinished upload of another field
+        _, status = await requester(
+            'POST',
+            '/db/guillotina/foobar/@tusupload/file',
+            headers={
+                'UPLOAD-LENGTH': str(1024 * 2),
+                'TUS-RESUMABLE': '1.0.0'
+            }
+        )
+        assert status == 201
+        _, status = await requester(
+            'PATCH',
+            '/db/guillotina/foobar/@tusupload/file',
+            headers={
+                'CONTENT-LENGTH': '1024',
+                'TUS-RESUMABLE': '1.0.0',
+                'upload-offset': '0'
+            },
+            data=b'X' * 1024
+        )
+        assert status == 200
+
+        request = utils.get_mocked_request(requester.db)
+        root = await utils.get_root(request)
+        async with managed_transaction(request=request):
+            container = await root.async_get('guillotina')
+            obj = await container.async_get('foobar')
+            behavior = IAttachment(obj)
+            await behavior.load()
+            live = behavior.file._blob.bid
+            upload = obj.__uploads__['file']['_blob'].bid
+            # written without being referenced
+            blob = Blob(obj)
+            await blob.open('w').async_write_chunk(b'foobar')
+
+        async def get_blobs():
+            async with managed_transaction(request=request, abort_when_done=True) as txn:
+                return sorted([record['bid'] async for record in txn.iterate_blobs()])
+
+        tm = request._tm
+        assert await get_blobs() == sorted([live, upload, blob.bid])
+        assert await vacuum_blobs(tm, dry_run=True) == [(blob.bid, obj._p_oid)]
+        assert await get_blobs() == sorted([live, upload, blob.bid])
+
+        assert await vacuum_blobs(tm) == [(blob.bid, obj._p_oid)]
+        assert await get_blobs() == sorted([live, upload])
+
+        # abandoned upload
+        assert await vacuum_blobs(tm, max_age=0, batch_size=1) == [(upload, obj._p_oid)]
+        assert await get_blobs() == [live]
+
+        # duplicates get their own blobs
+        _, status = await requester(
+            'POST', '/db/guillotina/foobar/@duplicate',
+            data=json.dumps({'new_id': 'foobar2'}))
+        assert status == 200
+        async with managed_transaction(request=request, abort_when_done=True):
+            container = await root.async_get('guillotina')
+            obj2 = await container.async_get('foobar2')
+            behavior = IAttachment(obj2)
+            await behavior.load()
+            copied = behavior.file._blob
+            assert copied.bid != live
+            assert copied.resource_zoid == obj2._p_oid
+            assert b''.join([c async for c in copied.open().iter_async_read()]) == b'X' * 1024
+        assert await vacuum_blobs(tm, max_age=0) == []
+        assert await get_blobs() == sorted([live, copied.bid])
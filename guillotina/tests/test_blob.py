@@ -80,3 +80,103 @@ async def test_write_large_blob_data(db, guillotina_main):
         assert container.blob.chunks == 6
 
         await db.async_del('container')
+
+
+async def test_read_blob_range(db, guillotina_main):
+    root = get_utility(IApplication, name='root')
+    db = root['db']
+    request = get_mocked_request(db)
+    login(request)
+
+    async with managed_transaction(request=request):
+        container = await create_content_in_container(
+            db, 'Container', 'container', request=request,
+            title='Container')
+
+        blob = Blob(container)
+        container.blob = blob
+
+        blobfi = blob.open('w')
+        await blobfi.async_write(b'0123456789' * 3, chunk_size=10)
+
+    async with managed_transaction(request=request):
+        container = await db.async_get('container')
+        blobfi = container.blob.open()
+        assert container.blob.chunk_size == 10
+        read = []
+        blobfi.async_read_chunks = lambda indexes, read_chunks=blobfi.async_read_chunks: (
+            read.extend(indexes) or read_chunks(indexes))
+        data = b''.join([chunk async for chunk in blobfi.iter_async_read_range(15, 22)])
+        assert data == b'5678901'
+        # only the chunks of the range are read
+        assert read == [1, 2]
+
+        await db.async_del('container')
+
+
+async def test_read_blob_ahead(db, guillotina_main):
+    root = get_utility(IApplication, name='root')
+    db = root['db']
+    request = get_mocked_request(db)
+    login(request)
+
+    async with managed_transaction(request=request):
+        container = await create_content_in_container(
+            db, 'Container', 'container', request=request,
+            title='Container')
+
+        blob = Blob(container)
+        container.blob = blob
+
+        blobfi = blob.open('w')
+        await blobfi.async_write(b'0123456789' * 10, chunk_size=10)
+
+    async with managed_transaction(request=request):
+        container = await db.async_get('container')
+        blobfi = container.blob.open()
+        batches = []
+        blobfi.async_read_chunks = lambda indexes, read_chunks=blobfi.async_read_chunks: (
+            batches.append(indexes) or read_chunks(indexes))
+        chunks = [chunk async for chunk in blobfi.iter_async_read(read_ahead=40)]
+        assert b''.join(chunks) == b'0123456789' * 10
+        assert len(chunks) == 10
+        # several chunks are fetched with one query, at most 4 at a time
+        assert len(batches) < 10
+        assert max(len(indexes) for indexes in batches) <= 4
+        assert sorted(sum(batches, [])) == list(range(10))
+
+        await db.async_del('container')
+
+
+async def test_read_blob_into_buffer(db, guillotina_main):
+    root = get_utility(IApplication, name='root')
+    db = root['db']
+    request = get_mocked_request(db)
+    login(request)
+
+    async with managed_transaction(request=request):
+        container = await create_content_in_container(
+            db, 'Container', 'container', request=request,
+            title='Container')
+
+        blob = Blob(container)
+        container.blob = blob
+
+        data = bytearray(b'0123456789' * 10)
+        blobfi = blob.open('w')
+        await blobfi.async_write(memoryview(data), chunk_size=30)
+        # the stored chunks do not change with the buffer they came from
+        data[:10] = b'X' * 10
+
+    async with managed_transaction(request=request):
+        container = await db.async_get('container')
+        blobfi = container.blob.open()
+        assert container.blob.chunks == 4
+        buffer = bytearray(120)
+        assert await blobfi.async_readinto(buffer) == 100
+        assert buffer[:100] == b'0123456789' * 10
+        view = await blobfi.async_read_view()
+        assert isinstance(view, memoryview)
+        assert view == b'0123456789' * 10
+
+        await db.async_del('container')
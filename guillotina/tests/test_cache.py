@@ -3,6 +3,8 @@ from guillotina.db.transaction import Transaction
 from guillotina.tests import mocks
 from guillotina.tests.utils import create_content
 
+import os
+
 
 class MemoryCache(BaseCache):
 
@@ -97,7 +99,8 @@ async def test_do_not_cache_large_object(dummy_guillotina):
     cache = MemoryCache(txn)
     txn._cache = cache
     ob = create_content()
-    ob.foobar = 'X' * cache.max_cache_record_size  # push size above cache threshold
+    # push size above cache threshold, random data does not compress
+    ob.foobar = os.urandom(cache.max_cache_record_size)
     storage.store(ob)
     loaded = await txn.get(ob._p_oid)
     assert id(loaded) != id(ob)
@@ -0,0 +1,77 @@
+from guillotina._settings import app_settings
+from guillotina.component import get_adapter
+from guillotina.content import create_content
+from guillotina.db.codec import decode_state
+from guillotina.db.codec import encode_state
+from guillotina.db.codec import register_codec
+from guillotina.db.interfaces import IWriter
+from guillotina.db.reader import reader
+
+import pickle
+import pytest
+
+
+def _row(state):
+    return {
+        'state': state,
+        'zoid': 'foobar-oid',
+        'tid': 1,
+        'id': 'foobar'
+    }
+
+
+async def test_rows_without_header_load(dummy_guillotina):
+    ob = await create_content('Item', id='foobar', title='Foobar')
+    state = pickle.dumps(ob, protocol=pickle.HIGHEST_PROTOCOL)
+    assert reader(_row(state)).title == 'Foobar'
+
+
+async def test_large_states_are_compressed(dummy_guillotina):
+    ob = await create_content('Item', id='foobar', title='Foobar' * 20000)
+    state = get_adapter(ob, IWriter).serialize()
+    assert state[0] == 0x02
+    assert len(state) < len(ob.title)
+    assert reader(_row(state)).title == ob.title
+
+    ob.title = 'Foobar'
+    state = get_adapter(ob, IWriter).serialize()
+    assert state[0] == 0x01
+    assert reader(_row(state)).title == 'Foobar'
+
+
+async def test_compression_can_be_disabled(dummy_guillotina):
+    settings = app_settings['state_codec']
+    app_settings['state_codec'] = {'compress_threshold': None}
+    try:
+        assert encode_state(b'\x80' + b'0' * 100000)[0] == 0x01
+    finally:
+        app_settings['state_codec'] = settings
+
+
+class ReversedCodec:
+    name = 'reversed'
+    header = 0x10
+
+    def encode(self, data):
+        return data[::-1]
+
+    def decode(self, data):
+        return bytes(data)[::-1]
+
+
+def test_register_codec():
+    register_codec(ReversedCodec())
+    state = encode_state(b'\x80foobar', codec='reversed')
+    assert state == b'\x10raboof\x80'
+    assert decode_state(state) == b'\x80foobar'
+
+    with pytest.raises(ValueError):
+        decode_state(b'\x11foobar')
+
+
+def test_register_codec_with_used_header():
+    codec = ReversedCodec()
+    codec.name = 'other'
+    codec.header = 0x02
+    with pytest.raises(ValueError):
+        register_codec(codec)
@@ -1,6 +1,10 @@
 from guillotina.behaviors.dublincore import IDublinCore
+from guillotina.component import get_adapter
+from guillotina.content import create_content
 from guillotina.content import Item
+from guillotina.db.interfaces import IWriter
 from guillotina.db.orm.base import BaseObject
+from guillotina.db.reader import ghost_reader
 from guillotina.db.transaction import Transaction
 from guillotina.interfaces import IAnnotations
 from guillotina.interfaces import IResource
@@ -68,3 +72,43 @@ async def test_use_behavior_annotation(dummy_txn_root):
         await dublin.load()
         dublin.publisher = 'foobar'
         assert dublin.publisher == 'foobar'
+
+
+async def test_ghost_object_loads_state_on_access(dummy_guillotina):
+    ob = await create_content('Item', id='foobar', title='Foobar')
+    ob._p_oid = 'foobar-oid'
+    row = {
+        'state': get_adapter(ob, IWriter).serialize(),
+        'zoid': ob._p_oid,
+        'tid': 1,
+        'id': ob.id,
+        'type': ob.type_name
+    }
+    ghost = ghost_reader(row)
+    assert ghost.id == 'foobar'
+    assert ghost.uuid == 'foobar-oid'
+    assert ghost.type_name == 'Item'
+    assert IResource.providedBy(ghost)
+    assert isinstance(ghost, Item)
+    assert object.__getattribute__(ghost, '_BaseObject__ghost') is not None
+
+    assert ghost.title == 'Foobar'
+    assert object.__getattribute__(ghost, '_BaseObject__ghost') is None
+    assert type(ghost) is Item
+    assert ghost.__dict__ == ob.__dict__
+
+
+async def test_ghost_object_activates_on_write(dummy_guillotina):
+    ob = await create_content('Item', id='foobar', title='Foobar')
+    row = {
+        'state': get_adapter(ob, IWriter).serialize(),
+        'zoid': 'foobar-oid',
+        'tid': 1,
+        'id': ob.id,
+        'type': ob.type_name
+    }
+    ghost = ghost_reader(row)
+    ghost.title = 'Changed'
+    assert type(ghost) is Item
+    assert ghost.title == 'Changed'
+    assert ghost.creation_date == ob.creation_date
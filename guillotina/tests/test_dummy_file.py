@@ -0,0 +1,126 @@
+from guillotina.content import Folder
+from guillotina.db.storages.dummy import DummyFileStorage
+from guillotina.db.transaction_manager import TransactionManager
+from guillotina.tests.utils import create_content
+
+import os
+import pytest
+
+
+def get_storage(tmpdir, **kwargs):
+    return DummyFileStorage(filename=os.path.join(str(tmpdir), 'g.db'), **kwargs)
+
+
+async def create_items(storage):
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    item = create_content(parent=folder)
+    item.title = 'Foobar'
+    txn.register(item)
+    await storage.write_blob_chunk(txn, 'bid', item._p_oid, 0, b'foobar')
+    await tm.commit(txn=txn)
+    return folder, item
+
+
+async def test_loads_objects_after_restart(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = get_storage(tmpdir)
+    folder, item = await create_items(storage)
+    await storage.finalize()
+    request._txn = None
+
+    # from the snapshot of the index and by replaying the log
+    for remove_snapshot in (False, True):
+        if remove_snapshot:
+            os.remove(storage.snapshot_filename)
+        storage = get_storage(tmpdir)
+        tm = TransactionManager(storage)
+        txn = await tm.begin()
+        ob = await txn.get(item._p_oid)
+        assert ob.title == 'Foobar'
+        assert [key for key in await txn.keys(folder._p_oid)] == [item.id]
+        assert (await storage.read_blob_chunk(txn, 'bid', 0))['data'] == b'foobar'
+        assert await storage.get_next_tid(txn) > item._p_serial
+        await tm.abort(txn=txn)
+        await storage.finalize()
+        request._txn = None
+
+
+async def test_incomplete_record_is_truncated(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = get_storage(tmpdir)
+    folder, item = await create_items(storage)
+    size = storage._size
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    ob = await txn.get(item._p_oid)
+    ob.title = 'Changed'
+    txn.register(ob)
+    await tm.commit(txn=txn)
+    storage._file.close()
+    os.truncate(storage.filename, storage._size - 3)
+    request._txn = None
+
+    storage = get_storage(tmpdir)
+    assert storage._size == size
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    assert (await txn.get(item._p_oid)).title == 'Foobar'
+    await tm.abort(txn=txn)
+    await storage.finalize()
+
+
+async def test_compact_rewrites_live_records(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = get_storage(tmpdir)
+    folder, item = await create_items(storage)
+    tm = TransactionManager(storage)
+    for idx in range(5):
+        txn = await tm.begin()
+        item._p_jar = txn
+        item.title = 'Foobar {}'.format(idx)
+        txn.register(item)
+        await tm.commit(txn=txn)
+    # logs smaller than compact_min_size are not compacted
+    assert storage._compact_task is None
+    size = storage._size
+    await storage.compact()
+    assert storage._size < size
+
+    storage._compact_min_size = 0
+    txn = await tm.begin()
+    item._p_jar = txn
+    item.title = 'Foobar 5'
+    txn.register(item)
+    await tm.commit(txn=txn)
+    assert storage._compact_task is not None
+    await storage._compact_task
+
+    txn = await tm.begin()
+    assert (await txn.get(item._p_oid)).title == 'Foobar 5'
+    assert (await storage.read_blob_chunk(txn, 'bid', 0))['data'] == b'foobar'
+    await tm.abort(txn=txn)
+
+    txn = await tm.begin()
+    folder._p_jar = txn
+    txn.delete(folder)
+    await tm.commit(txn=txn)
+    # blobs of deleted children are found by their oid
+    assert 'bid' not in storage._blobs
+    assert storage._blob_oids == {}
+    await storage.finalize()
+    request._txn = None
+
+    storage = get_storage(tmpdir)
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    with pytest.raises(KeyError):
+        await txn.get(item._p_oid)
+    assert 'bid' not in storage._blobs
+    await tm.abort(txn=txn)
+    await storage.finalize()
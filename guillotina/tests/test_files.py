@@ -1,6 +1,8 @@
 from guillotina.exceptions import UnRetryableRequestError
 from guillotina.files.utils import get_contenttype
+from guillotina.files.utils import parse_range_header
 from guillotina.files.utils import read_request_data
+from guillotina.files.utils import RequestDataCache
 from guillotina.tests.utils import get_mocked_request
 
 import pytest
@@ -10,10 +12,20 @@ async def test_read_request_data_handles_retries():
     request = get_mocked_request()
     request._retry_attempt = 1
     request._last_read_pos = 0
-    request._cache_data = b'aaa'
+    request._cache_data = RequestDataCache([b'aaa'])
     assert await read_request_data(request, 5) == b'aaa'
 
 
+def test_request_data_cache_replays_chunks_without_copy():
+    chunks = [b'a' * 5, b'b' * 5, b'c' * 2]
+    cache = RequestDataCache(chunks)
+    assert len(cache) == 12
+    assert cache.read(0, 5) is chunks[0]
+    assert cache.read(10, 5) is chunks[2]
+    assert cache.read(3, 5) == b'aabbb'
+    assert cache.read(8, 10) == b'bbcc'
+
+
 async def test_read_request_data_throws_exception_if_no_cache_data():
     request = get_mocked_request()
     request._retry_attempt = 1
@@ -31,3 +43,16 @@ def test_get_content_type():
     assert get_contenttype(Foobar()) == 'application/json'
     assert get_contenttype(Foobar2()) == 'application/json'
     assert get_contenttype(None, default='application/json') == 'application/json'
+
+
+def test_parse_range_header():
+    assert parse_range_header('bytes=0-9', 100) == [(0, 9)]
+    assert parse_range_header('bytes=90-', 100) == [(90, 99)]
+    assert parse_range_header('bytes=-10', 100) == [(90, 99)]
+    assert parse_range_header('bytes=0-1, 50-1000', 100) == [(0, 1), (50, 99)]
+    # not satisfiable
+    assert parse_range_header('bytes=100-', 100) == []
+    # ignored
+    assert parse_range_header('items=0-9', 100) is None
+    assert parse_range_header('bytes=9-0', 100) is None
+    assert parse_range_header('bytes=a-b', 100) is None
@@ -0,0 +1,200 @@
+from aiohttp.web import FileResponse
+from guillotina._settings import app_settings
+from guillotina.behaviors.attachment import IAttachment
+from guillotina.files.localfile import _open_at
+from guillotina.files.localfile import _store
+from guillotina.files.localfile import get_object_path
+from guillotina.files.localfile import remove_object_files
+from guillotina.files.localfile import vacuum
+from guillotina.files.manager import SendfileResponse
+from guillotina.tests import utils
+from guillotina.transactions import managed_transaction
+from unittest import mock
+from zope.interface import directlyProvides
+
+import hashlib
+import json
+import os
+import pytest
+import time
+
+
+@pytest.fixture
+def local_files(container_requester, tmpdir):
+    settings = app_settings['local_file_storage']
+    app_settings['cloud_storage'] = 'guillotina.interfaces.ILocalFileField'
+    app_settings['local_file_storage'] = {'path': str(tmpdir), 'max_age': 60}
+    # the file manager marks the field with the storage in use
+    directlyProvides(IAttachment['file'])
+    yield str(tmpdir)
+    app_settings['cloud_storage'] = 'guillotina.interfaces.IDBFileField'
+    app_settings['local_file_storage'] = settings
+    directlyProvides(IAttachment['file'])
+
+
+def get_files(path):
+    return sorted(os.path.join(dirpath, filename)
+                  for dirpath, _, filenames in os.walk(path)
+                  for filename in filenames)
+
+
+async def create_item(requester, path='/db/guillotina/', id='foobar'):
+    response, status = await requester(
+        'POST', path,
+        data=json.dumps({
+            '@type': 'Item',
+            '@behaviors': [IAttachment.__identifier__],
+            'id': id
+        })
+    )
+    assert status == 201
+    return response
+
+
+async def upload(requester, data, path='/db/guillotina/foobar'):
+    _, status = await requester(
+        'PATCH', f'{path}/@upload/file',
+        data=data,
+        headers={
+            'x-upload-size': str(len(data))
+        }
+    )
+    assert status == 200
+
+
+async def test_upload_and_download_local_file(container_requester, local_files):
+    async with container_requester as requester:
+        await create_item(requester)
+        data = os.urandom(1024 * 1024 * 6)
+        await upload(requester, data)
+
+        files = get_files(local_files)
+        assert len(files) == 1
+        with open(files[0], 'rb') as fi:
+            assert fi.read() == data
+
+        response, status = await requester('GET', '/db/guillotina/foobar')
+        assert response['guillotina.behaviors.attachment.IAttachment']['file'] == {
+            'filename': response['guillotina.behaviors.attachment.IAttachment']['file'][
+                'filename'],
+            'content_type': 'application/octet-stream',
+            'size': len(data),
+            'extension': None,
+            'md5': hashlib.md5(data).hexdigest()
+        }
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file')
+        assert status == 200
+        assert response == data
+        assert headers['ETag'] == f'"{hashlib.md5(data).hexdigest()}"'
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file',
+            headers={'Range': 'bytes=100-199'})
+        assert status == 206
+        assert response == data[100:200]
+        assert headers['Content-Range'] == f'bytes 100-199/{len(data)}'
+
+        response, status, headers = await requester.make_request(
+            'GET', '/db/guillotina/foobar/@download/file',
+            headers={'Range': 'bytes=0-9,-10'})
+        assert status == 206
+        assert data[:10] in response
+        assert data[-10:] in response
+
+        # the replaced file is removed
+        await upload(requester, b'foobar')
+        files = get_files(local_files)
+        assert len(files) == 1
+        with open(files[0], 'rb') as fi:
+            assert fi.read() == b'foobar'
+
+        _, status = await requester('DELETE', '/db/guillotina/foobar')
+        assert status == 200
+        assert get_files(local_files) == []
+
+
+async def test_vacuum_local_files(container_requester, local_files):
+    async with container_requester as requester:
+        response = await create_item(requester)
+        await upload(requester, b'foobar')
+        item_path = os.path.join(
+            local_files, 'db', get_object_path(response['@uid']))
+        live = get_files(local_files)
+
+        orphans = []
+        for path in (os.path.join(item_path, 'aborted'),
+                     os.path.join(local_files, 'db', 'tmp', 'abandoned'),
+                     os.path.join(local_files, 'db', get_object_path('deleted'), 'foobar')):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fi:
+                fi.write(b'foobar')
+            orphans.append(path)
+
+        request = utils.get_mocked_request(requester.db)
+        async with managed_transaction(request=request, abort_when_done=True) as txn:
+            # too recent to be removed
+            assert await vacuum(txn) == []
+
+            for path in get_files(local_files):
+                os.utime(path, (time.time() - 3600, time.time() - 3600))
+            assert sorted(await vacuum(txn, dry_run=True)) == sorted(orphans)
+            assert len(get_files(local_files)) == 4
+            assert sorted(await vacuum(txn)) == sorted(orphans)
+            assert get_files(local_files) == live
+
+
+def test_files_are_only_removed_with_local_file_storage():
+    ob = mock.Mock(_p_oid='foobar')
+    ob._p_jar.manager.db_id = 'db'
+    remove_object_files(ob, None)
+    assert not ob._p_jar.add_after_commit_hook.called
+
+    app_settings['cloud_storage'] = 'guillotina.interfaces.ILocalFileField'
+    try:
+        remove_object_files(ob, None)
+    finally:
+        app_settings['cloud_storage'] = 'guillotina.interfaces.IDBFileField'
+    assert ob._p_jar.add_after_commit_hook.called
+
+
+def test_replayed_uploads_store_the_same_data(tmpdir):
+    tmp_path = os.path.join(str(tmpdir), 'tmp', 'upload')
+    os.makedirs(os.path.dirname(tmp_path))
+    open(tmp_path, 'wb').close()
+    # requests are replayed on conflicts, chunks are written again at their offset
+    for _ in range(2):
+        for offset, chunk in ((0, b'foo'), (3, b'bar')):
+            fi = _open_at(tmp_path, offset)
+            fi.write(chunk)
+            fi.close()
+        path = os.path.join(str(tmpdir), 'ob', os.urandom(4).hex())
+        assert _store(tmp_path, path) == (6, hashlib.md5(b'foobar').hexdigest())
+        with open(path, 'rb') as fi:
+            assert fi.read() == b'foobar'
+        # kept until the transaction is committed
+        assert os.path.exists(tmp_path)
+
+
+def test_sendfile_is_only_used_on_plain_sockets(tmpdir):
+    path = os.path.join(str(tmpdir), 'data')
+    with open(path, 'wb') as fi:
+        fi.write(b'foobar')
+    extra = {'sslcontext': None, 'socket': object()}
+    request = mock.Mock()
+    request.transport.get_extra_info = extra.get
+    system = FileResponse._sendfile_system
+    with mock.patch('guillotina.files.manager._sendfile_args', 'count'):
+        with mock.patch.object(FileResponse, '_sendfile', system):
+            assert SendfileResponse(path, start=1, count=3)._use_sendfile(request)
+
+            # aiohttp falls back to sending whole chunks, past the range
+            resp = SendfileResponse(path, start=1, count=3)
+            resp.enable_compression()
+            assert not resp._use_sendfile(request)
+            extra['sslcontext'] = object()
+            assert not SendfileResponse(path, start=1, count=3)._use_sendfile(request)
+            extra['sslcontext'] = None
+            extra['socket'] = None
+            assert not SendfileResponse(path, start=1, count=3)._use_sendfile(request)
@@ -0,0 +1,144 @@
+from guillotina.content import Folder
+from guillotina.db.storages.mvcc import MVCCStorage
+from guillotina.db.transaction_manager import TransactionManager
+from guillotina.exceptions import ConflictError
+from guillotina.exceptions import ConflictIdOnContainer
+from guillotina.exceptions import TIDConflictError
+from guillotina.tests.utils import create_content
+from guillotina.tests.utils import get_mocked_request
+
+import asyncio
+import pytest
+
+
+async def create_folder(tm):
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    await tm.commit(txn=txn)
+    return folder
+
+
+async def test_transactions_read_their_snapshot(dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = MVCCStorage()
+    tm = TransactionManager(storage)
+    folder = await create_folder(tm)
+
+    reader = await tm.begin()
+    assert await reader.len(folder._p_oid) == 0
+
+    txn = await tm.begin()
+    item = create_content(parent=folder)
+    item.title = 'Foobar'
+    txn.register(item)
+    await tm.commit(txn=txn)
+
+    # not in the ones that started before they were committed
+    assert await reader.len(folder._p_oid) == 0
+    with pytest.raises(KeyError):
+        await reader.get(item._p_oid)
+    await tm.abort(txn=reader)
+
+    txn = await tm.begin()
+    assert await txn.len(folder._p_oid) == 1
+    assert (await txn.get(item._p_oid)).title == 'Foobar'
+    await tm.abort(txn=txn)
+
+    # versions that can not be read anymore are dropped
+    assert storage.get_metrics()['snapshots'] == 0
+    assert storage.get_metrics()['versions'] == 2
+
+
+async def test_updates_of_changed_objects_conflict(dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = MVCCStorage(transaction_strategy='writeset')
+    tm = TransactionManager(storage)
+    folder = await create_folder(tm)
+
+    txn1 = await tm.begin()
+    txn2 = await tm.begin()
+    ob1 = await txn1.get(folder._p_oid)
+    ob2 = await txn2.get(folder._p_oid)
+    ob1.title = 'foobar1'
+    ob2.title = 'foobar2'
+    txn1.register(ob1)
+    txn2.register(ob2)
+    await tm.commit(txn=txn1)
+    with pytest.raises(TIDConflictError):
+        await tm.commit(txn=txn2)
+    assert storage.get_metrics()['conflicts'] == 1
+
+    txn = await tm.begin()
+    assert (await txn.get(folder._p_oid)).title == 'foobar1'
+    item1 = create_content(id='foobar', parent=folder)
+    txn.register(item1)
+    await tm.commit(txn=txn)
+
+    # ids are unique in a folder
+    txn = await tm.begin()
+    item2 = create_content(id='foobar', parent=folder)
+    txn.register(item2)
+    with pytest.raises(ConflictIdOnContainer):
+        await tm.commit(txn=txn)
+
+
+async def test_resolve_strategy_detects_conflicts(dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = MVCCStorage(latency=0.001)
+    tm = TransactionManager(storage)
+    folder = await create_folder(tm)
+
+    async def change(title):
+        request = get_mocked_request()  # noqa every change has its own request
+        txn = await tm.begin(request=request)
+        ob = await txn.get(folder._p_oid)
+        ob.title = title
+        txn.register(ob)
+        await tm.commit(txn=txn)
+
+    results = await asyncio.gather(*[
+        change(f'foobar{idx}') for idx in range(5)], return_exceptions=True)
+    conflicts = [result for result in results if isinstance(result, ConflictError)]
+    assert len(conflicts) == 4
+
+
+async def test_children_are_found_by_id_in_the_snapshot(dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = MVCCStorage()
+    tm = TransactionManager(storage)
+    folder = await create_folder(tm)
+
+    txn = await tm.begin()
+    item = create_content(id='foobar', parent=folder)
+    txn.register(item)
+    await tm.commit(txn=txn)
+
+    reader = await tm.begin()
+    txn = await tm.begin()
+    item = await txn.get(item._p_oid)
+    item.id = 'foobar2'
+    txn.register(item)
+    await tm.commit(txn=txn)
+
+    # the old id is kept for the snapshot of the reader
+    assert (await storage.get_child(reader, folder._p_oid, 'foobar'))['zoid'] == item._p_oid
+    assert await storage.get_child(reader, folder._p_oid, 'foobar2') is None
+    await tm.abort(txn=reader)
+
+    txn = await tm.begin()
+    assert await storage.get_child(txn, folder._p_oid, 'foobar') is None
+    assert (await storage.get_child(txn, folder._p_oid, 'foobar2'))['zoid'] == item._p_oid
+    assert [row['id'] for row in await storage.get_children(
+        txn, folder._p_oid, ['foobar', 'foobar2'])] == ['foobar2']
+    await tm.abort(txn=txn)
+
+    # ids of versions that can not be read anymore are dropped
+    txn = await tm.begin()
+    txn.delete(await txn.get(item._p_oid))
+    await tm.commit(txn=txn)
+    assert storage._child_ids == {}
@@ -1,20 +1,33 @@
+from guillotina.async_util import PostgresqlAsyncJobPool
 from guillotina.content import Folder
+from guillotina.db.interfaces import IWriter
+from guillotina.db.reader import MetadataGhost
 from guillotina.db.storages.cockroach import CockroachStorage
+from guillotina.db.storages.pg import PGPoolMonitor
 from guillotina.db.storages.pg import PostgresqlStorage
+from guillotina.db.storages.pg import parse_lsn
 from guillotina.db.transaction_manager import TransactionManager
 from guillotina.exceptions import ConflictError
+from guillotina.exceptions import PoolExhaustedError
+from guillotina.exceptions import StateNotLoadedError
+from guillotina.exceptions import TIDConflictError
+from guillotina.factory.content import Database
+from guillotina.interfaces import IPrincipalRoleManager
 from guillotina.tests import mocks
+from guillotina.tests import utils
 from guillotina.tests.utils import create_content
+from unittest import mock
 
 import asyncio
 import asyncpg
 import concurrent
 import os
 import pytest
+import ujson
 
 
 DATABASE = os.environ.get('DATABASE', 'DUMMY')
-USE_RDMS = DATABASE != 'DUMMY'
+USE_RDMS = DATABASE not in ('DUMMY', 'sqlite')
 
 
 async def cleanup(aps):
@@ -35,7 +48,7 @@ async def cleanup(aps):
     await aps.finalize()
 
 
-async def get_aps(postgres, strategy=None, pool_size=16):
+async def get_aps(postgres, strategy=None, pool_size=16, **kwargs):
     dsn = "postgres://postgres:@{}:{}/guillotina".format(
         postgres[0],
         postgres[1],
@@ -55,12 +68,12 @@ async def get_aps(postgres, strategy=None, pool_size=16):
     aps = klass(
         dsn=dsn, name='db',
         transaction_strategy=strategy, pool_size=pool_size,
-        conn_acquire_timeout=0.1)
+        conn_acquire_timeout=0.1, **kwargs)
     await aps.initialize()
     return aps
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_read_obs(db, dummy_request):
     """Low level test checks that root is not there"""
     request = dummy_request  # noqa so magically get_current_request can find
@@ -87,7 +100,7 @@ async def test_read_obs(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_restart_connection(db, dummy_request):
     """Low level test checks that root is not there"""
     request = dummy_request  # noqa so magically get_current_request can find
@@ -117,7 +130,7 @@ async def test_restart_connection(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY'),
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
                     reason="Cockroach does not have cascade support")
 async def test_deleting_parent_deletes_children(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
@@ -163,7 +176,7 @@ async def test_deleting_parent_deletes_children(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_create_blob(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -193,7 +206,7 @@ async def test_create_blob(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_delete_resource_deletes_blob(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -226,7 +239,58 @@ async def test_delete_resource_deletes_blob(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY'),
+@pytest.mark.skipif(DATABASE != 'postgres', reason='Only postgresql has triggers')
+async def test_blob_chunks_are_deduplicated(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(db, blob_dedup=True)
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    ob = create_content()
+    txn.register(ob)
+    await txn.write_blob_chunk('X' * 32, ob._p_oid, 0, b'foobar')
+    await txn.write_blob_chunk('X' * 32, ob._p_oid, 1, b'barfoo')
+    await txn.write_blob_chunk('Y' * 32, ob._p_oid, 0, b'foobar')
+    await tm.commit(txn=txn)
+
+    chunks = await aps._read_conn.fetch(
+        'SELECT hash, refcount, data FROM blobs_chunks ORDER BY data')
+    assert [(chunk['data'], chunk['refcount']) for chunk in chunks] == [
+        (b'barfoo', 1), (b'foobar', 2)]
+
+    # chunks stored with a hash are still read with blob_dedup turned off
+    plain_aps = await get_aps(db)
+    plain_tm = TransactionManager(plain_aps)
+    txn = await plain_tm.begin()
+    assert (await txn.read_blob_chunk('Y' * 32, 0))['data'] == b'foobar'
+    assert [record['data'] for record in await txn.read_blob_chunk_batch(
+        'X' * 32, [0, 1])] == [b'foobar', b'barfoo']
+    await plain_tm.abort(txn=txn)
+    await plain_aps.finalize()
+
+    txn = await tm.begin()
+    assert (await txn.read_blob_chunk('Y' * 32, 0))['data'] == b'foobar'
+    assert [record['data'] for record in await txn.read_blob_chunk_batch(
+        'X' * 32, [0, 1])] == [b'foobar', b'barfoo']
+    await txn.del_blob('X' * 32)
+    await tm.commit(txn=txn)
+
+    # chunks are removed when no blob refers to them
+    chunks = await aps._read_conn.fetch('SELECT refcount, data FROM blobs_chunks')
+    assert [(chunk['data'], chunk['refcount']) for chunk in chunks] == [(b'foobar', 1)]
+
+    txn = await tm.begin()
+    assert (await txn.read_blob_chunk('Y' * 32, 0))['data'] == b'foobar'
+    assert await txn.read_blob_chunk('X' * 32, 0) is None
+    await tm.abort(txn=txn)
+
+    await aps._read_conn.execute('DROP TABLE IF EXISTS blobs_chunks')
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
                     reason="Cockroach not support resolve...")
 async def test_should_raise_conflict_error_when_editing_diff_data_with_resolve_strat(
         db, dummy_request):
@@ -266,7 +330,7 @@ async def test_should_raise_conflict_error_when_editing_diff_data_with_resolve_s
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY'),
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
                     reason="Cockroach not support resolve...")
 async def test_should_resolve_conflict_error(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
@@ -303,7 +367,7 @@ async def test_should_resolve_conflict_error(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY'),
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
                     reason="Cockroach not support resolve...")
 async def test_should_not_resolve_conflict_error_with_resolve(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
@@ -339,7 +403,7 @@ async def test_should_not_resolve_conflict_error_with_resolve(db, dummy_request)
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY'),
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
                     reason="Cockroach not support simple...")
 async def test_should_not_resolve_conflict_error_with_simple_strat(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
@@ -376,7 +440,196 @@ async def test_should_not_resolve_conflict_error_with_simple_strat(db, dummy_req
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
+                    reason="Cockroach not support writeset...")
+async def test_writeset_strat_only_conflicts_on_written_objects(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(db, 'writeset')
+    tm = TransactionManager(aps)
+
+    txn = await tm.begin()
+    ob1 = create_content()
+    ob2 = create_content()
+    txn.register(ob1)
+    txn.register(ob2)
+    await tm.commit(txn=txn)
+
+    async def get_conflicts(txn):
+        raise AssertionError('conflicts should not be queried')
+    aps.get_conflicts = get_conflicts
+
+    # different objects, no conflict
+    txn1 = await tm.begin()
+    txn2 = await tm.begin()
+    ob1 = await txn1.get(ob1._p_oid)
+    ob2 = await txn2.get(ob2._p_oid)
+    ob1.title = 'foobar1'
+    ob2.title = 'foobar2'
+    txn1.register(ob1)
+    txn2.register(ob2)
+    await tm.commit(txn=txn2)
+    await tm.commit(txn=txn1)
+
+    oid1 = ob1._p_oid
+    oid2 = ob2._p_oid
+
+    # same object, second commit fails on the tid check of the update
+    txn1 = await tm.begin()
+    txn2 = await tm.begin()
+    ob1 = await txn1.get(ob1._p_oid)
+    ob2 = await txn2.get(ob1._p_oid)
+    ob1.title = 'foobar3'
+    ob2.title = 'foobar4'
+    txn1.register(ob1)
+    txn2.register(ob2)
+    await tm.commit(txn=txn2)
+    with pytest.raises(TIDConflictError):
+        await tm.commit(txn=txn1)
+
+    txn = await tm.begin()
+    ob1 = await txn.get(oid1)
+    ob2 = await txn.get(oid2)
+    assert ob1.title == 'foobar4'
+    assert ob2.title == 'foobar2'
+    await tm.abort(txn=txn)
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
+                    reason="Cockroach does not use a tid sequence")
+async def test_tid_blocks_are_allocated_in_order(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(db, 'resolve', tid_block_size=5)
+    assert aps.tid_allocator is None
+    await aps.finalize()
+
+    aps = await get_aps(db, 'writeset', tid_block_size=5)
+    tm = TransactionManager(aps)
+    tids = []
+    for _ in range(12):
+        tids.append(await aps.get_next_tid(None))
+    assert tids == sorted(set(tids))
+
+    # the sequence is never behind tids already handed out
+    txn = await tm.begin()
+    ob1 = create_content()
+    txn.register(ob1)
+    await tm.commit(txn=txn)
+    assert txn._tid > tids[-1]
+    assert txn._tid <= await aps.get_current_tid(None)
+
+    metrics = aps.tid_allocator.get_metrics()
+    assert metrics['allocated'] == 13
+    assert metrics['waits'] >= 1
+    assert metrics['refills'] >= 3
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
+                    reason="Not for dummy db")
+async def test_read_only_requests_use_read_replica(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    # the primary is used as replica to test the routing
+    dsn = "postgres://postgres:@{}:{}/guillotina".format(db[0], db[1])
+    aps = await get_aps(db, read_dsn=dsn, read_pool_size=2)
+    assert aps.has_read_replica
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+    ob1 = create_content()
+    txn.register(ob1)
+    await tm.commit(txn=txn)
+    committed_lsn = txn._commit_lsn
+    assert parse_lsn(committed_lsn) is not None
+
+    async def get_connection(request):
+        txn = await tm.begin(request=request)
+        await txn.get(ob1._p_oid)
+        conn = txn._db_conn
+        replica = conn in aps._replica_conns
+        await tm.abort(txn=txn)
+        return replica
+
+    read_request = utils.get_mocked_request()
+    read_request._db_write_enabled = False
+    assert await get_connection(read_request)
+
+    write_request = utils.get_mocked_request()
+    assert not await get_connection(write_request)
+
+    # the primary is not a standby, we can not tell it replayed the commit
+    read_request = utils.get_mocked_request(headers={
+        'X-Guillotina-LSN': committed_lsn})
+    read_request._db_write_enabled = False
+    assert not await get_connection(read_request)
+
+    # replica has replayed the commit of the client
+    aps._replica_lsn = parse_lsn(committed_lsn)
+    read_request = utils.get_mocked_request(headers={
+        'X-Guillotina-LSN': committed_lsn})
+    read_request._db_write_enabled = False
+    assert await get_connection(read_request)
+    assert len(aps._replica_conns) == 0
+    metrics = aps.get_pool_metrics()
+    assert metrics['replica']['in_use'] == 0
+    # 2 transactions and 1 check of the replica wal position
+    assert metrics['replica']['acquired'] == 3
+    # shared read connection
+    assert metrics['primary']['in_use'] == 1
+
+    await aps.remove()
+    await cleanup(aps)
+
+
+class FakePool:
+
+    async def acquire(self, timeout=None):
+        return object()
+
+
+async def test_pool_monitor_fails_fast_when_too_many_waiters(loop):
+    monitor = PGPoolMonitor(1, max_waiters=1)
+    pool = FakePool()
+    conn = await monitor.acquire(pool, 1)
+    waiter = asyncio.ensure_future(monitor.acquire(pool, 1))
+    await asyncio.sleep(0.01)
+    assert monitor.get_metrics()['waiters'] == 1
+    with pytest.raises(PoolExhaustedError):
+        await monitor.acquire(pool, 1)
+
+    monitor.release(conn)
+    conn = await asyncio.wait_for(waiter, 1)
+    metrics = monitor.get_metrics()
+    assert metrics['in_use'] == 1
+    assert metrics['acquired'] == 2
+    assert metrics['rejected'] == 1
+    assert sum(metrics['acquire_time'].values()) == 2
+
+    with pytest.raises(asyncio.TimeoutError):
+        await monitor.acquire(pool, 0.01)
+    assert monitor.get_metrics()['timeouts'] == 1
+
+
+async def test_adaptive_pool_monitor(loop):
+    monitor = PGPoolMonitor(1, max_size=2, grow_after=0.01, shrink_after=0)
+    pool = FakePool()
+    conn1 = await monitor.acquire(pool, 1)
+    conn2 = await monitor.acquire(pool, 1)
+    assert monitor.get_metrics()['size'] == 2
+
+    monitor.release(conn2)
+    monitor.release(conn1)
+    assert monitor.get_metrics()['size'] == 1
+    assert monitor.get_metrics()['idle'] == 1
+
+
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_none_strat_allows_trans_commits(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -413,7 +666,7 @@ async def test_none_strat_allows_trans_commits(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_count_total_objects(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -438,7 +691,7 @@ async def test_count_total_objects(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_get_resources_of_type(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -467,7 +720,115 @@ async def test_get_resources_of_type(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
+                    reason='Metadata queries are postgresql specific')
+async def test_get_children_metadata_only(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(db)
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    parent = create_content(Folder, 'Folder')
+    txn.register(parent)
+    item = create_content(parent=parent)
+    txn.register(item)
+    shared = create_content(parent=parent)
+    IPrincipalRoleManager(shared).assign_role_to_principal('guillotina.Reader', 'foobar')
+    txn.register(shared)
+
+    await tm.commit(txn=txn)
+    txn = await tm.begin()
+
+    children = {}
+    async for child in txn.get_children(parent, [item.id, shared.id], metadata_only=True):
+        children[child.__name__] = child
+    assert isinstance(children[item.id], MetadataGhost)
+    assert children[item.id].uuid == item._p_oid
+    assert children[item.id].type_name == 'Item'
+    assert children[item.id].acl == {}
+    with pytest.raises(StateNotLoadedError):
+        children[item.id].title
+
+    # local roles are in the state, the row is loaded with it
+    assert not isinstance(children[shared.id], MetadataGhost)
+    assert 'prinrole' in children[shared.id].acl
+
+    count = 0
+    async for row in txn._get_resources_of_type('Item', metadata_only=True):
+        assert row['state'] is None or row['zoid'] == shared._p_oid
+        count += 1
+    assert count == 2
+
+    await tm.abort(txn=txn)
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(DATABASE != 'postgres', reason='Cockroach writes json with the object')
+async def test_deferred_json_is_projected_after_commit(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(db, deferred_json=True)
+    tm = TransactionManager(aps)
+    txn = await tm.begin()
+
+    parent = create_content(Folder, 'Folder')
+    txn.register(parent)
+    item = create_content(parent=parent)
+    item.title = 'Foobar'
+    txn.register(item)
+    await tm.commit(txn=txn)
+    tid = txn._tid
+
+    assert await aps.wait_for_json(tid, timeout=5)
+    conn = await aps.open()
+    json = await conn.fetchval('SELECT json FROM objects WHERE zoid = $1', item._p_oid)
+    # same data as writing it with the object
+    assert json is not None
+    assert ujson.loads(json) == await IWriter(item).get_json()
+    assert await conn.fetchval('SELECT count(*) FROM objects_json_queue') == 0
+
+    # updates are queued again
+    txn = await tm.begin()
+    item = await txn.get(item._p_oid)
+    item.title = 'Foobar2'
+    txn.register(item)
+    await tm.commit(txn=txn)
+    assert await aps.wait_for_json(txn._tid, timeout=5)
+    json = await conn.fetchval('SELECT json FROM objects WHERE zoid = $1', item._p_oid)
+    assert '"title": "Foobar2"' in json
+
+    # rows of versions that are not current do not block the queue
+    await conn.execute(
+        'INSERT INTO objects_json_queue (zoid, tid) VALUES ($1, 1)', item._p_oid)
+    assert await aps.wait_for_json(txn._tid, timeout=5)
+    assert await conn.fetchval('SELECT count(*) FROM objects_json_queue') == 0
+
+    # objects that fail stay queued to be retried and are not waited for
+    async def get_json(writer):
+        raise Exception('Failed')
+
+    txn = await tm.begin()
+    item = await txn.get(item._p_oid)
+    item.title = 'Foobar3'
+    txn.register(item)
+    with mock.patch('guillotina.db.writer.ResourceWriter.get_json', get_json):
+        await tm.commit(txn=txn)
+        assert await aps.wait_for_json(txn._tid, timeout=5)
+    row = await conn.fetchrow(
+        'SELECT tid, attempts, retry_at FROM objects_json_queue WHERE zoid = $1',
+        item._p_oid)
+    assert row['tid'] == txn._tid
+    assert row['attempts'] == 1
+    assert row['retry_at'] is not None
+
+    await aps.close(conn)
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_get_total_resources_of_type(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -491,7 +852,7 @@ async def test_get_total_resources_of_type(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_using_gather_with_queries_before_prepare(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -520,7 +881,7 @@ async def test_using_gather_with_queries_before_prepare(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_using_gather_with_queries_after_prepare(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -552,7 +913,7 @@ async def test_using_gather_with_queries_after_prepare(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_exhausting_pool_size(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -573,7 +934,7 @@ async def test_exhausting_pool_size(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_mismatched_tid_causes_conflict_error(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -598,7 +959,7 @@ async def test_mismatched_tid_causes_conflict_error(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_iterate_keys(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
 
@@ -628,7 +989,7 @@ async def test_iterate_keys(db, dummy_request):
     await tm.abort(txn=txn)
 
 
-@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY'),
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
                     reason="Cockroach does not like this test...")
 async def test_handles_asyncpg_trying_savepoints(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
@@ -662,7 +1023,7 @@ async def test_handles_asyncpg_trying_savepoints(db, dummy_request):
     await cleanup(aps)
 
 
-@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY'),
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
                     reason="Cockroach does not like this test...")
 async def test_handles_asyncpg_trying_txn_with_manual_txn(db, dummy_request):
     request = dummy_request  # noqa so magically get_current_request can find
@@ -693,3 +1054,93 @@ async def test_handles_asyncpg_trying_txn_with_manual_txn(db, dummy_request):
 
     await aps.remove()
     await cleanup(aps)
+
+
+_durable_jobs_run = []
+
+
+async def _durable_job(value):
+    if value == 'error':
+        # not taken for the pool exiting
+        raise RuntimeError('Job error')
+    _durable_jobs_run.append(value)
+
+
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
+                    reason='Cockroach does not support SKIP LOCKED')
+async def test_durable_job_pool_stores_jobs_with_commit(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(db)
+    database = Database('db', aps)
+    tm = database.get_transaction_manager()
+    pool = PostgresqlAsyncJobPool({'table_name': 'test_jobs'})
+
+    txn = await tm.begin(request=request)
+    txn.register(create_content())
+    pool.add_job_after_commit(_durable_job, request=request, args=['foobar'])
+    await tm.commit(txn=txn)
+    # job is stored, not run in this process
+    assert pool.num_running == 0
+
+    txn = await tm.begin(request=request)
+    txn.register(create_content())
+    pool.add_job_after_commit(_durable_job, request=request, args=['aborted'])
+    await tm.abort(txn=txn)
+
+    conn = await aps.open()
+    assert await conn.fetchval('SELECT count(*) FROM test_jobs') == 1
+
+    assert await pool.run_pending(database) == 1
+    await pool.join()
+    assert _durable_jobs_run == ['foobar']
+
+    record = await conn.fetchrow('SELECT * FROM test_jobs')
+    assert record['status'] == 'finished'
+    assert record['attempts'] == 1
+    assert record['duration'] is not None
+
+    await conn.execute('DROP TABLE test_jobs')
+    await aps.close(conn)
+    await aps.remove()
+    await cleanup(aps)
+
+
+@pytest.mark.skipif(DATABASE in ('cockroachdb', 'DUMMY', 'sqlite'),
+                    reason='Cockroach does not support SKIP LOCKED')
+async def test_durable_job_pool_retries_failed_jobs(db, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    aps = await get_aps(db)
+    database = Database('db', aps)
+    tm = database.get_transaction_manager()
+    pool = PostgresqlAsyncJobPool({
+        'table_name': 'test_jobs',
+        'max_attempts': 2,
+        'backoff': 0
+    })
+
+    txn = await tm.begin(request=request)
+    txn.register(create_content())
+    pool.add_job_after_commit(_durable_job, args=['error'])
+    await tm.commit(txn=txn)
+
+    assert await pool.run_pending(database) == 1
+    await asyncio.sleep(0.1)
+
+    conn = await aps.open()
+    record = await conn.fetchrow('SELECT * FROM test_jobs')
+    assert record['status'] == 'pending'
+    assert record['attempts'] == 1
+    assert 'Job error' in record['error']
+
+    assert await pool.run_pending(database) == 1
+    await pool.join()
+    record = await conn.fetchrow('SELECT * FROM test_jobs')
+    assert record['status'] == 'failed'
+    assert record['attempts'] == 2
+
+    await conn.execute('DROP TABLE test_jobs')
+    await aps.close(conn)
+    await aps.remove()
+    await cleanup(aps)
@@ -1,10 +1,16 @@
+from guillotina.async_util import AsyncJobPool
 from guillotina.async_util import IAsyncJobPool
 from guillotina.async_util import IQueueUtility
+from guillotina.async_util import QueueUtility
 from guillotina.browser import View
 from guillotina.component import get_utility
+from guillotina.exceptions import JobPoolFullException
 from guillotina.tests import utils
+from guillotina.transactions import get_transaction
+from guillotina.utils import get_current_request
 
 import asyncio
+import pytest
 
 
 class AsyncMockView(View):
@@ -44,6 +50,84 @@ async def test_add_sync_utility(guillotina, loop):
     assert len(var) == 4
 
 
+async def test_queue_workers_keep_order_per_key(guillotina, loop):
+    util = QueueUtility({'workers': 3}, loop=loop)
+    task = asyncio.ensure_future(util.initialize())
+
+    running = []
+    max_running = []
+    var = []
+
+    async def add_value(key, value):
+        running.append(value)
+        max_running.append(len(running))
+        await asyncio.sleep(0.01 * (3 - value))
+        var.append((key, value))
+        running.remove(value)
+
+    requests = {key: utils.get_mocked_request(guillotina.db) for key in ('a', 'b')}
+    root = await utils.get_root(requests['a'])
+    for value in range(3):
+        for key in ('a', 'b'):
+            view = AsyncMockView(root, requests[key], add_value, key, value)
+            view.queue_key = key
+            await util.add(view)
+
+    await util.join()
+    for key in ('a', 'b'):
+        assert [v for k, v in var if k == key] == [0, 1, 2]
+    assert max(max_running) > 1
+    metrics = util.get_metrics()
+    assert metrics['processed'] == 6
+    assert metrics['queued'] == 0
+    task.cancel()
+    await asyncio.wait([task])
+
+
+async def test_queued_views_run_in_their_own_transaction(guillotina, loop):
+    util = QueueUtility({'max_origin_wait': 5}, loop=loop)
+    task = asyncio.ensure_future(util.initialize())
+
+    request = utils.get_mocked_request(guillotina.db)
+    root = await utils.get_root(request)
+    txn = await request._tm.begin(request)
+    seen = []
+
+    async def record():
+        view_request = get_current_request()
+        seen.append((view_request is request, get_transaction(view_request) is txn))
+
+    await util.add(AsyncMockView(root, request, record))
+    await asyncio.sleep(0.1)
+    # waits until the transaction of the request that queued the view is done
+    assert seen == []
+    await request._tm.commit(txn=txn)
+    await util.join()
+    assert seen == [(False, False)]
+    task.cancel()
+    await asyncio.wait([task])
+
+
+async def test_queued_views_do_not_wait_forever_for_the_origin(guillotina, loop):
+    util = QueueUtility({'max_origin_wait': 0.1}, loop=loop)
+    task = asyncio.ensure_future(util.initialize())
+
+    request = utils.get_mocked_request(guillotina.db)
+    root = await utils.get_root(request)
+    txn = await request._tm.begin(request)
+    var = []
+
+    async def add_value(value):
+        var.append(value)
+
+    await util.add(AsyncMockView(root, request, add_value, 'foobar'))
+    await util.join()
+    assert var == ['foobar']
+    await request._tm.abort(txn=txn)
+    task.cancel()
+    await asyncio.wait([task])
+
+
 class JobRunner:
 
     def __init__(self):
@@ -86,3 +170,106 @@ async def test_run_many_jobs(guillotina, dummy_request):
 
     for job in jobs:
         assert job.func.done
+
+
+async def test_jobs_with_higher_priority_run_first(dummy_guillotina):
+    pool = AsyncJobPool({
+        'max_size': 1,
+        'job_classes': {
+            'reindex': {'max_size': 1, 'priority': 0},
+            'cache': {'max_size': 1, 'priority': 10}
+        }
+    })
+    blocker = JobRunner()
+    pool.add_job(blocker, args=['foobar'])
+    order = []
+
+    async def record(value):
+        order.append(value)
+
+    pool.add_job(record, args=['reindex'], kind='reindex')
+    pool.add_job(record, args=['cache'], kind='cache')
+    pool.add_job(record, args=['urgent'], kind='reindex', priority=20)
+    assert pool.num_pending == 3
+
+    blocker.wait = False
+    await pool.join()
+    assert order == ['urgent', 'cache', 'reindex']
+
+
+async def test_job_class_concurrency_limit(dummy_guillotina):
+    pool = AsyncJobPool({
+        'max_size': 5,
+        'job_classes': {
+            'reindex': {'max_size': 1}
+        }
+    })
+    reindex_jobs = [pool.add_job(JobRunner(), args=['foobar'], kind='reindex')
+                    for _ in range(3)]
+    cache_job = pool.add_job(JobRunner(), args=['foobar'], kind='cache')
+    assert pool.num_running == 2
+    assert pool.num_pending == 2
+    metrics = pool.get_metrics()
+    assert metrics['reindex']['running'] == 1
+    assert metrics['reindex']['queued'] == 2
+    assert metrics['cache']['running'] == 1
+
+    for job in reindex_jobs + [cache_job]:
+        job.func.wait = False
+    await pool.join()
+    metrics = pool.get_metrics()
+    assert metrics['reindex']['finished'] == 3
+    assert metrics['reindex']['queued'] == 0
+    assert metrics['cache']['finished'] == 1
+
+
+async def test_dedup_jobs(dummy_guillotina):
+    pool = AsyncJobPool({'max_size': 1})
+    blocker = pool.add_job(JobRunner(), args=['foobar'])
+    job1 = pool.add_job(JobRunner(), args=['foobar'], dedup_key='reindex-foobar')
+    job2 = pool.add_job(JobRunner(), args=['foobar'], dedup_key='reindex-foobar')
+    assert job1 is job2
+    assert pool.num_pending == 1
+    blocker.func.wait = job1.func.wait = False
+    await pool.join()
+
+
+async def test_max_pending_jobs(dummy_guillotina):
+    pool = AsyncJobPool({'max_size': 1, 'max_pending': 1})
+    blocker = pool.add_job(JobRunner(), args=['foobar'])
+    job = pool.add_job(JobRunner(), args=['foobar'])
+    with pytest.raises(JobPoolFullException):
+        pool.add_job(JobRunner(), args=['foobar'])
+
+    waiter = asyncio.ensure_future(pool.wait_for_space())
+    await asyncio.sleep(0.05)
+    assert not waiter.done()
+    blocker.func.wait = False
+    await asyncio.wait_for(waiter, 1)
+    job.func.wait = False
+    await pool.join()
+
+
+async def test_after_commit_jobs_do_not_wait_forever(dummy_guillotina):
+    pool = AsyncJobPool({'max_size': 1, 'max_pending': 1, 'max_pending_wait': 0.05})
+    blocker = pool.add_job(JobRunner(), args=['foobar'])
+    job = pool.add_job(JobRunner(), args=['foobar'])
+    runner = JobRunner()
+    runner.wait = False
+    await asyncio.wait_for(pool._add_job_after_commit(True, runner, args=['foobar']), 1)
+    # queued over the limit
+    assert pool.num_pending == 2
+    blocker.func.wait = job.func.wait = False
+    await pool.join()
+    assert runner.done
+
+
+async def test_failed_jobs_are_counted(dummy_guillotina):
+    pool = AsyncJobPool({'max_size': 1})
+
+    async def fail():
+        raise Exception('foobar')
+
+    pool.add_job(fail)
+    await pool.join()
+    assert pool.get_metrics()['default']['failed'] == 1
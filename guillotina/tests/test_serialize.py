@@ -6,17 +6,25 @@ from guillotina.component import get_multi_adapter
 from guillotina.exceptions import ValueDeserializationError
 from guillotina.files.dbfile import DBFile
 from guillotina.interfaces import IJSONToValue
+from guillotina.interfaces import IResource
 from guillotina.interfaces import IResourceDeserializeFromJson
 from guillotina.interfaces import IResourceSerializeToJson
+from guillotina.interfaces.security import Allow
 from guillotina.json import deserialize_value
 from guillotina.json.deserialize_value import schema_compatible
 from guillotina.json.serialize_value import json_compatible
+from guillotina.renderers import fast_json_dumps
+from guillotina.renderers import json_dumps
+from guillotina.renderers import RendererJson
 from guillotina.schema.exceptions import WrongType
 from guillotina.tests import mocks
 from guillotina.tests.utils import create_content
 from guillotina.tests.utils import login
+from unittest import mock
 from zope.interface import Interface
 
+import json
+
 
 async def test_serialize_resource(dummy_request):
     content = create_content()
@@ -854,3 +862,48 @@ async def test_delete_by_value_field(dummy_request):
         }, errors)
     assert len(errors) == 1
     assert errors[0]['field'] == 'patch_list_int'
+
+
+def test_fast_json_dumps_renders_like_json_dumps():
+    value = {
+        'date': datetime(2018, 12, 27, 10, 30),
+        'permission': Allow,
+        'interface': IResource,
+        'tags': {'foo'},
+        'items': [{'title': 'Foo/bar', 'size': 1.5, 'count': None}]
+    }
+    assert json.loads(fast_json_dumps(value)) == json.loads(json_dumps(value))
+
+    # values of other types are left to GuillotinaJSONEncoder
+    value = {'big': 2 ** 70, 'tuple': (1, 2)}
+    assert json.loads(fast_json_dumps(value)) == json.loads(json_dumps(value))
+
+
+def test_fast_json_dumps_does_not_round_floats():
+    value = {'items': [{'size': 0.1 + 0.2}, {'size': 1e-05}, {'size': 1.0}]}
+    assert json.loads(fast_json_dumps(value)) == value
+
+
+def test_fast_json_dumps_encodes_exact_floats_with_ujson():
+    value = {'items': [{'price': 10.25}, {'location': [41.3874, 2.1686]}]}
+    with mock.patch('guillotina.renderers.json_dumps') as fallback:
+        assert json.loads(fast_json_dumps(value)) == value
+    assert not fallback.called
+
+
+async def test_render_streamed_json(dummy_request):
+    async def _items():
+        for idx in range(3):
+            yield {'id': f'foobar{idx}', 'date': datetime(2018, 12, 27)}
+
+    renderer = RendererJson(None, dummy_request)
+    body = b''.join([chunk async for chunk in renderer.iter_body({
+        'items': _items(),
+        'total': 3
+    })])
+    assert json.loads(body) == {
+        'items': [{
+            'id': f'foobar{idx}', 'date': '2018-12-27T00:00:00'
+        } for idx in range(3)],
+        'total': 3
+    }
@@ -0,0 +1,158 @@
+from guillotina.content import Folder
+from guillotina.db.storages.sqlite import SQLiteStorage
+from guillotina.db.transaction_manager import TransactionManager
+from guillotina.exceptions import ConflictIdOnContainer
+from guillotina.exceptions import TIDConflictError
+from guillotina.tests.utils import create_content
+from unittest import mock
+
+import os
+import pytest
+import ujson
+
+
+async def get_storage(tmpdir, **kwargs):
+    storage = SQLiteStorage(filename=os.path.join(str(tmpdir), 'g.sqlite'), **kwargs)
+    await storage.initialize()
+    return storage
+
+
+async def test_stores_and_loads_objects_after_restart(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = await get_storage(tmpdir)
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    item = create_content(parent=folder)
+    item.title = 'Foobar'
+    txn.register(item)
+    await tm.commit(txn=txn)
+    await storage.finalize()
+    # do not reuse the transaction of the closed storage
+    request._txn = None
+
+    storage = await get_storage(tmpdir)
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    ob = await txn.get(item._p_oid)
+    assert ob.title == 'Foobar'
+    assert await txn.contains(folder._p_oid, item.id)
+    assert await txn.len(folder._p_oid) == 1
+    assert [key for key in await txn.keys(folder._p_oid)] == [item.id]
+    children = [child async for child in txn.get_children(folder, [item.id])]
+    assert children[0]._p_oid == item._p_oid
+    assert await storage.get_total_resources_of_type(txn, 'Item') == 1
+    await tm.abort(txn=txn)
+
+    # tids keep increasing after a restart
+    assert await storage.get_next_tid(None) > item._p_serial
+    await storage.finalize()
+
+
+async def test_changes_of_a_transaction_are_written_at_commit(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = await get_storage(tmpdir)
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    await storage.write_blob_chunk(txn, 'bid', folder._p_oid, 0, b'foobar')
+    assert (await storage.read_blob_chunk(txn, 'bid', 0))['data'] == b'foobar'
+    await tm.abort(txn=txn)
+
+    txn = await tm.begin()
+    assert await storage.read_blob_chunk(txn, 'bid', 0) is None
+    with pytest.raises(KeyError):
+        await txn.get(folder._p_oid)
+    await tm.abort(txn=txn)
+    await storage.finalize()
+
+
+async def test_json_is_updated_for_unchanged_objects(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = await get_storage(tmpdir)
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    await tm.commit(txn=txn)
+
+    # the json also depends on annotations, behaviors and parents
+    txn = await tm.begin()
+    ob = await txn.get(folder._p_oid)
+    ob._p_register()
+
+    async def get_json(writer):
+        return {'title': 'Reindexed'}
+
+    with mock.patch('guillotina.db.writer.ResourceWriter.get_json', get_json):
+        await tm.commit(txn=txn)
+    assert txn._skipped == 1
+    json = await storage.fetchval('SELECT json FROM objects WHERE zoid = ?', folder._p_oid)
+    assert ujson.loads(json) == {'title': 'Reindexed'}
+    await storage.finalize()
+
+
+async def test_deleting_parent_deletes_children_and_blobs(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = await get_storage(tmpdir)
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    item = create_content(parent=folder)
+    txn.register(item)
+    await storage.write_blob_chunk(txn, 'bid', item._p_oid, 0, b'foobar')
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    folder._p_jar = txn
+    txn.delete(folder)
+    await tm.commit(txn=txn)
+
+    txn = await tm.begin()
+    with pytest.raises(KeyError):
+        await txn.get(item._p_oid)
+    assert await storage.read_blob_chunk(txn, 'bid', 0) is None
+    await tm.abort(txn=txn)
+    await storage.finalize()
+
+
+async def test_concurrent_changes_conflict(tmpdir, dummy_request):
+    request = dummy_request  # noqa so magically get_current_request can find
+
+    storage = await get_storage(tmpdir)
+    tm = TransactionManager(storage)
+    txn = await tm.begin()
+    folder = create_content(Folder, 'Folder')
+    txn.register(folder)
+    await tm.commit(txn=txn)
+
+    txn1 = await tm.begin()
+    txn2 = await tm.begin()
+    ob1 = await txn1.get(folder._p_oid)
+    ob2 = await txn2.get(folder._p_oid)
+    ob1.title = 'foobar1'
+    ob2.title = 'foobar2'
+    txn1.register(ob1)
+    txn2.register(ob2)
+    await tm.commit(txn=txn1)
+    with pytest.raises(TIDConflictError):
+        await tm.commit(txn=txn2)
+
+    txn = await tm.begin()
+    assert (await txn.get(folder._p_oid)).title == 'foobar1'
+
+    # ids are unique in a folder
+    item1 = create_content(id='foobar', parent=folder)
+    txn.register(item1)
+    item2 = create_content(id='foobar', parent=folder)
+    txn.register(item2)
+    with pytest.raises(ConflictIdOnContainer):
+        await tm.commit(txn=txn)
+    await storage.finalize()
@@ -1,6 +1,12 @@
+from guillotina._settings import app_settings
+from guillotina.api.files import get_static_file_variant
+from guillotina.api.files import static_file_cache
 from guillotina.component import get_utility
 from guillotina.interfaces import IApplication
 
+import hashlib
+import os
+
 
 def test_get_static_folder(dummy_guillotina):
     root = get_utility(IApplication, name='root')
@@ -52,3 +58,81 @@ async def test_render_module_static_default_directory_file(container_requester):
         response, status = await requester('GET', '/module_static/tests')
         assert status == 200
         assert response.decode('utf8').strip() == 'foobar'
+
+
+async def test_static_file_not_modified(container_requester):
+    async with container_requester as requester:
+        _, status, headers = await requester.make_request(
+            'GET', '/static/tests/teststatic.txt')
+        assert status == 200
+        etag = headers['ETag']
+
+        _, status, _ = await requester.make_request(
+            'GET', '/static/tests/teststatic.txt',
+            headers={'If-None-Match': etag})
+        assert status == 304
+        _, status, _ = await requester.make_request(
+            'GET', '/static/tests/teststatic.txt',
+            headers={'If-Modified-Since': headers['Last-Modified']})
+        assert status == 304
+        _, status, _ = await requester.make_request(
+            'GET', '/static/tests/teststatic.txt',
+            headers={'If-None-Match': '"foobar"'})
+        assert status == 200
+
+
+async def test_static_file_served_from_cache_and_disk(container_requester, monkeypatch):
+    async with container_requester as requester:
+        static_file_cache.clear()
+        filepath = os.path.join(os.path.dirname(__file__), 'resources', 'plone.png')
+        with open(filepath, 'rb') as fi:
+            data = fi.read()
+
+        response, status = await requester('GET', '/static/tests/resources/plone.png')
+        assert status == 200
+        assert response == data
+        assert filepath in static_file_cache._data
+
+        # bigger files are sent with sendfile
+        static_file_cache.clear()
+        monkeypatch.setitem(app_settings['static_cache'], 'max_file_size', 1024)
+        response, status, headers = await requester.make_request(
+            'GET', '/static/tests/resources/plone.png')
+        assert status == 200
+        assert response == data
+        assert headers['Content-Type'] == 'image/png'
+        assert headers['Content-Disposition'] == 'attachment; filename="plone.png"'
+        assert filepath not in static_file_cache._data
+
+
+async def test_static_file_headers_match_the_data_sent(container_requester, monkeypatch):
+    async with container_requester as requester:
+        static_file_cache.clear()
+        # the file changed after it was stat
+        monkeypatch.setattr('guillotina.api.files._read', lambda filepath: b'changed data')
+        response, status, headers = await requester.make_request(
+            'GET', '/static/tests/teststatic.txt')
+        assert status == 200
+        assert response == b'changed data'
+        assert headers['Content-Length'] == str(len(b'changed data'))
+        assert headers['ETag'] == '"{}"'.format(hashlib.md5(b'changed data').hexdigest())
+
+        _, status, _ = await requester.make_request(
+            'GET', '/static/tests/teststatic.txt',
+            headers={'If-None-Match': headers['ETag']})
+        assert status == 304
+        static_file_cache.clear()
+
+
+def test_static_file_variant(tmpdir):
+    filepath = os.path.join(str(tmpdir), 'app.js')
+    for path in (filepath, filepath + '.gz', filepath + '.br'):
+        with open(path, 'wb') as fi:
+            fi.write(b'foobar')
+
+    assert get_static_file_variant(filepath)[:2] == (filepath, None)
+    assert get_static_file_variant(filepath, 'gzip, deflate')[:2] == (filepath + '.gz', 'gzip')
+    assert get_static_file_variant(filepath, 'gzip, br')[:2] == (filepath + '.br', 'br')
+    assert get_static_file_variant(filepath, 'gzip, br;q=0')[:2] == (filepath + '.gz', 'gzip')
+    os.remove(filepath + '.gz')
+    assert get_static_file_variant(filepath, 'gzip')[:2] == (filepath, None)
@@ -59,7 +59,7 @@ async def test_delete_database(container_requester):
         assert 'foobar' not in response['databases']
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_storage_impl(db, guillotina_main):
     storages = app_settings['storages']
     storage_config = storages['db']
@@ -73,7 +73,7 @@ async def test_storage_impl(db, guillotina_main):
     assert len(await factory.get_names()) == original_size
 
 
-@pytest.mark.skipif(DATABASE == 'DUMMY', reason='Not for dummy db')
+@pytest.mark.skipif(DATABASE in ('DUMMY', 'sqlite'), reason='Not for dummy db')
 async def test_storage_exists(db, guillotina_main):
     storages = app_settings['storages']
     storage_config = storages['db']
@@ -43,3 +43,37 @@ async def test_managed_transaction_with_adoption(container_requester):
         async with managed_transaction(request=request, abort_when_done=True):
             container = await root.async_get('guillotina')
             assert container.title == 'changed title'
+
+
+async def test_unchanged_objects_are_not_written(container_requester):
+    async with container_requester as requester:
+        request = utils.get_mocked_request(requester.db)
+        root = await utils.get_root(request)
+        async with managed_transaction(request=request, write=True) as txn:
+            container = await root.async_get('guillotina')
+            container.title = 'changed title'
+            container._p_register()
+        assert txn._skipped == 0
+
+        async with managed_transaction(request=request, write=True) as txn:
+            container = await root.async_get('guillotina')
+            container._p_register()
+        assert txn._skipped == 1
+
+        async with managed_transaction(request=request, write=True) as txn:
+            container = await root.async_get('guillotina')
+            # moving only changes the location of the object
+            container.__name__ = 'guillotina'
+            container._p_register()
+        assert txn._skipped == 0
+
+        async with managed_transaction(request=request, abort_when_done=True):
+            container = await root.async_get('guillotina')
+            assert container.title == 'changed title'
+
+
+async def test_skipped_writes_in_debug_headers(container_requester):
+    async with container_requester as requester:
+        _, _, headers = await requester.make_request(
+            'GET', '/db/guillotina', headers={'X-Debug': '1'})
+        assert headers['XG-Request-Skipped-writes'] == '0'
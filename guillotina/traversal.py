@@ -22,6 +22,8 @@ from guillotina.component import query_adapter
 from guillotina.component import query_multi_adapter
 from guillotina.contentnegotiation import get_acceptable_content_types
 from guillotina.contentnegotiation import get_acceptable_languages
+from guillotina.db import READ_LSN_COOKIE
+from guillotina.db import READ_LSN_HEADER
 from guillotina.event import notify
 from guillotina.events import BeforeRenderViewEvent
 from guillotina.events import ObjectLoadedEvent
@@ -29,6 +31,7 @@ from guillotina.events import TraversalResourceMissEvent
 from guillotina.events import TraversalRouteMissEvent
 from guillotina.events import TraversalViewMissEvent
 from guillotina.exceptions import ConflictError
+from guillotina.exceptions import PoolExhaustedError
 from guillotina.exceptions import TIDConflictError
 from guillotina.i18n import default_message_factory as _
 from guillotina.interfaces import ACTIVE_LAYERS_KEY
@@ -50,6 +53,8 @@ from guillotina.interfaces import IResource
 from guillotina.interfaces import ITraversable
 from guillotina.profile import profilable
 from guillotina.registry import REGISTRY_DATA_KEY
+from guillotina.renderers import collect_streamed
+from guillotina.renderers import is_streamed
 from guillotina.response import HTTPBadRequest
 from guillotina.response import HTTPMethodNotAllowed
 from guillotina.response import HTTPNotFound
@@ -198,6 +203,8 @@ class BaseMatchInfo(AbstractMatchInfo):
                     resp.headers['XG-Total-Cache-hits'] = str(txn._manager._storage._hits)
                     resp.headers['XG-Total-Cache-misses'] = str(txn._manager._storage._misses)
                     resp.headers['XG-Total-Cache-stored'] = str(txn._manager._storage._stored)
+                    resp.headers['XG-Request-Skipped-writes'] = str(txn._skipped)
+                    resp.headers['XG-Total-Skipped-writes'] = str(txn._manager._storage._skipped)
                     resp.headers['XG-Num-Queries'] = str(
                         txn._query_count_end - txn._query_count_start)
                     for idx, query in enumerate(txn._queries.keys()):
@@ -238,6 +245,16 @@ async def _apply_cors(request, resp):
     return resp
 
 
+def _apply_read_lsn(request, resp):
+    # let the client tell us which commit it needs to see on read replicas
+    txn = getattr(request, '_txn', None)
+    lsn = getattr(txn, '_commit_lsn', None)
+    if lsn is None or resp.prepared:
+        return
+    resp.headers[READ_LSN_HEADER] = lsn
+    resp.set_cookie(READ_LSN_COOKIE, lsn, httponly=True)
+
+
 class MatchInfo(BaseMatchInfo):
     """Function that returns from traversal request on aiohttp."""
 
@@ -253,11 +270,12 @@ class MatchInfo(BaseMatchInfo):
         request._view_error = False
         await notify(BeforeRenderViewEvent(request, self.view))
         request.record('viewrender')
-        if app_settings['check_writable_request'](request):
+        write = app_settings['check_writable_request'](request)
+        if write:
             try:
                 # We try to avoid collisions on the same instance of
                 # guillotina
-                view_result = await self.view()
+                view_result = await self._call_view(write)
                 await commit(request, warn=False)
             except (ConflictError, TIDConflictError):
                 # bubble this error up
@@ -273,7 +291,7 @@ class MatchInfo(BaseMatchInfo):
                 request._view_error = True
         else:
             try:
-                view_result = await self.view()
+                view_result = await self._call_view(write)
             except (response.Response, aiohttp.web_exceptions.HTTPException) as exc:
                 view_result = exc
                 request._view_error = True
@@ -291,6 +309,9 @@ class MatchInfo(BaseMatchInfo):
             request.record('renderer')
             resp = await _apply_cors(request, resp)
 
+        if write and not request._view_error:
+            _apply_read_lsn(request, resp)
+
         if not request._view_error:
             request.execute_futures()
         else:
@@ -303,6 +324,18 @@ class MatchInfo(BaseMatchInfo):
         request.clear_futures()
         return resp
 
+    async def _call_view(self, write):
+        view_result = await self.view()
+        if is_streamed(view_result):
+            if write:
+                # the response can only be sent once the commit succeeded
+                view_result = await collect_streamed(view_result)
+            else:
+                # streamed values are iterated while the transaction is open
+                view_result = await apply_rendering(
+                    self.view, self.request, view_result)
+        return view_result
+
     def get_info(self):
         return {
             'request': self.request,
@@ -396,6 +429,8 @@ class TraversalRouter(AbstractRouter):
         except ConflictError:
             # can also happen from connection errors so we bubble this...
             raise
+        except PoolExhaustedError as exc:
+            raise generate_error_response(exc, request, 'ServiceUnavailable')
         except Exception as _exc:
             logger.error('Unhandled exception occurred', exc_info=True)
             request.resource = request.tail = None
@@ -0,0 +1,54 @@
+from guillotina.annotations import AnnotationData
+from guillotina.content import create_content
+from guillotina.db.codec import decode_state
+from guillotina.db.codec import encode_state
+
+import pickle
+import time
+
+
+ITERATIONS = 100
+
+# ----------------------------------------------------
+# Measure size and speed of the state codecs
+#
+# Lessons:
+#   - zlib level 1 shrinks bucket list annotations to a fraction of their
+#     size, small content states gain little and are left uncompressed
+#     below the `compress_threshold` of the `state_codec` setting
+# ----------------------------------------------------
+
+
+async def get_objects():
+    item = await create_content('Item', id='foobar', title='Foobar')
+    folder = await create_content('Folder', id='foobar', title='Foobar')
+    bucket = AnnotationData()
+    bucket.update({
+        'items': [{
+            'id': f'foobar{idx}',
+            'title': 'Foobar',
+            'tags': ['foo', 'bar']
+        } for idx in range(5000)]
+    })
+    return [('Item', item), ('Folder', folder), ('Bucket list annotation', bucket)]
+
+
+async def run1():
+    for name, ob in await get_objects():
+        pickled = pickle.dumps(ob, protocol=pickle.HIGHEST_PROTOCOL)
+        for codec in ('pickle', 'zlib'):
+            print(f'Test {codec} codec with {name}')
+            start = time.time()
+            for _ in range(ITERATIONS):
+                state = encode_state(pickled, codec=codec)
+            encoded = time.time()
+            for _ in range(ITERATIONS):
+                decode_state(state)
+            end = time.time()
+            print(f'Ratio {len(state) / len(pickled):.3f} of {len(pickled)} bytes, '
+                  f'encode {encoded - start} and decode {end - encoded} seconds '
+                  f'for {ITERATIONS}')
+
+
+async def run():
+    await run1()
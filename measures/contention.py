@@ -0,0 +1,76 @@
+from guillotina.content import Folder
+from guillotina.db.storages.mvcc import MVCCStorage
+from guillotina.db.transaction_manager import TransactionManager
+from guillotina.exceptions import ConflictError
+from guillotina.tests.utils import create_content
+from guillotina.tests.utils import get_mocked_request
+
+import asyncio
+import time
+
+
+WORKERS = 20
+ITERATIONS = 20
+ATTEMPTS = 10
+LATENCY = 0.001
+LATENCY_JITTER = 0.001
+
+# ----------------------------------------------------
+# Measure throughput of concurrent writes with conflicts and retries
+# against the in-memory mvcc storage
+#
+# Lessons:
+#   - with all workers changing the same object most commits are retried
+#     and about half give up after ATTEMPTS, throughput drops tenfold
+#   - with one object per worker only workers drifting onto the object of
+#     another one conflict, simple retries more than resolve and writeset
+# ----------------------------------------------------
+
+
+async def worker(tm, oids, stats, offset):
+    request = get_mocked_request()  # noqa so magically get_current_request can find
+    for idx in range(ITERATIONS):
+        oid = oids[(offset + idx) % len(oids)]
+        for _ in range(ATTEMPTS):
+            txn = await tm.begin(request=request)
+            try:
+                ob = await txn.get(oid)
+                ob.title = f'{id(request)} {idx}'
+                txn.register(ob)
+                await tm.commit(txn=txn)
+                stats['commits'] += 1
+                break
+            except ConflictError:
+                stats['retries'] += 1
+                await tm.abort(txn=txn)
+        else:
+            stats['failed'] += 1
+
+
+async def runner(strategy, num_objects):
+    request = get_mocked_request()  # noqa so magically get_current_request can find
+    storage = MVCCStorage(transaction_strategy=strategy, latency=LATENCY,
+                          latency_jitter=LATENCY_JITTER)
+    tm = TransactionManager(storage)
+    txn = await tm.begin(request=request)
+    oids = []
+    for _ in range(num_objects):
+        folder = create_content(Folder, 'Folder')
+        txn.register(folder)
+        oids.append(folder._p_oid)
+    await tm.commit(txn=txn)
+
+    print(f'Test {WORKERS} workers changing {num_objects} objects with {strategy} strategy')
+    stats = {'commits': 0, 'retries': 0, 'failed': 0}
+    start = time.time()
+    await asyncio.gather(*[worker(tm, oids, stats, offset) for offset in range(WORKERS)])
+    end = time.time()
+    print(f'Done with {stats["commits"]} commits, {stats["retries"]} retries and '
+          f'{stats["failed"]} failed in {end - start} seconds, '
+          f'{stats["commits"] / (end - start):.1f} commits per second\n')
+
+
+async def run():
+    for strategy in ('resolve', 'simple', 'writeset'):
+        await runner(strategy, 1)
+        await runner(strategy, WORKERS)
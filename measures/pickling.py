@@ -1,6 +1,7 @@
 from guillotina.component import get_adapter
 from guillotina.content import create_content
 from guillotina.db.interfaces import IWriter
+from guillotina.db.reader import ghost_reader
 from guillotina.db.reader import reader
 
 import time
@@ -16,6 +17,8 @@ ITERATIONS = 100000
 #   - BaseObject was too complex and unnecessary logic for what we are using.
 #       - Simplifying provides 4x speed improvements for deserialization
 #       - 2x speed improvements for serializing
+#   - Ghost objects only read the class out of the pickle so listings that
+#     use the name, type and uuid of children skip unpickling their state
 # ---------------------------------------------------------
 
 
@@ -55,6 +58,31 @@ async def run2():
     print(f'Done with {ITERATIONS} in {end - start} seconds')
 
 
+async def run3():
+    print('Test ghost deserialize content from db')
+    ob = await create_content('TestContent6', id='foobar')
+    ob.foobar1 = '1'
+    ob.foobar2 = '2'
+    ob.foobar6 = '6'
+    start = time.time()
+    writer = get_adapter(ob, IWriter)
+    serialized = writer.serialize()
+    for _ in range(ITERATIONS):
+        ob = ghost_reader({
+            'state': serialized,
+            'zoid': 0,
+            'tid': 0,
+            'id': 'foobar',
+            'type': 'TestContent6'
+        })
+        ob.type_name
+    end = time.time()
+    assert ob.foobar1 == '1'
+    assert ob.foobar6 == '6'
+    print(f'Done with {ITERATIONS} in {end - start} seconds')
+
+
 async def run():
     await run1()
     await run2()
+    await run3()
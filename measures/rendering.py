@@ -0,0 +1,94 @@
+from datetime import datetime
+from guillotina.component import get_multi_adapter
+from guillotina.content import create_content
+from guillotina.interfaces import IResource
+from guillotina.interfaces import IResourceSerializeToJson
+from guillotina.interfaces.security import Allow
+from guillotina.renderers import fast_json_dumps
+from guillotina.renderers import json_dumps
+from guillotina.tests import mocks
+from guillotina.utils import get_current_request
+
+import time
+
+
+ITEMS = 1000
+ITERATIONS = 20
+
+# ----------------------------------------------------
+# Measure encoding of large @items responses with the json module and
+# GuillotinaJSONEncoder against ujson with the fast path
+#
+# Measured with ujson 1.35 as pinned in requirements.txt, which has no hook
+# for other types: fast_json_dumps converts the whole value with a python
+# pass (_normalize) before ujson encodes it
+#
+# Lessons:
+#   - serialized content is mostly strings and integers, the python pass
+#     and ujson together take about 60% of the time of the json module
+#   - values of other types, like datetimes and interfaces, cost a python
+#     call each in the pass and with the json encoder hook and ujson ends
+#     up about 5% slower, the serializers should keep returning native values
+#   - ujson 1.35 rounds floats to 15 decimals, they are checked one by one
+#     and only values with floats it would round are encoded with the json
+#     module
+# ----------------------------------------------------
+
+
+def runit(name, payload):
+    print(f'Test encoding {name}')
+    for dumps in (json_dumps, fast_json_dumps):
+        start = time.time()
+        for _ in range(ITERATIONS):
+            body = dumps(payload)
+        end = time.time()
+        print(f'{dumps.__name__}: {ITERATIONS} of {len(body)} bytes in {end - start} seconds')
+    print()
+
+
+async def run():
+    request = get_current_request()
+    request._db_id = 'db'
+    txn = mocks.MockTransaction()
+    items = []
+    for idx in range(ITEMS):
+        ob = await create_content('Item', id=f'foobar{idx}')
+        ob._p_jar = txn
+        ob.title = f'Foobar {idx}'
+        serializer = get_multi_adapter((ob, request), IResourceSerializeToJson)
+        items.append(await serializer())
+
+    runit(f'@items with {ITEMS} serialized items', {
+        '@id': 'http://localhost/db/container/@items',
+        'items': items,
+        'total': ITEMS
+    })
+    runit(f'@items with {ITEMS} items with types for the encoder hook', {
+        '@id': 'http://localhost/db/container/@items',
+        'items': [{
+            'id': item['@id'],
+            'creation_date': datetime.utcnow(),
+            'modification_date': datetime.utcnow(),
+            'permission': Allow,
+            'provides': IResource,
+            'tags': {'foo', 'bar'}
+        } for item in items],
+        'total': ITEMS
+    })
+    runit(f'@items with {ITEMS} items with floats', {
+        '@id': 'http://localhost/db/container/@items',
+        'items': [{
+            'id': item['@id'],
+            'price': idx + 0.25,
+            'location': [41.3874, 2.1686]
+        } for idx, item in enumerate(items)],
+        'total': ITEMS
+    })
+    runit(f'@items with {ITEMS} items with floats ujson 1.35 rounds', {
+        '@id': 'http://localhost/db/container/@items',
+        'items': [{
+            'id': item['@id'],
+            'ratio': idx / 7
+        } for idx, item in enumerate(items)],
+        'total': ITEMS
+    })